@@ -0,0 +1,209 @@
+"""
+准入控制中间件
+
+早高峰流量超过数据库连接池时，请求会在 get_db 里排队直到连接池超时，所有接口一起变慢。
+这里在进入路由之前按路由类别限制并发：
+
+- interactive：患者/医生/预约的增删改查（挂号要保证响应）
+- report：仪表盘、统计报表（单个请求慢，限制少量并发）
+- export：提交后台任务（导出、查重）和下载任务结果（最慢，并发最少）；查询任务进度仍为 interactive
+
+每个类别最多 limit 个请求同时处理，超出的在有界队列中等待；
+队列已满或等待超过 ADMISSION_QUEUE_TIMEOUT 秒时立即返回 503 和 Retry-After，
+而不是占着连接等到超时。各类别的当前并发、排队和拒绝次数见 /metrics。
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# (请求方法, 路由前缀, 类别)，按顺序匹配；方法为 None 时匹配所有方法，前缀中的 * 匹配一段路径。
+# /api 下其余路由为 interactive，/api 以外不限制
+ROUTE_CLASSES: List[Tuple[Optional[str], str, str]] = [
+    (None, "/api/dashboard", "report"),
+    (None, "/api/reports", "report"),
+    ("POST", "/api/jobs", "export"),
+    ("GET", "/api/jobs/*/result", "export"),
+]
+DEFAULT_ROUTE_CLASS = "interactive"
+LIMITED_PREFIX = "/api"
+
+# 各类别的 (并发上限, 队列长度, Retry-After 秒数)
+DEFAULT_LIMITS = {
+    "interactive": (10, 50, 1),
+    "report": (3, 6, 5),
+    "export": (2, 2, 30),
+}
+
+# 在队列中最多等待的时间（秒）
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5"))
+# 设为 0 关闭准入控制
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1").lower() not in ("0", "false", "no")
+
+
+class ConcurrencyLimiter:
+    """单个类别的并发上限 + 有界等待队列"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, retry_after: int,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+        self.active = 0
+        self.waiting = 0
+        self.peak_active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+
+    async def acquire(self) -> bool:
+        """获得处理名额返回 True；队列已满或等待超时返回 False"""
+        # 在事件循环中首次使用时创建（信号量绑定事件循环；测试中每个客户端一个事件循环）
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+            self.active = self.waiting = 0
+        semaphore = self._semaphore
+        if not semaphore.locked():
+            await semaphore.acquire()
+        else:
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+                self.total_wait_seconds += time.monotonic() - started
+
+        self.active += 1
+        self.admitted += 1
+        self.peak_active = max(self.peak_active, self.active)
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "peak_active": self.peak_active,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "total_wait_seconds": round(self.total_wait_seconds, 3),
+        }
+
+
+def build_limiters() -> Dict[str, ConcurrencyLimiter]:
+    """按环境变量 ADMISSION_<类别>_LIMIT / _QUEUE / _RETRY_AFTER 创建各类别的限流器"""
+    limiters = {}
+    for name, (limit, queue_size, retry_after) in DEFAULT_LIMITS.items():
+        prefix = f"ADMISSION_{name.upper()}"
+        limiters[name] = ConcurrencyLimiter(
+            name,
+            int(os.getenv(f"{prefix}_LIMIT", str(limit))),
+            int(os.getenv(f"{prefix}_QUEUE", str(queue_size))),
+            int(os.getenv(f"{prefix}_RETRY_AFTER", str(retry_after))),
+        )
+    return limiters
+
+
+route_limiters = build_limiters()
+
+
+def _matches(prefix: str, segments: List[str]) -> bool:
+    pattern = prefix.strip("/").split("/")
+    return len(segments) >= len(pattern) and all(
+        part == "*" or part == segment for part, segment in zip(pattern, segments)
+    )
+
+
+def classify(path: str, route_classes: Sequence[Tuple[Optional[str], str, str]] = ROUTE_CLASSES,
+             method: str = "GET") -> Optional[str]:
+    """返回请求所属类别，不受限制的路径返回 None"""
+    segments = path.strip("/").split("/")
+    for route_method, prefix, name in route_classes:
+        if (route_method is None or route_method == method) and _matches(prefix, segments):
+            return name
+    if path == LIMITED_PREFIX or path.startswith(LIMITED_PREFIX + "/"):
+        return DEFAULT_ROUTE_CLASS
+    return None
+
+
+class AdmissionControlMiddleware:
+    """按路由类别做准入控制的 ASGI 中间件"""
+
+    def __init__(self, app: ASGIApp, limiters: Optional[Dict[str, ConcurrencyLimiter]] = None,
+                 route_classes: Sequence[Tuple[Optional[str], str, str]] = ROUTE_CLASSES, enabled: bool = ADMISSION_ENABLED):
+        self.app = app
+        self.limiters = limiters if limiters is not None else route_limiters
+        self.route_classes = route_classes
+        self.enabled = enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiters.get(classify(scope["path"], self.route_classes, scope["method"]))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            await self._reject(limiter, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    async def _reject(self, limiter: ConcurrencyLimiter, send: Send):
+        body = json.dumps({
+            "success": False,
+            "error": {
+                "code": "SERVICE_OVERLOADED",
+                "message": "系统繁忙，请稍后重试",
+                "details": {"route_class": limiter.name},
+            }
+        }, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(limiter.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def get_stats() -> Dict:
+    return {
+        "enabled": ADMISSION_ENABLED,
+        "classes": {name: limiter.stats() for name, limiter in route_limiters.items()},
+    }
@@ -0,0 +1,185 @@
+"""
+历史预约归档
+
+appointments 表只保留近期（热）数据，早于截止时间的预约分批整行搬到 appointments_archive：
+
+    python manage.py archive-appointments            # 适合 cron 定时执行
+    ARCHIVE_INTERVAL_SECONDS=3600                    # 或在Web进程内定时执行
+
+每批在自己的短事务中完成：锁定一批ID（PostgreSQL/MySQL 使用 FOR UPDATE SKIP LOCKED，
+多个进程同时归档互不等待）→ INSERT ... SELECT 复制到归档表 → 累加按医生的归档计数
+（appointments_archive_counts）→ DELETE → 提交，提交后从实体缓存和全文索引中移除这批预约。
+批与批之间可以暂停，避免长时间占用锁和复制带宽。
+
+升级前已有归档数据时，执行一次 python manage.py rebuild-archive-counts 重建计数。
+
+选择独立归档表而不是数据库原生分区，是为了在 SQLite/MySQL/PostgreSQL 上行为一致；
+crud.get_appointment 透明地同时读取两张表，crud.get_appointments 在时间范围早于归档边界时才读归档表。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+import cache
+import fulltext
+from models import Appointment, ArchivedAppointment, ArchivedAppointmentCount
+
+logger = logging.getLogger("hospitalrun.archive")
+
+# 预约时间早于多少天前的归档
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+# 每批搬移的预约数
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# 批与批之间的暂停（秒）
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.1"))
+# Web进程内定时归档的间隔（秒），0 表示不在Web进程内归档
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "0"))
+
+_stats_lock = threading.Lock()
+_stats = {"runs": 0, "batches": 0, "archived": 0, "last_run_at": None, "last_error": None}
+
+
+def archive_cutoff(days: int = ARCHIVE_AFTER_DAYS, now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.now()) - timedelta(days=days)
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """搬移一批早于 cutoff 的预约并提交，返回本批数量"""
+    live = Appointment.__table__
+    archived = ArchivedAppointment.__table__
+
+    ids = [
+        row.id for row in db.execute(
+            select(live.c.id)
+            .where(live.c.appointment_time < cutoff)
+            .order_by(live.c.appointment_time, live.c.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+    ]
+    if not ids:
+        db.rollback()
+        return 0
+
+    columns = [column.name for column in live.c]
+    db.execute(
+        archived.insert().from_select(
+            columns + ["archived_at"],
+            select(*live.c, func.now()).where(live.c.id.in_(ids))
+        )
+    )
+    _add_archived_counts(db, db.execute(
+        select(live.c.doctor_name, func.count()).where(live.c.id.in_(ids)).group_by(live.c.doctor_name)
+    ).all())
+    db.execute(live.delete().where(live.c.id.in_(ids)))
+    db.commit()
+
+    for appointment_id in ids:
+        cache.evict(db, Appointment, appointment_id)
+        fulltext.entity_deleted(db, Appointment, appointment_id)
+    return len(ids)
+
+
+def _add_archived_counts(db: Session, counts):
+    """在归档事务中累加按医生的归档计数；并发归档同时插入同一医生的新行时本批失败回滚，下次重试"""
+    table = ArchivedAppointmentCount.__table__
+    for doctor_name, count in counts:
+        result = db.execute(
+            update(table)
+            .where(table.c.doctor_name == doctor_name)
+            .values(appointment_count=table.c.appointment_count + count)
+        )
+        if result.rowcount == 0:
+            db.execute(table.insert().values(doctor_name=doctor_name, appointment_count=count))
+
+
+def rebuild_archived_counts(db: Session) -> int:
+    """按归档表重新统计按医生的归档计数（升级或手工修改归档表后使用），返回医生数"""
+    archived = ArchivedAppointment.__table__
+    db.execute(delete(ArchivedAppointmentCount))
+    db.execute(
+        ArchivedAppointmentCount.__table__.insert().from_select(
+            ["doctor_name", "appointment_count"],
+            select(archived.c.doctor_name, func.count()).group_by(archived.c.doctor_name)
+        )
+    )
+    db.commit()
+    return db.query(ArchivedAppointmentCount).count()
+
+
+def archived_counts(db: Session) -> Dict[str, int]:
+    """{医生姓名: 已归档的预约数}"""
+    return dict(db.query(ArchivedAppointmentCount.doctor_name, ArchivedAppointmentCount.appointment_count).all())
+
+
+def archive_appointments(
+    session_factory: Callable[[], Session] = None,
+    cutoff: Optional[datetime] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    pause: float = ARCHIVE_BATCH_PAUSE,
+    max_batches: Optional[int] = None,
+) -> int:
+    """分批归档直到没有早于 cutoff 的预约（或达到 max_batches），返回归档总数"""
+    if session_factory is None:
+        from database import SessionLocal
+        session_factory = SessionLocal
+    cutoff = cutoff or archive_cutoff()
+
+    total = 0
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            db = session_factory()
+            try:
+                moved = archive_batch(db, cutoff, batch_size)
+            finally:
+                db.close()
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            with _stats_lock:
+                _stats["batches"] += 1
+                _stats["archived"] += moved
+            logger.info("已归档 %s 条预约（本次累计 %s）", moved, total)
+            if moved < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    except Exception as exc:
+        with _stats_lock:
+            _stats["last_error"] = str(exc)
+        raise
+    finally:
+        with _stats_lock:
+            _stats["runs"] += 1
+            _stats["last_run_at"] = datetime.now().isoformat()
+    return total
+
+
+def archived_until(db: Session) -> Optional[datetime]:
+    """归档表中最晚的预约时间（索引查找），归档表为空时返回 None"""
+    return db.query(func.max(ArchivedAppointment.appointment_time)).scalar()
+
+
+async def run_periodically(interval: float = ARCHIVE_INTERVAL_SECONDS):
+    """Web进程内的定时归档任务，归档本身在线程池中执行，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, archive_appointments)
+        except Exception:
+            logger.exception("预约归档失败")
+        await asyncio.sleep(interval)
+
+
+def get_stats() -> Dict:
+    with _stats_lock:
+        return dict(_stats)
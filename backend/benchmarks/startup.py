@@ -0,0 +1,84 @@
+"""
+冷启动基准测试
+
+测量两个指标（各重复多次取中位数）：
+- import: 新进程中 `import main` 的耗时
+- first_request: 从启动 uvicorn 进程到 /health 第一次返回 200 的耗时
+
+用法（在 backend 目录下执行）：
+
+    DATABASE_URL=sqlite:///./test.db python benchmarks/startup.py --runs 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import main; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    """在新进程中测量 import main 的耗时（秒）"""
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=os.environ.copy()
+    )
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_first_request(timeout: float = 30.0) -> float:
+    """测量从启动服务进程到第一个请求成功返回的耗时（秒）"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=os.environ.copy(),
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"服务在 {timeout} 秒内未就绪")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="HospitalRun 冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数")
+    args = parser.parse_args(argv)
+
+    imports = [measure_import() for _ in range(args.runs)]
+    first_requests = [measure_first_request() for _ in range(args.runs)]
+
+    print(f"import main:    median {statistics.median(imports) * 1000:.1f} ms, "
+          f"min {min(imports) * 1000:.1f} ms")
+    print(f"first request:  median {statistics.median(first_requests) * 1000:.1f} ms, "
+          f"min {min(first_requests) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+按ID读取的实体缓存
+
+crud.get_patient / get_doctor / get_appointment 先查这里，未命中再查数据库并写入缓存。
+每种实体一个有容量上限的 LRU（超过上限淘汰最久未使用的），每条记录有 TTL。
+
+缓存的是列值快照而不是 ORM 对象：命中时重建一个与当前会话关联的对象，
+调用方可以像查询结果一样修改、删除它。crud 的写操作提交后调用 store / evict，
+其他进程的写入只能等 TTL 过期，因此 TTL 不宜设得太长。
+
+读穿透与写入并发时，读到旧版本的请求可能晚于写入者写缓存：每条记录带上版本号，
+不用旧版本覆盖新版本。读副本得到的值可能落后于主库，只返回给调用方，不写入缓存。
+"""
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import Patient, Doctor, Appointment
+
+# 缓存条目有效期（秒）
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "60"))
+
+# 每种实体最多缓存的条目数，0 表示不缓存
+CACHE_SIZES = {
+    Patient: int(os.getenv("PATIENT_CACHE_SIZE", "2000")),
+    Doctor: int(os.getenv("DOCTOR_CACHE_SIZE", "500")),
+    Appointment: int(os.getenv("APPOINTMENT_CACHE_SIZE", "2000")),
+}
+
+_MISSING = object()
+
+
+class LRUCache:
+    """带 TTL 的线程安全 LRU"""
+
+    def __init__(self, maxsize: int, ttl: float = ENTITY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[float, object, Optional[int]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_puts = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version: Optional[int] = None):
+        """写入；指定 version 时，已缓存更高版本（且未过期）的条目不被替换"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            entry = self._data.get(key)
+            if (
+                version is not None and entry is not None
+                and entry[2] is not None and entry[2] > version and entry[0] > now
+            ):
+                self.stale_puts += 1
+                return
+            self._data[key] = (now + self.ttl, value, version)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale_puts": self.stale_puts,
+        }
+
+
+# 每个数据库引擎一组缓存（测试中每个用例使用独立的内存数据库）
+_caches: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def caches_for(db: Session) -> Dict[type, LRUCache]:
+    """获取会话所属数据库（主库）的实体缓存"""
+    bind = db.get_bind()
+    caches = _caches.get(bind)
+    if caches is None:
+        with _caches_lock:
+            caches = _caches.setdefault(
+                bind, {model: LRUCache(size) for model, size in CACHE_SIZES.items()}
+            )
+    return caches
+
+
+def _snapshot(instance) -> Dict:
+    return {attr.key: getattr(instance, attr.key) for attr in inspect(instance).mapper.column_attrs}
+
+
+def _put(db: Session, instance):
+    snapshot = _snapshot(instance)
+    caches_for(db)[type(instance)].put(instance.id, snapshot, snapshot.get("version"))
+
+
+def _read_from_replica(db: Session) -> bool:
+    """会话刚才的 SELECT 是否发往了只读副本（RoutingSession 选定副本且尚未写入）"""
+    return bool(getattr(db, "use_replica", False) and not getattr(db, "_wrote", True)
+                and getattr(db, "_replica", None) is not None)
+
+
+def attach(db: Session, model, values: Dict):
+    """
+    用一行完整的列值得到与会话关联的对象，不发出SQL
+
+    会话中已有同一ID的对象时（例如提交后已过期）直接把值设为已加载状态，
+    否则新建对象并作为持久化对象加入会话。
+    """
+    key = db.identity_key(model, values["id"])
+    instance = db.identity_map.get(key)
+    if instance is not None:
+        for name, value in values.items():
+            set_committed_value(instance, name, value)
+        return instance
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    db.add(instance)
+    return instance
+
+
+def get(db: Session, model, entity_id: int):
+    """按ID读取实体：会话中已有 → 缓存 → 数据库"""
+    key = db.identity_key(model, entity_id)
+    if key in db.identity_map:
+        return db.identity_map[key]
+
+    cache = caches_for(db)[model]
+    snapshot = cache.get(entity_id, _MISSING)
+    if snapshot is not _MISSING:
+        return attach(db, model, snapshot)
+
+    instance = db.query(model).filter(model.id == entity_id).first()
+    if instance is not None and not _read_from_replica(db):
+        _put(db, instance)
+    return instance
+
+
+def store(db: Session, instance):
+    """写入提交并 refresh 后调用，缓存最新值"""
+    _put(db, instance)
+
+
+def evict(db: Session, model, entity_id: int):
+    """删除（或无法取得最新值的写入）提交后调用"""
+    caches_for(db)[model].discard(entity_id)
+
+
+def clear():
+    """清空所有缓存"""
+    for caches in list(_caches.values()):
+        for cache in caches.values():
+            cache.clear()
+
+
+def get_stats() -> Dict:
+    """按实体汇总所有引擎的缓存统计"""
+    totals: Dict[str, Dict] = {}
+    for caches in list(_caches.values()):
+        for model, cache in caches.items():
+            name = model.__tablename__
+            current = totals.setdefault(name, dict.fromkeys(cache.stats(), 0))
+            for field, value in cache.stats().items():
+                current[field] += value
+            current["maxsize"] = cache.maxsize
+    return totals
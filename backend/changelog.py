@@ -0,0 +1,261 @@
+"""
+变更日志与增量同步
+
+前端每次编辑后重新下载整张列表。crud 的每次写入（创建、修改、删除患者/医生/预约）在同一事务中
+向 change_log 追加一行 (序号, 类型, ID, 操作, 版本号)，不保存整行数据；客户端记住上次读到的序号，
+用 GET /api/changes?since=<序号> 只取之后的变更：
+
+- 同一页内同一条记录的多次变更合并为一条，数据按ID从表中读取当前值；删除返回墓碑（data 为空）
+- insert / update 都应按“存在则替换、不存在则插入”处理：压缩后早期的 insert 可能只剩 update
+- 序号由数据库自增生成，并发事务可能晚于更大的序号提交。只返回 CHANGES_SETTLE_SECONDS 秒前
+  写入的变更，遇到更新的一行即停止，避免游标越过尚未提交的变更；副本延迟可能超过这个时间，
+  接口读主库
+
+日志有界：python manage.py cleanup-changes（或 CHANGE_LOG_INTERVAL_SECONDS 在Web进程内定时）
+
+- 清理：删除早于 CHANGE_LOG_RETENTION_DAYS 天的一段连续最早序号，始终保留最新的一行
+- 压缩：删除被同一记录更新的一行取代的旧行，最早的一行除外
+
+因此日志中最小序号之前的变更都已清理或被取代：游标早于它时返回 410，客户端重新全量加载后
+用响应中的 cursor 继续。
+"""
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, func, insert, select
+from sqlalchemy.orm import Session
+
+import schemas
+from models import Appointment, ArchivedAppointment, ChangeLogEntry, Doctor, Patient
+
+logger = logging.getLogger("hospitalrun.changelog")
+
+# 日志保留天数
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+# 清理、压缩时每批处理的行数
+CHANGE_LOG_BATCH_SIZE = int(os.getenv("CHANGE_LOG_BATCH_SIZE", "1000"))
+# Web进程内定时清理的间隔（秒），0 表示不在Web进程内清理
+CHANGE_LOG_INTERVAL_SECONDS = float(os.getenv("CHANGE_LOG_INTERVAL_SECONDS", "0"))
+# 每页默认返回的变更数
+CHANGES_PAGE_LIMIT = int(os.getenv("CHANGES_PAGE_LIMIT", "500"))
+# 只返回多少秒前写入的变更（覆盖事务从写日志到提交的时间）
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "1"))
+
+# 类型 → (模型, 响应 Schema)
+ENTITY_TYPES = {
+    "patient": (Patient, schemas.Patient),
+    "doctor": (Doctor, schemas.Doctor),
+    "appointment": (Appointment, schemas.Appointment),
+}
+_TYPE_NAMES = {model: name for name, (model, _) in ENTITY_TYPES.items()}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "recorded": 0, "reads": 0, "expired_cursors": 0,
+    "runs": 0, "purged": 0, "compacted": 0, "last_run_at": None, "last_error": None,
+}
+
+
+class CursorExpiredError(Exception):
+    """游标之后的变更已被清理，客户端需要重新全量加载"""
+
+    def __init__(self, since: int, oldest: int):
+        super().__init__(f"游标 {since} 已过期，最早可用的游标为 {oldest}")
+        self.since = since
+        self.oldest = oldest
+
+
+def record(db: Session, model, entity_id: int, op: str, version: Optional[int] = None):
+    """在调用方的事务中追加一行变更（由调用方提交）"""
+    db.execute(insert(ChangeLogEntry).values(
+        entity_type=_TYPE_NAMES[model], entity_id=entity_id, op=op, version=version, changed_at=datetime.now()
+    ))
+    _stats["recorded"] += 1
+
+
+def _settled(now: Optional[datetime]) -> datetime:
+    return (now or datetime.now()) - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+
+
+def head(db: Session, now: Optional[datetime] = None) -> int:
+    """当前可用的最新游标：全量加载后从这里开始增量同步"""
+    table = ChangeLogEntry.__table__
+    pending = db.execute(select(func.min(table.c.id)).where(table.c.changed_at > _settled(now))).scalar()
+    if pending is not None:
+        return pending - 1
+    return db.execute(select(func.max(table.c.id))).scalar() or 0
+
+
+def _load(db: Session, type_name: str, ids: List[int]) -> Dict[int, Dict]:
+    """按ID读取当前数据（预约同时查归档表）"""
+    model, schema = ENTITY_TYPES[type_name]
+    models = [model, ArchivedAppointment] if model is Appointment else [model]
+    found = {}
+    for source in models:
+        missing = [entity_id for entity_id in ids if entity_id not in found]
+        if not missing:
+            break
+        for row in db.query(source).filter(source.id.in_(missing)):
+            found[row.id] = schema.model_validate(row).model_dump()
+    return found
+
+
+def read_changes(db: Session, since: int, limit: Optional[int] = None,
+                 now: Optional[datetime] = None) -> Tuple[List[Dict], int, bool]:
+    """读取游标之后的一页变更，返回 (变更列表, 新游标, 是否还有更多)"""
+    limit = limit or CHANGES_PAGE_LIMIT
+    table = ChangeLogEntry.__table__
+    _stats["reads"] += 1
+
+    oldest = db.execute(select(func.min(table.c.id))).scalar()
+    if oldest is not None and since < oldest - 1:
+        _stats["expired_cursors"] += 1
+        raise CursorExpiredError(since, oldest - 1)
+
+    rows = db.execute(
+        select(table).where(table.c.id > since).order_by(table.c.id).limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    settled = _settled(now)
+    for position, row in enumerate(rows):
+        if row.changed_at > settled:
+            rows, has_more = rows[:position], False
+            break
+    if not rows:
+        return [], since, False
+
+    # 同一记录只保留最后一次变更，按最后一次变更的顺序输出
+    first_ops: Dict[Tuple[str, int], str] = {}
+    latest: Dict[Tuple[str, int], object] = {}
+    for row in rows:
+        key = (row.entity_type, row.entity_id)
+        first_ops.setdefault(key, row.op)
+        latest.pop(key, None)
+        latest[key] = row
+
+    wanted: Dict[str, List[int]] = {}
+    for (type_name, entity_id), row in latest.items():
+        if row.op != "delete":
+            wanted.setdefault(type_name, []).append(entity_id)
+    data = {type_name: _load(db, type_name, ids) for type_name, ids in wanted.items()}
+
+    changes = []
+    for key, row in latest.items():
+        type_name, entity_id = key
+        if row.op == "delete":
+            op, values = "delete", None
+        else:
+            values = data[type_name].get(entity_id)
+            if values is None:
+                # 之后已被删除：墓碑在后面的变更中返回
+                continue
+            op = "insert" if first_ops[key] == "insert" else "update"
+        changes.append({
+            "cursor": row.id,
+            "type": type_name,
+            "id": entity_id,
+            "op": op,
+            "version": row.version,
+            "changed_at": row.changed_at,
+            "data": values,
+        })
+    return changes, rows[-1].id, has_more
+
+
+def purge_expired(db: Session, cutoff: datetime, batch_size: int = CHANGE_LOG_BATCH_SIZE) -> int:
+    """分批删除早于 cutoff 的最早一段日志（序号连续，始终保留最新的一行），返回删除数量"""
+    table = ChangeLogEntry.__table__
+    boundary = db.execute(select(func.min(table.c.id)).where(table.c.changed_at >= cutoff)).scalar()
+    if boundary is None:
+        boundary = db.execute(select(func.max(table.c.id))).scalar()
+    total = 0
+    while boundary is not None:
+        ids = db.execute(
+            select(table.c.id).where(table.c.id < boundary).order_by(table.c.id).limit(batch_size)
+        ).scalars().all()
+        if ids:
+            db.execute(delete(table).where(table.c.id.in_(ids)))
+            db.commit()
+            total += len(ids)
+        if len(ids) < batch_size:
+            break
+    db.rollback()
+    return total
+
+
+def compact(db: Session, batch_size: int = CHANGE_LOG_BATCH_SIZE) -> int:
+    """按序号分批扫描，删除被同一记录更新的一行取代的旧行（最早的一行除外），返回删除数量"""
+    table = ChangeLogEntry.__table__
+    later = table.alias("later")
+    superseded = exists().where(
+        later.c.entity_type == table.c.entity_type,
+        later.c.entity_id == table.c.entity_id,
+        later.c.id > table.c.id,
+    )
+    after = db.execute(select(func.min(table.c.id))).scalar()
+    total = 0
+    while after is not None:
+        rows = db.execute(
+            select(table.c.id, superseded.label("superseded"))
+            .where(table.c.id > after)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        ids = [row.id for row in rows if row.superseded]
+        if ids:
+            db.execute(delete(table).where(table.c.id.in_(ids)))
+            db.commit()
+            total += len(ids)
+        if len(rows) < batch_size:
+            break
+        after = rows[-1].id
+    db.rollback()
+    return total
+
+
+def cleanup(session_factory: Callable[[], Session] = None, now: Optional[datetime] = None) -> Tuple[int, int]:
+    """清理过期日志并压缩，返回 (清理数量, 压缩数量)"""
+    if session_factory is None:
+        from database import SessionLocal
+        session_factory = SessionLocal
+    cutoff = (now or datetime.now()) - timedelta(days=CHANGE_LOG_RETENTION_DAYS)
+
+    db = session_factory()
+    try:
+        purged = purge_expired(db, cutoff)
+        compacted = compact(db)
+    except Exception as exc:
+        with _stats_lock:
+            _stats["last_error"] = str(exc)
+        raise
+    finally:
+        db.close()
+        with _stats_lock:
+            _stats["runs"] += 1
+            _stats["last_run_at"] = datetime.now().isoformat()
+    with _stats_lock:
+        _stats["purged"] += purged
+        _stats["compacted"] += compacted
+    logger.info("变更日志：清理 %s 行，压缩 %s 行", purged, compacted)
+    return purged, compacted
+
+
+async def run_periodically(interval: float = CHANGE_LOG_INTERVAL_SECONDS):
+    """Web进程内的定时清理任务，在线程池中执行，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, cleanup)
+        except Exception:
+            logger.exception("变更日志清理失败")
+        await asyncio.sleep(interval)
+
+
+def get_stats() -> Dict:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,128 @@
+"""
+相同 GET 请求合并（single-flight）
+
+几十个页面往往在同一秒内请求完全相同的 GET /api/dashboard、GET /api/doctors。
+对白名单中的路径，同一时刻相同的请求（方法、路径、规范化后的查询参数、Accept 头都相同）
+只有第一个（leader）真正进入路由计算，其余的等待并共享它的响应状态、响应头和响应体。
+
+只合并幂等的 GET 请求；leader 出错时，等待的请求各自重新处理。外层中间件（压缩、CORS）会原地修改
+响应头，因此保存的是发送前的副本，每个等待的请求重放各自的一份新副本。
+后到的请求可能拿到稍早一点开始计算的结果，因此只应把允许这种误差的接口加入白名单。
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# 允许合并的路径前缀，逗号分隔
+COALESCE_PATHS = os.getenv("COALESCE_PATHS", "/api/dashboard,/api/doctors")
+# 设为 0 关闭请求合并
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# 影响响应内容的请求头，作为合并键的一部分
+VARY_HEADERS = ("accept",)
+
+_stats = {"leaders": 0, "coalesced": 0, "leader_errors": 0}
+
+
+def parse_paths(value: str) -> List[str]:
+    return [path.strip().rstrip("/") for path in value.split(",") if path.strip()]
+
+
+def normalize_query(query_string: bytes) -> str:
+    """查询参数排序后重新编码，参数顺序不同的请求视为相同"""
+    return urlencode(sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)))
+
+
+def request_key(scope: Scope) -> Tuple:
+    headers = Headers(scope=scope)
+    return (
+        scope["method"],
+        scope["path"],
+        normalize_query(scope.get("query_string", b"")),
+        tuple(headers.get(name, "") for name in VARY_HEADERS),
+    )
+
+
+def copy_message(message: Message) -> Message:
+    """复制 ASGI 消息及其响应头列表（外层中间件会原地修改 headers）"""
+    copied = dict(message)
+    if "headers" in copied:
+        copied["headers"] = [tuple(header) for header in copied["headers"]]
+    return copied
+
+
+class LeaderCancelledError(Exception):
+    """leader 请求被取消，等待的请求需要各自重新处理"""
+
+
+class RequestCoalescingMiddleware:
+    """合并白名单路径上相同的并发 GET 请求"""
+
+    def __init__(self, app: ASGIApp, paths: Optional[Sequence[str]] = None, enabled: bool = COALESCE_ENABLED):
+        self.app = app
+        self.paths = list(paths) if paths is not None else parse_paths(COALESCE_PATHS)
+        self.enabled = enabled
+        self._in_flight: Dict[Tuple, asyncio.Future] = {}
+
+    def allowed(self, scope: Scope) -> bool:
+        if scope["type"] != "http" or scope["method"] != "GET" or not self.enabled:
+            return False
+        path = scope["path"].rstrip("/")
+        return any(path == prefix or path.startswith(prefix + "/") for prefix in self.paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self.allowed(scope):
+            await self.app(scope, receive, send)
+            return
+
+        key = request_key(scope)
+        future = self._in_flight.get(key)
+        if future is not None:
+            try:
+                messages = await asyncio.shield(future)
+            except Exception:
+                # leader 失败，各自重新处理
+                await self.app(scope, receive, send)
+                return
+            _stats["coalesced"] += 1
+            for message in messages:
+                await send(copy_message(message))
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        _stats["leaders"] += 1
+        messages: List[Message] = []
+
+        async def capture(message: Message):
+            messages.append(copy_message(message))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException as exc:
+            # 包括 leader 被取消（客户端断开、进程关闭）：等待者收到普通异常后各自重新处理，
+            # 不能让 future 一直不完成
+            _stats["leader_errors"] += 1
+            if not isinstance(exc, Exception):
+                exc = LeaderCancelledError("合并请求的 leader 已取消")
+            future.set_exception(exc)
+            # 没有等待者时避免 "Future exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(messages)
+        finally:
+            del self._in_flight[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+
+def get_stats() -> Dict:
+    return {"enabled": COALESCE_ENABLED, "paths": parse_paths(COALESCE_PATHS), **_stats}
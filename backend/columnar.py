@@ -0,0 +1,142 @@
+"""
+列表接口的紧凑响应格式
+
+预约看板、导出等大列表中，每个 JSON 对象都重复字段名。列表接口支持两种可选表示：
+
+- ``format=columns``：字段名只出现一次，值按列存放为并行数组，枚举字段字典编码
+  （列中存放字典下标）::
+
+      {"format": "columns", "count": 2,
+       "fields": ["id", "name", "gender"],
+       "columns": [[1, 2], ["张三", "李四"], [0, 1]],
+       "dictionaries": {"gender": ["男", "女"]}}
+
+- ``Accept: application/msgpack``：用 MessagePack 编码响应（可与 format=columns 组合）。
+  需要安装 msgpack；未安装时仍返回 JSON。
+
+不带这两个选项的请求保持原有 JSON 格式。
+"""
+from enum import Enum
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from starlette.responses import Response
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖
+    msgpack = None
+
+COLUMNS_FORMAT = "columns"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def enum_fields(schema) -> List[str]:
+    """Pydantic 模型中类型为枚举的字段（字典编码）"""
+    return [
+        name for name, field in schema.model_fields.items()
+        if isinstance(field.annotation, type) and issubclass(field.annotation, Enum)
+    ]
+
+
+def to_columns(rows: Sequence[Dict[str, Any]], fields: Sequence[str], dictionary_fields: Sequence[str] = ()) -> Dict:
+    """把对象列表转换为列式表示"""
+    columns = [[row.get(field) for row in rows] for field in fields]
+    dictionaries = {}
+    for index, field in enumerate(fields):
+        if field not in dictionary_fields:
+            continue
+        codes: Dict[Any, int] = {}
+        columns[index] = [codes.setdefault(value, len(codes)) for value in columns[index]]
+        dictionaries[field] = list(codes)
+    return {
+        "format": COLUMNS_FORMAT,
+        "count": len(rows),
+        "fields": list(fields),
+        "columns": columns,
+        "dictionaries": dictionaries,
+    }
+
+
+def from_columns(table: Dict) -> List[Dict[str, Any]]:
+    """to_columns 的逆变换（客户端解码参考实现，测试中使用）"""
+    columns = []
+    for field, column in zip(table["fields"], table["columns"]):
+        dictionary = table["dictionaries"].get(field)
+        columns.append([dictionary[code] for code in column] if dictionary is not None else column)
+    return [dict(zip(table["fields"], values)) for values in zip(*columns)]
+
+
+def parse_accept(accept: str) -> List[Tuple[str, float]]:
+    """解析 Accept 请求头，返回 [(媒体范围, q 值)]；q 值无法解析的范围忽略"""
+    ranges = []
+    for part in accept.split(","):
+        media_range, *params = [item.strip() for item in part.split(";")]
+        if not media_range:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = -1.0
+        if 0 <= quality <= 1:
+            ranges.append((media_range.lower(), quality))
+    return ranges
+
+
+def _quality(ranges: List[Tuple[str, float]], media_type: str) -> float:
+    """media_type 的 q 值：取最具体的匹配范围（type/subtype > type/* > */*），没有匹配时为 0"""
+    main_type = media_type.split("/")[0]
+    best = (-1, 0.0)
+    for media_range, quality in ranges:
+        if media_range == media_type:
+            specificity = 2
+        elif media_range == f"{main_type}/*":
+            specificity = 1
+        elif media_range == "*/*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best[0]:
+            best = (specificity, quality)
+    return best[1]
+
+
+def accepts_msgpack(request: Request) -> bool:
+    """
+    客户端是否要 MessagePack：必须显式列出 MessagePack 媒体类型且 q > 0，
+    并且不低于 JSON 的 q 值（*/* 等通配不算要求 MessagePack）
+    """
+    if msgpack is None:
+        return False
+    ranges = parse_accept(request.headers.get("accept", ""))
+    msgpack_quality = max(
+        (quality for media_range, quality in ranges if media_range in MSGPACK_MEDIA_TYPES), default=0.0
+    )
+    return msgpack_quality > 0 and msgpack_quality >= _quality(ranges, "application/json")
+
+
+def respond(request: Request, response: BaseModel, list_key: str, item_schema, format: Optional[str] = None):
+    """
+    按 format 参数和 Accept 请求头编码列表响应
+
+    响应内容随 Accept 变化，始终带 Vary: Accept，共享缓存不会把 MessagePack 响应交给 JSON 客户端。
+    """
+    use_msgpack = accepts_msgpack(request)
+    headers = {"Vary": "Accept"}
+
+    payload = jsonable_encoder(response)
+    if format == COLUMNS_FORMAT:
+        payload[list_key] = to_columns(
+            payload[list_key], list(item_schema.model_fields), enum_fields(item_schema)
+        )
+    if use_msgpack:
+        return Response(msgpack.packb(payload, use_bin_type=True), media_type=MSGPACK_MEDIA_TYPE, headers=headers)
+    return JSONResponse(payload, headers=headers)
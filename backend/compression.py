@@ -0,0 +1,254 @@
+"""
+响应压缩中间件
+
+根据请求的 Accept-Encoding 协商压缩算法（zstd / br / gzip），
+小于阈值的响应保持原样，流式响应（导出等）逐块压缩并立即刷新，
+不会把整个响应缓存在内存中。
+
+brotli 与 zstd 为可选依赖，未安装时自动退回 gzip。
+"""
+import os
+import zlib
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 可选依赖
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+
+# 压缩配置 - 从环境变量读取
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "500"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+COMPRESSION_ENCODINGS = os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip")
+
+# 已经压缩过的内容类型，再压缩只会浪费CPU
+INCOMPRESSIBLE_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+)
+
+
+def available_encodings() -> List[str]:
+    """返回当前环境可用的压缩算法（按服务端偏好排序）"""
+    encodings = []
+    for encoding in COMPRESSION_ENCODINGS.split(","):
+        encoding = encoding.strip().lower()
+        if encoding == "zstd" and zstandard is None:
+            continue
+        if encoding == "br" and brotli is None:
+            continue
+        if encoding in ("zstd", "br", "gzip"):
+            encodings.append(encoding)
+    return encodings
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """解析 Accept-Encoding 头，返回 {编码: q值}"""
+    result = {}
+    for part in header.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[name.strip().lower()] = q
+    return result
+
+
+def select_encoding(header: str, encodings: List[str]) -> Optional[str]:
+    """
+    选择压缩算法
+
+    客户端q值优先；q值相同时按服务端偏好顺序（encodings 的顺序）选择。
+    """
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best = None
+    best_q = 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    """统一三种算法的流式压缩接口"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int, zstd_level: int):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            self._obj = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._obj = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data)
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        """刷新已缓冲的数据，流保持打开"""
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._obj.flush()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        """结束压缩流"""
+        if self.encoding == "gzip":
+            return self._obj.flush(zlib.Z_FINISH)
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    响应压缩中间件
+
+    - **minimum_size**: 小于该字节数的完整响应不压缩
+    - **gzip_level / brotli_quality / zstd_level**: 各算法压缩级别
+    - **encodings**: 启用的算法及偏好顺序，默认取环境变量配置
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        gzip_level: int = COMPRESSION_GZIP_LEVEL,
+        brotli_quality: int = COMPRESSION_BROTLI_QUALITY,
+        zstd_level: int = COMPRESSION_ZSTD_LEVEL,
+        encodings: Optional[List[str]] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.zstd_level = zstd_level
+        self.encodings = encodings if encodings is not None else available_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = select_encoding(headers.get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """处理单个响应：决定是否压缩，并改写响应头"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    def _new_compressor(self) -> _Compressor:
+        return _Compressor(
+            self.encoding,
+            self.middleware.gzip_level,
+            self.middleware.brotli_quality,
+            self.middleware.zstd_level,
+        )
+
+    async def send(self, message: Message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            # 先暂存响应头，等看到第一块响应体再决定是否压缩
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            if "content-encoding" in headers or content_type.startswith(INCOMPRESSIBLE_CONTENT_TYPES):
+                self.passthrough = True
+            return
+
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        if self.passthrough:
+            if self.start_message is not None:
+                await self._send(self.start_message)
+                self.start_message = None
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start_message = self.start_message
+            self.start_message = None
+            headers = MutableHeaders(raw=start_message["headers"])
+
+            if not more_body:
+                # 完整响应：低于阈值直接返回
+                if len(body) < self.middleware.minimum_size:
+                    await self._send(start_message)
+                    await self._send(message)
+                    return
+                compressor = self._new_compressor()
+                body = compressor.compress(body) + compressor.finish()
+                headers["Content-Encoding"] = self.encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                await self._send(start_message)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+
+            # 流式响应：去掉 Content-Length，逐块压缩
+            self.compressor = self._new_compressor()
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            await self._send(start_message)
+
+        if self.compressor is None:
+            await self._send(message)
+            return
+
+        chunk = self.compressor.compress(body)
+        if more_body:
+            # 每块都刷新，保证客户端能及时收到导出数据
+            chunk += self.compressor.flush()
+        else:
+            chunk += self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -1,26 +1,163 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from models import Patient, Doctor, Appointment
+from sqlalchemy import func, and_, or_, select, update, delete
+from models import Patient, Doctor, Appointment, ArchivedAppointment
 from schemas import (
     PatientCreate, PatientUpdate,
     DoctorCreate, DoctorUpdate,
     AppointmentCreate, AppointmentUpdate,
     GenderEnum, SpecialtyEnum
 )
+from contextlib import contextmanager
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
+import functools
+import archive
+import cache
+import changelog
+import doctor_directory
+import name_index
+import fulltext
+
+# ============================================
+# 通用写操作
+# ============================================
+
+class VersionConflictError(Exception):
+    """条件更新时版本号不一致：记录已被其他请求修改"""
+
+    def __init__(self, model, entity_id: int, expected_version: int, current_version: int):
+        super().__init__(
+            f"{model.__tablename__} {entity_id} 版本冲突: 期望 {expected_version}, 当前 {current_version}"
+        )
+        self.entity_id = entity_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+@contextmanager
+def single_transaction(db: Session):
+    """
+    合并提交：期间的 crud 新建操作只 flush 不提交，调用方可以在同一事务中继续写入
+    （如幂等记录的响应），退出时提交一次；缓存、索引等提交后的更新推迟到这次提交之后执行。
+    出现异常时回滚，推迟的更新不执行
+    """
+    deferred = db.info["after_commit"] = []
+    try:
+        yield
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.info.pop("after_commit", None)
+    for hook in deferred:
+        hook()
+
+def _insert_row(db: Session, instance, *hooks):
+    """
+    插入一行，在同一事务中写变更日志，提交后返回刷新的对象
+
+    hooks(db, instance) 在提交后调用（更新缓存、索引）；在 single_transaction 中只 flush，
+    hooks 推迟到合并提交之后
+    """
+    db.add(instance)
+    db.flush()
+    changelog.record(db, type(instance), instance.id, "insert", instance.version)
+    hooks = (cache.store,) + hooks
+    deferred = db.info.get("after_commit")
+    if deferred is not None:
+        db.refresh(instance)
+        deferred.extend(functools.partial(hook, db, instance) for hook in hooks)
+        return instance
+    db.commit()
+    db.refresh(instance)
+    for hook in hooks:
+        hook(db, instance)
+    return instance
+
+def _update_row(db: Session, model, entity_id: int, values: Dict[str, Any], expected_version: int = None):
+    """
+    按ID更新一行并返回更新后的对象，不存在时返回 None
+
+    每次更新版本号加1。指定 expected_version 时为条件更新（WHERE version = ?），
+    不加行锁；记录存在但版本号不一致时抛出 VersionConflictError。
+
+    支持 UPDATE ... RETURNING 的数据库（SQLite 3.35+、PostgreSQL）一条语句完成更新；
+    MySQL/MariaDB 不支持，退化为 UPDATE + 按主键 SELECT 两条语句。
+    更新成功时在同一事务中再插入一行变更日志。
+    """
+    if not values and expected_version is None:
+        return cache.get(db, model, entity_id)
+
+    table = model.__table__
+    condition = table.c.id == entity_id
+    if expected_version is not None:
+        condition = and_(condition, table.c.version == expected_version)
+    stmt = update(table).where(condition).values(**values, version=table.c.version + 1)
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(stmt.returning(*table.c)).first()
+    else:
+        result = db.execute(stmt)
+        row = None
+        if result.rowcount:
+            row = db.execute(table.select().where(table.c.id == entity_id)).first()
+    if row is not None:
+        changelog.record(db, model, entity_id, "update", row.version)
+    db.commit()
+
+    if row is None:
+        cache.evict(db, model, entity_id)
+        if expected_version is not None:
+            # 只有更新失败时才多查一次，区分“不存在”和“版本冲突”
+            current_version = db.execute(
+                select(table.c.version).where(table.c.id == entity_id)
+            ).scalar()
+            if current_version is not None:
+                raise VersionConflictError(model, entity_id, expected_version, current_version)
+        return None
+    instance = cache.attach(db, model, dict(row._mapping))
+    cache.store(db, instance)
+    return instance
+
+def _delete_row(db: Session, model, entity_id: int) -> bool:
+    """
+    按ID删除一行，返回是否删除了记录（支持时使用 DELETE ... RETURNING id，否则检查 rowcount）
+
+    删除成功时在同一事务中插入一行变更日志（墓碑）。
+    """
+    table = model.__table__
+    stmt = delete(table).where(table.c.id == entity_id)
+    if db.get_bind().dialect.delete_returning:
+        deleted = db.execute(stmt.returning(table.c.id)).first() is not None
+    else:
+        deleted = db.execute(stmt).rowcount == 1
+    if deleted:
+        changelog.record(db, model, entity_id, "delete")
+    # 会话中已加载的对象在提交前移出，调用方持有的引用保留原值而不是过期
+    instance = db.identity_map.get(db.identity_key(model, entity_id))
+    if instance is not None:
+        db.expunge(instance)
+    db.commit()
+
+    cache.evict(db, model, entity_id)
+    return deleted
 
 # ============================================
 # 患者CRUD操作
 # ============================================
 
 def get_patient(db: Session, patient_id: int):
-    return db.query(Patient).filter(Patient.id == patient_id).first()
+    return cache.get(db, Patient, patient_id)
 
-def get_patients(db: Session, skip: int = 0, limit: int = 10, search: str = None, gender: str = None):
+def get_patients(db: Session, skip: int = 0, limit: int = 10, search: str = None, gender: str = None,
+                 fuzzy: bool = False):
     query = db.query(Patient)
 
-    if search:
+    # 容错搜索：姓名 n-gram 索引给出按相似度排序的候选ID
+    ranked = None
+    if search and fuzzy:
+        ranked = {patient_id: rank for rank, (patient_id, _) in enumerate(name_index.search(db, Patient, search))}
+        query = query.filter(Patient.id.in_(list(ranked)))
+    elif search:
         query = query.filter(
             or_(
                 Patient.name.contains(search),
@@ -36,32 +173,31 @@ def get_patients(db: Session, skip: int = 0, limit: int = 10, search: str = None
             query = query.filter(Patient.gender == GenderEnum.female.value)
 
     total = query.count()
-    patients = query.offset(skip).limit(limit).all()
+    if ranked is not None:
+        patients = sorted(query.all(), key=lambda patient: ranked[patient.id])[skip:skip + limit]
+    else:
+        patients = query.offset(skip).limit(limit).all()
 
     return patients, total
 
 def create_patient(db: Session, patient: PatientCreate):
-    db_patient = Patient(**patient.model_dump())
-    db.add(db_patient)
-    db.commit()
-    db.refresh(db_patient)
-    return db_patient
-
-def update_patient(db: Session, patient_id: int, patient: PatientUpdate):
-    db_patient = get_patient(db, patient_id)
+    return _insert_row(db, Patient(**patient.model_dump()), name_index.entity_saved, fulltext.entity_saved)
+
+def update_patient(db: Session, patient_id: int, patient: PatientUpdate, expected_version: int = None):
+    if expected_version is None:
+        expected_version = patient.version
+    db_patient = _update_row(
+        db, Patient, patient_id, patient.model_dump(exclude_unset=True, exclude={"version"}), expected_version
+    )
     if db_patient:
-        update_data = patient.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_patient, field, value)
-        db.commit()
-        db.refresh(db_patient)
+        name_index.entity_saved(db, db_patient)
+        fulltext.entity_saved(db, db_patient)
     return db_patient
 
 def delete_patient(db: Session, patient_id: int):
-    db_patient = get_patient(db, patient_id)
-    if db_patient:
-        db.delete(db_patient)
-        db.commit()
+    if _delete_row(db, Patient, patient_id):
+        name_index.entity_deleted(db, Patient, patient_id)
+        fulltext.entity_deleted(db, Patient, patient_id)
         return True
     return False
 
@@ -70,9 +206,18 @@ def delete_patient(db: Session, patient_id: int):
 # ============================================
 
 def get_doctor(db: Session, doctor_id: int):
-    return db.query(Doctor).filter(Doctor.id == doctor_id).first()
+    return cache.get(db, Doctor, doctor_id)
 
-def get_doctors(db: Session, specialty: str = None, status: str = None, search: str = None):
+def get_doctors(
+    db: Session,
+    specialty: str = None,
+    status: str = None,
+    search: str = None,
+    skip: int = 0,
+    limit: int = None,
+    cursor: int = None,
+    fuzzy: bool = False
+):
     query = db.query(Doctor)
 
     if specialty:
@@ -84,7 +229,12 @@ def get_doctors(db: Session, specialty: str = None, status: str = None, search:
     if status:
         query = query.filter(Doctor.status == status)
 
-    if search:
+    # 容错搜索：姓名 n-gram 索引给出按相似度排序的候选ID
+    ranked = None
+    if search and fuzzy:
+        ranked = {doctor_id: rank for rank, (doctor_id, _) in enumerate(name_index.search(db, Doctor, search))}
+        query = query.filter(Doctor.id.in_(list(ranked)))
+    elif search:
         query = query.filter(
             or_(
                 Doctor.name.contains(search),
@@ -92,19 +242,35 @@ def get_doctors(db: Session, specialty: str = None, status: str = None, search:
             )
         )
 
-    doctors = query.all()
-
-    # 统计信息
-    total = len(doctors)
-    specialty_count = {}
-    status_count = {}
+    # 统计信息：在数据库中分组计数，不需要加载全部医生
+    specialty_count = dict(
+        query.with_entities(Doctor.specialty, func.count(Doctor.id)).group_by(Doctor.specialty).all()
+    )
+    status_count = dict(
+        query.with_entities(Doctor.status, func.count(Doctor.id)).group_by(Doctor.status).all()
+    )
+    total = sum(specialty_count.values())
+
+    # 容错搜索按相似度排序，只支持 skip 偏移分页
+    if ranked is not None:
+        doctors = sorted(query.all(), key=lambda doctor: ranked[doctor.id])
+        end = skip + limit if limit is not None else None
+        return doctors[skip:end], {
+            "total": total,
+            "specialty_count": specialty_count,
+            "status_count": status_count
+        }
 
-    for doctor in doctors:
-        spec = doctor.specialty
-        stat = doctor.status
+    # 分页：cursor 为上一页最后一个医生的ID（键集分页），否则按 skip 偏移
+    query = query.order_by(Doctor.id)
+    if cursor is not None:
+        query = query.filter(Doctor.id > cursor)
+    elif skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
 
-        specialty_count[spec] = specialty_count.get(spec, 0) + 1
-        status_count[stat] = status_count.get(stat, 0) + 1
+    doctors = query.all()
 
     return doctors, {
         "total": total,
@@ -113,27 +279,28 @@ def get_doctors(db: Session, specialty: str = None, status: str = None, search:
     }
 
 def create_doctor(db: Session, doctor: DoctorCreate):
-    db_doctor = Doctor(**doctor.model_dump())
-    db.add(db_doctor)
-    db.commit()
-    db.refresh(db_doctor)
-    return db_doctor
-
-def update_doctor(db: Session, doctor_id: int, doctor: DoctorUpdate):
-    db_doctor = get_doctor(db, doctor_id)
+    return _insert_row(
+        db, Doctor(**doctor.model_dump()),
+        doctor_directory.doctor_saved, name_index.entity_saved, fulltext.entity_saved
+    )
+
+def update_doctor(db: Session, doctor_id: int, doctor: DoctorUpdate, expected_version: int = None):
+    if expected_version is None:
+        expected_version = doctor.version
+    db_doctor = _update_row(
+        db, Doctor, doctor_id, doctor.model_dump(exclude_unset=True, exclude={"version"}), expected_version
+    )
     if db_doctor:
-        update_data = doctor.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_doctor, field, value)
-        db.commit()
-        db.refresh(db_doctor)
+        doctor_directory.doctor_saved(db, db_doctor)
+        name_index.entity_saved(db, db_doctor)
+        fulltext.entity_saved(db, db_doctor)
     return db_doctor
 
 def delete_doctor(db: Session, doctor_id: int):
-    db_doctor = get_doctor(db, doctor_id)
-    if db_doctor:
-        db.delete(db_doctor)
-        db.commit()
+    if _delete_row(db, Doctor, doctor_id):
+        doctor_directory.doctor_deleted(db, doctor_id)
+        name_index.entity_deleted(db, Doctor, doctor_id)
+        fulltext.entity_deleted(db, Doctor, doctor_id)
         return True
     return False
 
@@ -142,7 +309,8 @@ def delete_doctor(db: Session, doctor_id: int):
 # ============================================
 
 def get_appointment(db: Session, appointment_id: int):
-    return db.query(Appointment).filter(Appointment.id == appointment_id).first()
+    # 热表中没有时再查归档表（归档后的预约只读）
+    return cache.get(db, Appointment, appointment_id) or db.get(ArchivedAppointment, appointment_id)
 
 def get_appointments(
     db: Session,
@@ -152,29 +320,38 @@ def get_appointments(
     doctor: str = None,
     patient: str = None
 ):
-    query = db.query(Appointment)
-
+    date_from_obj = None
+    date_to_obj = None
     if date_from:
         date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-        query = query.filter(Appointment.appointment_time >= date_from_obj)
 
     if date_to:
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d')
         date_to_obj = date_to_obj.replace(hour=23, minute=59, second=59)
-        query = query.filter(Appointment.appointment_time <= date_to_obj)
 
-    if status:
-        query = query.filter(Appointment.status == status)
-
-    if doctor:
-        query = query.filter(Appointment.doctor_name == doctor)
-
-    if patient:
-        query = query.filter(Appointment.patient_name == patient)
-
-    appointments = query.all()
-
-    # 增强数据：包含患者和医生详细信息
+    def filtered(model):
+        query = db.query(model)
+        if date_from_obj:
+            query = query.filter(model.appointment_time >= date_from_obj)
+        if date_to_obj:
+            query = query.filter(model.appointment_time <= date_to_obj)
+        if status:
+            query = query.filter(model.status == status)
+        if doctor:
+            query = query.filter(model.doctor_name == doctor)
+        if patient:
+            query = query.filter(model.patient_name == patient)
+        return query
+
+    appointments = filtered(Appointment).all()
+
+    # 指定了时间范围且可能早于归档边界时，才再读归档表；不带时间条件的列表只查热表
+    archived_until = archive.archived_until(db) if date_from_obj or date_to_obj else None
+    if archived_until is not None and (date_from_obj is None or date_from_obj <= archived_until):
+        appointments = filtered(ArchivedAppointment).all() + appointments
+
+    # 增强数据：包含患者和医生详细信息（医生信息来自进程内目录缓存）
+    directory = doctor_directory.directory_for(db)
     enhanced_appointments = []
     for appointment in appointments:
         appointment_dict = {
@@ -197,9 +374,7 @@ def get_appointments(
             }
 
         # 获取医生信息
-        doctor_info = db.query(Doctor).filter(
-            Doctor.name == appointment.doctor_name
-        ).first()
+        doctor_info = directory.get_by_name(db, appointment.doctor_name)
         if doctor_info:
             appointment_dict["doctor"] = {
                 "name": doctor_info.name,
@@ -247,27 +422,21 @@ def get_appointments(
     return enhanced_appointments, today_summary
 
 def create_appointment(db: Session, appointment: AppointmentCreate):
-    db_appointment = Appointment(**appointment.model_dump())
-    db.add(db_appointment)
-    db.commit()
-    db.refresh(db_appointment)
-    return db_appointment
-
-def update_appointment(db: Session, appointment_id: int, appointment: AppointmentUpdate):
-    db_appointment = get_appointment(db, appointment_id)
+    return _insert_row(db, Appointment(**appointment.model_dump()), fulltext.entity_saved)
+
+def update_appointment(db: Session, appointment_id: int, appointment: AppointmentUpdate, expected_version: int = None):
+    if expected_version is None:
+        expected_version = appointment.version
+    db_appointment = _update_row(
+        db, Appointment, appointment_id, appointment.model_dump(exclude_unset=True, exclude={"version"}), expected_version
+    )
     if db_appointment:
-        update_data = appointment.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_appointment, field, value)
-        db.commit()
-        db.refresh(db_appointment)
+        fulltext.entity_saved(db, db_appointment)
     return db_appointment
 
 def delete_appointment(db: Session, appointment_id: int):
-    db_appointment = get_appointment(db, appointment_id)
-    if db_appointment:
-        db.delete(db_appointment)
-        db.commit()
+    if _delete_row(db, Appointment, appointment_id):
+        fulltext.entity_deleted(db, Appointment, appointment_id)
         return True
     return False
 
@@ -277,8 +446,9 @@ def delete_appointment(db: Session, appointment_id: int):
 
 def get_dashboard_summary(db: Session):
     # 基本统计
+    directory = doctor_directory.directory_for(db)
     total_patients = db.query(Patient).count()
-    total_doctors = db.query(Doctor).count()
+    total_doctors = directory.count(db)
 
     # 今日预约
     today = datetime.now().date()
@@ -313,21 +483,29 @@ def get_dashboard_summary(db: Session):
         Appointment.appointment_time >= today_start
     ).order_by(Appointment.appointment_time).limit(5).all()
 
-    # 科室统计
-    departments = []
-    specialties = db.query(Doctor.specialty, func.count(Doctor.id)).group_by(Doctor.specialty).all()
-
-    for specialty, doctor_count in specialties:
-        appointment_count = db.query(Appointment).filter(
-            Appointment.doctor_name.in_(
-                db.query(Doctor.name).filter(Doctor.specialty == specialty)
-            )
-        ).count()
+    # 科室统计：医生来自目录缓存，热表预约按医生姓名分组计数，归档预约读按医生的归档计数
+    specialty_doctors: Dict[str, int] = {}
+    specialty_names: Dict[str, set] = {}
+    for record in directory.all(db):
+        specialty_doctors[record.specialty] = specialty_doctors.get(record.specialty, 0) + 1
+        specialty_names.setdefault(record.specialty, set()).add(record.name)
+
+    appointment_counts: Dict[str, int] = {}
+    if specialty_doctors:
+        appointment_counts = archive.archived_counts(db)
+        for name, count in (
+            db.query(Appointment.doctor_name, func.count(Appointment.id)).group_by(Appointment.doctor_name).all()
+        ):
+            appointment_counts[name] = appointment_counts.get(name, 0) + count
 
+    departments = []
+    for specialty in sorted(specialty_doctors):
         departments.append({
             "name": specialty,
-            "doctor_count": doctor_count,
-            "appointment_count": appointment_count
+            "doctor_count": specialty_doctors[specialty],
+            "appointment_count": sum(
+                appointment_counts.get(name, 0) for name in specialty_names[specialty]
+            )
         })
 
     return {
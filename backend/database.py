@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Request
 from dotenv import load_dotenv
+from typing import Callable, Dict, List, Optional
+import itertools
+import logging
 import os
+import threading
+import time
+
+logger = logging.getLogger("hospitalrun.database")
 
 # 加载.env文件中的环境变量
 load_dotenv()
@@ -10,19 +18,240 @@ load_dotenv()
 # 数据库URL - 从.env文件或环境变量读取
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 
+# 只读副本URL，多个用逗号分隔（未配置时所有请求都走主库）
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+
+# 副本允许的最大复制延迟（秒），超过则该副本暂停使用
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+
+# 副本延迟检测间隔（秒）
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "10"))
+
+# 是否输出SQL日志（逐条打印SQL开销很大，默认关闭）
+SQL_ECHO = os.getenv("SQL_ECHO", "").lower() in ("1", "true", "yes")
+
+# 连接池配置（每个工作进程一份，serve.py 按进程数自动设置）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+def engine_options(url: str) -> Dict:
+    """引擎参数；SQLite 使用 SQLAlchemy 默认连接池"""
+    options = {"echo": SQL_ECHO}
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return options
+
 # 创建SQLAlchemy引擎
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+# 只读副本引擎
+replica_engines = [create_engine(url, **engine_options(url)) for url in DATABASE_REPLICA_URLS]
+
+def dispose_engines():
+    """关闭主库和副本的所有连接（进程退出时调用）"""
+    engine.dispose()
+    for replica in replica_engines:
+        replica.dispose()
+
+
+# ============================================
+# 只读副本路由
+# ============================================
+
+def probe_replication_lag(replica) -> Optional[float]:
+    """
+    查询副本的复制延迟（秒）
+
+    返回 None 表示复制已中断或无法判断。SQLite 等没有复制的数据库视为无延迟。
+    """
+    dialect = replica.dialect.name
+    with replica.connect() as conn:
+        if dialect == "postgresql":
+            return conn.execute(text(
+                "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+            )).scalar()
+        if dialect in ("mysql", "mariadb"):
+            row = conn.execute(text("SHOW SLAVE STATUS")).mappings().first()
+            if row is None:
+                return 0.0
+            lag = row.get("Seconds_Behind_Master")
+            return None if lag is None else float(lag)
+    return 0.0
+
+
+class ReplicaSet:
+    """
+    只读副本集合
+
+    轮询选择副本；每个副本的延迟按 check_interval 缓存，
+    延迟超过 max_lag 或检测失败的副本被跳过，全部不可用时返回 None（回退主库）。
+
+    延迟检测在锁外执行，同一副本同一时间只有一个线程检测，其他线程使用上次的结果
+    （从未检测过视为不可用），慢或不可达的副本不会阻塞其他请求选择副本。
+    """
+
+    def __init__(
+        self,
+        engines: List,
+        max_lag: float = REPLICA_MAX_LAG_SECONDS,
+        check_interval: float = REPLICA_LAG_CHECK_INTERVAL,
+        lag_probe: Callable = probe_replication_lag,
+    ):
+        self.engines = list(engines)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag_probe = lag_probe
+        self._lock = threading.Lock()
+        self._cycle = itertools.cycle(range(len(self.engines))) if self.engines else None
+        self._lag: Dict[int, Optional[float]] = {}
+        self._checked_at: Dict[int, float] = {}
+        self._probe_locks = [threading.Lock() for _ in self.engines]
+        self.reads = [0] * len(self.engines)
+        self.fallbacks = 0
+
+    def _expired(self, index: int) -> bool:
+        return time.monotonic() - self._checked_at.get(index, float("-inf")) >= self.check_interval
+
+    def _current_lag(self, index: int) -> Optional[float]:
+        probe_lock = self._probe_locks[index]
+        if self._expired(index) and probe_lock.acquire(blocking=False):
+            try:
+                if self._expired(index):
+                    try:
+                        lag = self.lag_probe(self.engines[index])
+                    except Exception as exc:
+                        logger.warning("副本 %s 延迟检测失败: %s", index, exc)
+                        lag = None
+                    self._lag[index] = lag
+                    self._checked_at[index] = time.monotonic()
+            finally:
+                probe_lock.release()
+        return self._lag.get(index)
+
+    def is_healthy(self, index: int) -> bool:
+        lag = self._current_lag(index)
+        return lag is not None and lag <= self.max_lag
+
+    def choose(self):
+        """选择一个可用副本，没有可用副本时返回 None"""
+        if not self.engines:
+            return None
+        # 锁内只决定轮询顺序，健康检查（可能探测延迟）在锁外进行
+        count = len(self.engines)
+        with self._lock:
+            start = next(self._cycle)
+        for index in ((start + offset) % count for offset in range(count)):
+            if self.is_healthy(index):
+                with self._lock:
+                    self.reads[index] += 1
+                return self.engines[index]
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def stats(self) -> List[Dict]:
+        return [
+            {
+                "name": f"replica_{index}",
+                "lag_seconds": self._lag.get(index),
+                "reads": self.reads[index],
+                "pool": pool_stats(replica),
+            }
+            for index, replica in enumerate(self.engines)
+        ]
+
+
+replicas = ReplicaSet(replica_engines)
+
+
+class RoutingSession(Session):
+    """
+    读写分离会话
+
+    use_replica 为 True 时，SELECT 发往只读副本；
+    一旦会话执行过写操作（flush 或 INSERT/UPDATE/DELETE），
+    之后的读也留在主库，保证同一请求内读到自己的写入。
+    """
+
+    def __init__(self, *args, replica_set: Optional[ReplicaSet] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica_set = replica_set if replica_set is not None else replicas
+        self.use_replica = False
+        self._wrote = False
+        self._replica = None
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if self._flushing or (clause is not None and getattr(clause, "is_dml", False)):
+            self._wrote = True
+
+        if (
+            self.use_replica
+            and not self._wrote
+            and clause is not None
+            and getattr(clause, "is_select", False)
+        ):
+            # 同一会话固定使用一个副本，避免不同副本间延迟不一致
+            if self._replica is None:
+                self._replica = self.replica_set.choose()
+            if self._replica is not None:
+                return self._replica
+
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
 
 # 创建Session类
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
 
 # 创建Base类
 Base = declarative_base()
 
+# 只读请求方法，这些请求的查询可以走副本
+READ_ONLY_METHODS = ("GET", "HEAD")
+
 # 获取数据库会话
-def get_db():
+def get_db(request: Request = None):
     db = SessionLocal()
+    if request is not None and request.method in READ_ONLY_METHODS:
+        db.use_replica = True
     try:
         yield db
     finally:
         db.close()
+
+def get_read_session() -> Session:
+    """获取只读会话，供报表等非请求上下文的统计查询使用（调用方负责 close）"""
+    db = SessionLocal()
+    db.use_replica = True
+    return db
+
+
+# ============================================
+# 连接池统计
+# ============================================
+
+def pool_stats(target) -> Dict:
+    """单个引擎的连接池统计"""
+    pool = target.pool
+    stats = {"pool_class": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+def get_pool_stats() -> Dict:
+    """主库和所有副本的连接池及路由统计"""
+    return {
+        "primary": pool_stats(engine),
+        "replicas": replicas.stats(),
+        "replica_fallbacks": replicas.fallbacks,
+    }
@@ -0,0 +1,381 @@
+"""
+患者查重
+
+前台建档时同一位患者常被重复登记，姓名写法不同（同音字、拼音、空格）、电话格式不同
+（+86、横线）。患者两两比较是 O(n²)，在我们的数据量下不可行。这里先给每位患者算出几个
+分块键，只有分块键相同的患者才两两打分：
+
+- phone:<规范化电话>：只保留数字，去掉 86/0086 国家码
+- name:<姓名拼音>：汉字转拼音（安装了可选依赖 pypinyin 时），拉丁字母小写、去掉空格
+- initials:<首字母>:<年龄段>：拼音首字母加年龄段（每 DEDUPE_AGE_BUCKET 岁一段）；
+  未安装 pypinyin 时汉字姓名用“姓 + 字数”代替首字母，名字里的同音错字也能分到同一块
+
+分块键保存在 patient_block_keys 表中，按 (block_key, patient_id) 键集分页顺序读取，
+逐块比较、逐条产出合并建议，内存占用只与单个分块的大小有关。超过 DEDUPE_MAX_BLOCK 人的分块
+（如常见姓名首字母）区分度太低，直接跳过；同时在几个分块中的患者对在区分度最高（电话、姓名、
+首字母依次）且未超限的分块中比较，不会因为其中一个分块超限而漏掉。
+
+增量查重：指定 since_id 时，只读取新患者（ID 大于 since_id）的分块键，只比较包含新患者的分块。
+每次查重前先给尚未建立分块键的新患者补建（按患者ID递增，不拖慢建档）；修改过的患者的分块键
+不会自动更新，需要定期提交 rebuild=true 的全量查重任务重建。
+
+    GET /api/patients/duplicates?since_id=...   # 流式返回合并建议（JSON Lines）
+    POST /api/jobs {"kind": "patient_dedupe"}   # 后台任务，结果为 JSON Lines 文件
+"""
+import json
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from jobs import JobContext, register
+from models import Patient, PatientBlockKey
+from schemas import PatientDedupeParams
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # pragma: no cover - 可选依赖
+    lazy_pinyin = None
+
+# 每批读取的分块键/患者数
+DEDUPE_BATCH_SIZE = int(os.getenv("DEDUPE_BATCH_SIZE", "1000"))
+# 超过此人数的分块不比较
+DEDUPE_MAX_BLOCK = int(os.getenv("DEDUPE_MAX_BLOCK", "200"))
+# 年龄段宽度（岁）
+DEDUPE_AGE_BUCKET = int(os.getenv("DEDUPE_AGE_BUCKET", "10"))
+# 默认相似度下限
+DEFAULT_MIN_SCORE = 0.5
+
+MAX_KEY_LENGTH = 120
+
+# 单个汉字，或一串拉丁字母/数字
+_NAME_TOKEN = re.compile(r"[\u3400-\u9fff]|[a-z0-9]+")
+
+# 分块键按区分度从高到低
+_KEY_PREFERENCE = ("phone:", "name:", "initials:")
+
+_stats = {"runs": 0, "indexed": 0, "blocks": 0, "oversized_blocks": 0, "comparisons": 0, "suggestions": 0}
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """只保留数字并去掉国家码，不足7位视为无效"""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("0086"):
+        digits = digits[4:]
+    elif digits.startswith("86") and len(digits) == 13:
+        digits = digits[2:]
+    return digits if len(digits) >= 7 else ""
+
+
+def name_parts(name: Optional[str]) -> List[str]:
+    """姓名拆成音节：汉字逐字转拼音（未安装 pypinyin 时保留汉字），拉丁字母按空格等分词"""
+    text = unicodedata.normalize("NFKC", name or "").lower()
+    parts = []
+    for token in _NAME_TOKEN.findall(text):
+        if lazy_pinyin is not None and not token.isascii():
+            token = lazy_pinyin(token)[0]
+        parts.append(token)
+    return parts
+
+
+def initials(parts: Sequence[str]) -> str:
+    if all(part.isascii() for part in parts):
+        return "".join(part[0] for part in parts)
+    return f"{parts[0]}{len(parts)}"
+
+
+class PatientRecord:
+    """参与比较的患者字段"""
+    __slots__ = ("id", "name", "age", "gender", "phone", "parts", "normalized_phone")
+
+    def __init__(self, id: int, name: str, age: int, gender: str, phone: Optional[str]):
+        self.id = id
+        self.name = name
+        self.age = age
+        self.gender = gender
+        self.phone = phone
+        self.parts = name_parts(name)
+        self.normalized_phone = normalize_phone(phone)
+
+    def block_keys(self) -> List[str]:
+        keys = []
+        if self.normalized_phone:
+            keys.append(f"phone:{self.normalized_phone}")
+        if self.parts:
+            keys.append(f"name:{''.join(self.parts)}")
+            keys.append(f"initials:{initials(self.parts)}:{(self.age or 0) // DEDUPE_AGE_BUCKET}")
+        return [key[:MAX_KEY_LENGTH] for key in keys]
+
+
+_COLUMNS = (Patient.id, Patient.name, Patient.age, Patient.gender, Patient.phone)
+
+
+def score(a: PatientRecord, b: PatientRecord) -> Tuple[float, List[str]]:
+    """两位患者是同一人的可能性（0-1）及依据"""
+    total = 0.0
+    reasons = []
+    if a.normalized_phone and a.normalized_phone == b.normalized_phone:
+        total += 0.45
+        reasons.append("电话相同")
+    elif (a.normalized_phone and len(a.normalized_phone) == len(b.normalized_phone)
+          and sum(x != y for x, y in zip(a.normalized_phone, b.normalized_phone)) == 1):
+        total += 0.3
+        reasons.append("电话相差一位")
+
+    similarity = SequenceMatcher(None, "".join(a.parts), "".join(b.parts)).ratio()
+    total += 0.35 * similarity
+    if similarity == 1:
+        reasons.append("姓名相同")
+    elif similarity >= 0.6:
+        reasons.append("姓名相似")
+
+    age_diff = abs((a.age or 0) - (b.age or 0))
+    if age_diff <= 1:
+        total += 0.15
+        reasons.append("年龄相近")
+    elif age_diff <= 3:
+        total += 0.08
+
+    if a.gender == b.gender:
+        total += 0.05
+    else:
+        total *= 0.5
+        reasons.append("性别不同")
+    return round(total, 3), reasons
+
+
+# ============================================
+# 分块键维护
+# ============================================
+
+def _load_records(db: Session, ids: Sequence[int]) -> Dict[int, PatientRecord]:
+    return {row.id: PatientRecord(*row) for row in db.execute(select(*_COLUMNS).where(Patient.id.in_(ids)))}
+
+
+def _write_keys(db: Session, records: Sequence[PatientRecord]):
+    """替换一批患者的分块键（同一事务）"""
+    ids = [record.id for record in records]
+    db.execute(delete(PatientBlockKey).where(PatientBlockKey.patient_id.in_(ids)))
+    rows = [{"block_key": key, "patient_id": record.id} for record in records for key in set(record.block_keys())]
+    if rows:
+        db.execute(insert(PatientBlockKey), rows)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 其他进程同时为这批患者建了分块键
+        db.rollback()
+
+
+def index_patients(db: Session, after_id: int = 0, until_id: Optional[int] = None,
+                   batch_size: int = DEDUPE_BATCH_SIZE) -> int:
+    """为ID在 (after_id, until_id] 内的患者按ID分批（重新）建立分块键，返回患者数"""
+    done = 0
+    while True:
+        query = select(*_COLUMNS).where(Patient.id > after_id).order_by(Patient.id).limit(batch_size)
+        if until_id is not None:
+            query = query.where(Patient.id <= until_id)
+        records = [PatientRecord(*row) for row in db.execute(query)]
+        if records:
+            _write_keys(db, records)
+        done += len(records)
+        if len(records) < batch_size:
+            break
+        after_id = records[-1].id
+    _stats["indexed"] += done
+    return done
+
+
+def index_new_patients(db: Session, until_id: Optional[int] = None) -> int:
+    """为尚未建立分块键的新患者补建"""
+    last_indexed = db.execute(select(func.max(PatientBlockKey.patient_id))).scalar() or 0
+    return index_patients(db, last_indexed, until_id)
+
+
+def rebuild_index(db: Session, until_id: Optional[int] = None) -> int:
+    """重建全部患者的分块键（患者信息修改后使用）"""
+    db.execute(delete(PatientBlockKey))
+    db.commit()
+    return index_patients(db, 0, until_id)
+
+
+# ============================================
+# 逐块比较
+# ============================================
+
+def iter_blocks(db: Session, batch_size: int = DEDUPE_BATCH_SIZE) -> Iterator[Tuple[str, List[int]]]:
+    """按分块键顺序产出 (分块键, 患者ID列表)，只产出多于一人的分块；每批一个短查询"""
+    current_key, members = None, []
+    after = None
+    while True:
+        query = (
+            select(PatientBlockKey.block_key, PatientBlockKey.patient_id)
+            .order_by(PatientBlockKey.block_key, PatientBlockKey.patient_id)
+            .limit(batch_size)
+        )
+        if after is not None:
+            query = query.where(or_(
+                PatientBlockKey.block_key > after[0],
+                and_(PatientBlockKey.block_key == after[0], PatientBlockKey.patient_id > after[1]),
+            ))
+        rows = db.execute(query).all()
+        for key, patient_id in rows:
+            if key != current_key:
+                if len(members) > 1:
+                    yield current_key, members
+                current_key, members = key, []
+            # 超大分块只需要知道它超限，不再继续收集
+            if len(members) <= DEDUPE_MAX_BLOCK:
+                members.append(patient_id)
+        if len(rows) < batch_size:
+            break
+        after = (rows[-1].block_key, rows[-1].patient_id)
+    if len(members) > 1:
+        yield current_key, members
+
+
+def new_block_keys(db: Session, since_id: int, until_id: Optional[int] = None) -> List[str]:
+    """新患者（ID大于 since_id）的分块键"""
+    query = select(PatientBlockKey.block_key).where(PatientBlockKey.patient_id > since_id).distinct()
+    if until_id is not None:
+        query = query.where(PatientBlockKey.patient_id <= until_id)
+    return sorted(db.execute(query).scalars())
+
+
+def block_members(db: Session, block_key: str) -> List[int]:
+    return list(db.execute(
+        select(PatientBlockKey.patient_id)
+        .where(PatientBlockKey.block_key == block_key)
+        .order_by(PatientBlockKey.patient_id)
+        .limit(DEDUPE_MAX_BLOCK + 1)
+    ).scalars())
+
+
+def _key_rank(key: str) -> Tuple[int, str]:
+    rank = next((i for i, prefix in enumerate(_KEY_PREFERENCE) if key.startswith(prefix)), len(_KEY_PREFERENCE))
+    return rank, key
+
+
+def _comparable_members(db: Session, block_key: str, until_id: Optional[int] = None) -> List[int]:
+    """分块中参与比较的患者（与 find_duplicates 逐块读取时的范围一致，最多 DEDUPE_MAX_BLOCK + 1 人）"""
+    ids = block_members(db, block_key)
+    if until_id is not None:
+        ids = [patient_id for patient_id in ids if patient_id <= until_id]
+    return ids
+
+
+def compare_block(db: Session, block_key: str, ids: List[int], min_score: float,
+                  since_id: Optional[int] = None, stale: Optional[List[int]] = None,
+                  until_id: Optional[int] = None) -> Iterator[Dict]:
+    """
+    比较一个分块内的患者，产出合并建议
+
+    同一对患者可能同时在几个分块中（电话、姓名都相同），只在两人共有、区分度最高且未超限的分块中产出，
+    不需要记录已经比较过的患者对。指定 since_id 时只比较至少有一人是新患者的患者对。
+    """
+    _stats["blocks"] += 1
+    if len(ids) > DEDUPE_MAX_BLOCK:
+        _stats["oversized_blocks"] += 1
+        return
+    records = _load_records(db, ids)
+    if stale is not None:
+        # 已删除的患者，分块键稍后清理
+        stale.extend(patient_id for patient_id in ids if patient_id not in records)
+    ordered = [records[patient_id] for patient_id in ids if patient_id in records]
+    keys = {record.id: set(record.block_keys()) for record in ordered}
+    # 其他共有分块是否超限（每个分块最多查一次）
+    oversized = {block_key: False}
+
+    def preferred(shared):
+        for key in sorted(shared, key=_key_rank):
+            if key not in oversized:
+                oversized[key] = len(_comparable_members(db, key, until_id)) > DEDUPE_MAX_BLOCK
+            if not oversized[key]:
+                return key
+        return None
+
+    for i, a in enumerate(ordered):
+        for b in ordered[i + 1:]:
+            if since_id is not None and b.id <= since_id:
+                continue
+            shared = keys[a.id] & keys[b.id]
+            if shared and preferred(shared) not in (None, block_key):
+                continue
+            _stats["comparisons"] += 1
+            value, reasons = score(a, b)
+            if value < min_score:
+                continue
+            _stats["suggestions"] += 1
+            yield {
+                "patient_id": a.id,
+                "patient_name": a.name,
+                "duplicate_id": b.id,
+                "duplicate_name": b.name,
+                "score": value,
+                "reasons": reasons,
+                "block_key": block_key,
+            }
+
+
+def find_duplicates(db: Session, since_id: Optional[int] = None, until_id: Optional[int] = None,
+                    rebuild: bool = False, min_score: float = DEFAULT_MIN_SCORE,
+                    progress: Optional[Callable[[int], None]] = None) -> Iterator[Dict]:
+    """
+    逐条产出合并建议：patient_id 为较早建档的患者（建议保留），duplicate_id 为疑似重复的患者
+
+    since_id 为空时全量比较，否则只比较包含新患者的分块；until_id 之后建档的患者不参与。
+    progress(已比较的分块数) 每 DEDUPE_BATCH_SIZE 个分块调用一次。
+    """
+    _stats["runs"] += 1
+    if rebuild:
+        rebuild_index(db, until_id)
+    else:
+        index_new_patients(db, until_id)
+
+    if since_id is None:
+        blocks = iter_blocks(db)
+    else:
+        blocks = ((key, block_members(db, key)) for key in new_block_keys(db, since_id, until_id))
+
+    stale: List[int] = []
+    for done, (block_key, ids) in enumerate(blocks, 1):
+        if until_id is not None:
+            ids = [patient_id for patient_id in ids if patient_id <= until_id]
+        if len(ids) > 1:
+            yield from compare_block(db, block_key, ids, min_score, since_id, stale, until_id)
+        if progress is not None and done % DEDUPE_BATCH_SIZE == 0:
+            progress(done)
+
+    if stale:
+        db.execute(delete(PatientBlockKey).where(PatientBlockKey.patient_id.in_(set(stale))))
+        db.commit()
+
+
+def last_patient_id(db: Session) -> int:
+    """本次查重的患者ID上界，也是下一次增量查重的 since_id"""
+    return db.execute(select(func.max(Patient.id))).scalar() or 0
+
+
+@register("patient_dedupe", PatientDedupeParams, media_type="application/x-ndjson", suffix=".jsonl",
+          description="患者查重：按分块键比较，输出合并建议（JSON Lines），可只比较新患者")
+def run_patient_dedupe(context: JobContext, params: PatientDedupeParams, out) -> str:
+    # 分块键要写回主库，不使用只读副本
+    db = context.write_session()
+    try:
+        until_id = last_patient_id(db)
+        count = 0
+        for suggestion in find_duplicates(db, params.since_id, until_id, params.rebuild, params.min_score,
+                                          progress=lambda done: context.progress(done)):
+            out.write(json.dumps(suggestion, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        db.close()
+    return f"共 {count} 条合并建议，下次增量查重使用 since_id={until_id}"
+
+
+def get_stats() -> Dict:
+    return {"pinyin": lazy_pinyin is not None, **_stats}
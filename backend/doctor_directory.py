@@ -0,0 +1,198 @@
+"""
+医生目录缓存
+
+医生表数据量小、读多写少，预约列表补充医生信息和仪表盘科室统计都要查它。
+这里在进程内缓存整张医生表（按ID和姓名索引），首次使用时一次性加载：
+
+- crud 的 create/update/delete_doctor 写入后调用 doctor_saved / doctor_deleted 同步更新缓存
+- 多进程部署时通过 set_invalidation_publisher 注册广播函数（如 Redis pub/sub），
+  其他进程收到消息后调用 handle_remote_invalidation
+- 超过 DOCTOR_DIRECTORY_TTL 秒自动重新加载，作为跨进程失效的兜底
+"""
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Doctor
+
+# 目录缓存有效期（秒）
+DOCTOR_DIRECTORY_TTL = float(os.getenv("DOCTOR_DIRECTORY_TTL", "300"))
+
+
+class DoctorRecord:
+    """医生的紧凑只读快照"""
+    __slots__ = ("id", "name", "specialty", "experience", "phone", "status")
+
+    def __init__(self, id, name, specialty, experience, phone, status):
+        self.id = id
+        self.name = name
+        self.specialty = specialty
+        self.experience = experience
+        self.phone = phone
+        self.status = status
+
+    @classmethod
+    def from_doctor(cls, doctor) -> "DoctorRecord":
+        return cls(doctor.id, doctor.name, doctor.specialty, doctor.experience, doctor.phone, doctor.status)
+
+
+_COLUMNS = (Doctor.id, Doctor.name, Doctor.specialty, Doctor.experience, Doctor.phone, Doctor.status)
+
+
+class DoctorDirectory:
+    """单个数据库的医生目录"""
+
+    def __init__(self, ttl: float = DOCTOR_DIRECTORY_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._by_id: Dict[int, DoctorRecord] = {}
+        self._by_name: Dict[str, DoctorRecord] = {}
+        self._loaded_at: Optional[float] = None
+        self.loads = 0
+        self.hits = 0
+
+    def _index_name(self, record: DoctorRecord):
+        # 同名医生取ID最小的一位，与按姓名 .first() 查询的结果一致
+        current = self._by_name.get(record.name)
+        if current is None or record.id <= current.id:
+            self._by_name[record.name] = record
+
+    def _unindex_name(self, record: DoctorRecord):
+        if self._by_name.get(record.name) is record:
+            del self._by_name[record.name]
+            # 同名的其他医生补位
+            for other in self._by_id.values():
+                if other.name == record.name:
+                    self._index_name(other)
+
+    def _ensure_loaded(self, db: Session):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+            self.hits += 1
+            return
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            by_id = {}
+            for row in db.query(*_COLUMNS).order_by(Doctor.id):
+                by_id[row.id] = DoctorRecord(*row)
+            self._by_id = by_id
+            self._by_name = {}
+            for record in by_id.values():
+                self._index_name(record)
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+
+    def get(self, db: Session, doctor_id: int) -> Optional[DoctorRecord]:
+        self._ensure_loaded(db)
+        return self._by_id.get(doctor_id)
+
+    def get_by_name(self, db: Session, name: str) -> Optional[DoctorRecord]:
+        self._ensure_loaded(db)
+        return self._by_name.get(name)
+
+    def all(self, db: Session) -> List[DoctorRecord]:
+        self._ensure_loaded(db)
+        return list(self._by_id.values())
+
+    def count(self, db: Session) -> int:
+        self._ensure_loaded(db)
+        return len(self._by_id)
+
+    def put(self, record: DoctorRecord):
+        """写入或更新一条记录（未加载时忽略，下次使用时整体加载）"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            # 先移出旧记录再解除姓名索引，避免旧记录自己补位
+            previous = self._by_id.pop(record.id, None)
+            if previous is not None:
+                self._unindex_name(previous)
+            self._by_id[record.id] = record
+            self._index_name(record)
+
+    def discard(self, doctor_id: int):
+        with self._lock:
+            record = self._by_id.pop(doctor_id, None)
+            if record is not None:
+                self._unindex_name(record)
+
+    def invalidate(self):
+        """丢弃全部缓存，下次使用时重新加载"""
+        with self._lock:
+            self._loaded_at = None
+            self._by_id = {}
+            self._by_name = {}
+
+    def stats(self) -> Dict:
+        return {
+            "doctors": len(self._by_id),
+            "loads": self.loads,
+            "hits": self.hits,
+            "loaded": self._loaded_at is not None,
+        }
+
+
+# 每个数据库引擎一份目录（测试中每个用例使用独立的内存数据库）
+_directories: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_directories_lock = threading.Lock()
+
+# 跨进程失效广播函数，参数为医生ID（None 表示全部失效）
+_publisher: Optional[Callable[[Optional[int]], None]] = None
+
+
+def directory_for(db: Session) -> DoctorDirectory:
+    """获取会话所属数据库的医生目录"""
+    bind = db.get_bind()
+    directory = _directories.get(bind)
+    if directory is None:
+        with _directories_lock:
+            directory = _directories.setdefault(bind, DoctorDirectory())
+    return directory
+
+
+def set_invalidation_publisher(publisher: Optional[Callable[[Optional[int]], None]]):
+    """注册跨进程失效广播函数"""
+    global _publisher
+    _publisher = publisher
+
+
+def handle_remote_invalidation(doctor_id: Optional[int] = None):
+    """
+    其他进程修改了医生数据：丢弃本进程的目录
+
+    远端新增的医生本进程并没有记录，只丢弃单条无法让按姓名查找看到它，
+    所以无论 doctor_id 是否指定都整体重新加载（医生表很小，代价可以接受）。
+    """
+    for directory in list(_directories.values()):
+        directory.invalidate()
+
+
+def _publish(doctor_id: Optional[int]):
+    if _publisher is not None:
+        _publisher(doctor_id)
+
+
+def doctor_saved(db: Session, doctor):
+    """create_doctor / update_doctor 提交后调用"""
+    directory_for(db).put(DoctorRecord.from_doctor(doctor))
+    _publish(doctor.id)
+
+
+def doctor_deleted(db: Session, doctor_id: int):
+    """delete_doctor 提交后调用"""
+    directory_for(db).discard(doctor_id)
+    _publish(doctor_id)
+
+
+def get_stats() -> Dict:
+    directories = list(_directories.values())
+    return {
+        "directories": len(directories),
+        "doctors": sum(directory.stats()["doctors"] for directory in directories),
+        "loads": sum(directory.loads for directory in directories),
+        "hits": sum(directory.hits for directory in directories),
+    }
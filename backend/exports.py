@@ -0,0 +1,125 @@
+"""
+导出任务（在后台任务中执行，见 jobs.py）
+
+结果为带BOM的UTF-8 CSV（Excel可直接打开中文）。数据按主键分批读取（每批一个短查询），
+只取导出的列，内存占用与导出行数无关；每批写完汇报一次进度，取消时在批与批之间停止。
+"""
+import csv
+import os
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+import archive
+from jobs import JobContext, register
+from models import Appointment, ArchivedAppointment, Patient
+from schemas import AppointmentExportParams, PatientExportParams
+
+# 每批读取的行数
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# (字段, 表头)，第一列必须是 id（分批读取的游标）
+APPOINTMENT_COLUMNS = [
+    ("id", "预约ID"),
+    ("patient_name", "患者姓名"),
+    ("doctor_name", "医生姓名"),
+    ("appointment_time", "预约时间"),
+    ("status", "状态"),
+    ("reason", "预约原因"),
+    ("notes", "备注"),
+]
+PATIENT_COLUMNS = [
+    ("id", "患者ID"),
+    ("name", "姓名"),
+    ("age", "年龄"),
+    ("gender", "性别"),
+    ("phone", "联系电话"),
+    ("address", "地址"),
+    ("medical_condition", "病情"),
+    ("created_at", "建档时间"),
+]
+
+
+def month_range(month: str) -> Tuple[datetime, datetime]:
+    """'2024-05' → [2024-05-01, 2024-06-01)"""
+    year, number = (int(part) for part in month.split("-"))
+    return datetime(year, number, 1), datetime(year + number // 12, number % 12 + 1, 1)
+
+
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return getattr(value, "value", value)
+
+
+def write_rows(context: JobContext, db, model, filters: List, columns: Sequence[Tuple[str, str]],
+               writer, done: int = 0, total: Optional[int] = None) -> int:
+    """按主键分批读取 model 中满足 filters 的行写入 CSV，返回累计写出的行数"""
+    fields = [getattr(model, name) for name, _ in columns]
+    last_id = 0
+    while True:
+        rows = (
+            db.query(*fields)
+            .filter(*filters, model.id > last_id)
+            .order_by(model.id)
+            .limit(EXPORT_BATCH_SIZE)
+            .all()
+        )
+        for row in rows:
+            writer.writerow([_cell(value) for value in row])
+        done += len(rows)
+        context.progress(done, total)
+        if len(rows) < EXPORT_BATCH_SIZE:
+            return done
+        last_id = rows[-1][0]
+
+
+@register("appointments_export", AppointmentExportParams, media_type="text/csv", suffix=".csv",
+          encoding="utf-8-sig", description="导出预约（CSV），可按月份、医生、状态筛选")
+def export_appointments(context: JobContext, params: AppointmentExportParams, out) -> str:
+    start = end = None
+    if params.month:
+        start, end = month_range(params.month)
+
+    def filters(model):
+        conditions = []
+        if start is not None:
+            conditions += [model.appointment_time >= start, model.appointment_time < end]
+        if params.doctor_name:
+            conditions.append(model.doctor_name == params.doctor_name)
+        if params.status:
+            conditions.append(model.status == params.status.value)
+        return conditions
+
+    writer = csv.writer(out)
+    writer.writerow([title for _, title in APPOINTMENT_COLUMNS])
+    db = context.session()
+    try:
+        # 与预约列表相同：范围可能早于归档边界时也导出归档表
+        models = [Appointment]
+        archived_until = archive.archived_until(db)
+        if archived_until is not None and (start is None or start <= archived_until):
+            models.insert(0, ArchivedAppointment)
+        total = sum(db.query(model).filter(*filters(model)).count() for model in models)
+        done = 0
+        for model in models:
+            done = write_rows(context, db, model, filters(model), APPOINTMENT_COLUMNS, writer, done, total)
+    finally:
+        db.close()
+    return f"共导出 {done} 条预约"
+
+
+@register("patients_export", PatientExportParams, media_type="text/csv", suffix=".csv",
+          encoding="utf-8-sig", description="导出患者（CSV），可按性别筛选")
+def export_patients(context: JobContext, params: PatientExportParams, out) -> str:
+    conditions = [Patient.gender == params.gender.value] if params.gender else []
+    writer = csv.writer(out)
+    writer.writerow([title for _, title in PATIENT_COLUMNS])
+    db = context.session()
+    try:
+        total = db.query(Patient).filter(*conditions).count()
+        done = write_rows(context, db, Patient, conditions, PATIENT_COLUMNS, writer, total=total)
+    finally:
+        db.close()
+    return f"共导出 {done} 位患者"
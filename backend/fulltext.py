@@ -0,0 +1,355 @@
+"""
+统一搜索的倒排索引
+
+前台一个搜索框同时搜患者（姓名/电话/病情）、医生（姓名/科室）和预约（原因/备注）。
+逐表 LIKE '%x%' 要扫描三张表，这里在进程内为三张表各维护一个倒排索引：
+
+- 分词：文本规范化（全角转半角、小写）后，连续的汉字切成单字和相邻二元组（“感冒发烧” →
+  感 冒 发 烧 / 感冒 冒发 发烧），拉丁字母和数字按词切分。查询中两个字以上的汉字只用二元组，
+  单个汉字用单字，“发烧”只匹配相邻的“发烧”，不会匹配分开出现的“发”和“烧”
+- 倒排表：词 → {ID: 权重}，权重为该词所在字段的权重（姓名、电话高于病情、备注）
+- 查询：所有查询词都出现的记录才算命中（从最短的倒排表开始求交集），
+  得分为 Σ idf(词) × 权重，idf = ln(1 + 记录数 / 包含该词的记录数)
+
+crud 的创建、修改、删除提交后调用 entity_saved / entity_deleted 更新对应记录的词条。
+每 SEARCH_INDEX_TTL 秒用一条聚合查询（行数、最大ID、最大更新时间）与数据库核对，不一致
+（其他进程的写入、预约归档）时只读取ID大于最大ID、或更新时间不早于最大更新时间的行；补上后行数
+仍不一致说明有删除（归档），再只读ID列找出已不存在的记录移除。两步之后仍不一致（核对期间又有
+写入）才重建该表的索引。只索引预约热表，已归档的预约不参与搜索。
+"""
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import weakref
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from models import Appointment, Doctor, Patient
+
+# 与数据库核对的间隔（秒）
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "300"))
+# 每种类型最多参与排序的命中数
+SEARCH_MAX_HITS = int(os.getenv("SEARCH_MAX_HITS", "1000"))
+# 重建时每批读取的行数
+SEARCH_LOAD_BATCH = int(os.getenv("SEARCH_LOAD_BATCH", "5000"))
+
+# 连续的汉字，或一串拉丁字母/数字
+_TOKEN = re.compile(r"[\u3400-\u9fff]+|[a-z0-9]+")
+
+
+def _is_cjk(run: str) -> bool:
+    return "\u3400" <= run[0] <= "\u9fff"
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """建索引用：汉字切成单字和二元组，拉丁字母/数字按词"""
+    tokens = []
+    for run in _TOKEN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if _is_cjk(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def query_terms(text: Optional[str]) -> List[str]:
+    """查询用：两个字以上的汉字只取二元组，单个汉字取单字"""
+    terms = []
+    for run in _TOKEN.findall(unicodedata.normalize("NFKC", text or "").lower()):
+        if _is_cjk(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return list(dict.fromkeys(terms))
+
+
+class SearchType:
+    """一种可搜索的记录：字段权重、展示用的标题和副标题"""
+
+    def __init__(self, name: str, model, fields: Dict[str, float],
+                 title: Callable[[Dict], str], subtitle: Callable[[Dict], Optional[str]]):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.title = title
+        self.subtitle = subtitle
+        self.columns = sorted({"id", "updated_at", *fields, *_DISPLAY_COLUMNS.get(name, ())})
+
+
+_DISPLAY_COLUMNS = {
+    "patient": ("name", "phone", "medical_condition"),
+    "doctor": ("name", "specialty"),
+    "appointment": ("patient_name", "doctor_name", "appointment_time", "reason"),
+}
+
+SEARCH_TYPES: Dict[str, SearchType] = {
+    search_type.name: search_type for search_type in (
+        SearchType(
+            "patient", Patient, {"name": 3.0, "phone": 3.0, "medical_condition": 1.0},
+            title=lambda row: row["name"],
+            subtitle=lambda row: row["medical_condition"],
+        ),
+        SearchType(
+            "doctor", Doctor, {"name": 3.0, "specialty": 2.0},
+            title=lambda row: row["name"],
+            subtitle=lambda row: row["specialty"],
+        ),
+        SearchType(
+            "appointment", Appointment, {"reason": 1.0, "notes": 1.0},
+            title=lambda row: f"{row['patient_name']} - {row['doctor_name']}",
+            subtitle=lambda row: f"{row['appointment_time']:%Y-%m-%d %H:%M} {row['reason'] or ''}".strip(),
+        ),
+    )
+}
+
+
+class TableIndex:
+    """单个数据库单张表的倒排索引"""
+
+    def __init__(self, search_type: SearchType, ttl: float = SEARCH_INDEX_TTL):
+        self.search_type = search_type
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        # 记录ID → {词: 权重}，更新、删除时据此移除旧词条
+        self._docs: Dict[int, Dict[str, float]] = {}
+        # 记录ID → (标题, 副标题)
+        self._display: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._max_updated_at: Optional[datetime] = None
+        self._loaded = False
+        self._checked_at: Optional[float] = None
+        self.rebuilds = 0
+        self.refreshes = 0
+
+    def _add(self, row: Dict):
+        entity_id = row["id"]
+        terms: Dict[str, float] = {}
+        for field, weight in self.search_type.fields.items():
+            value = row.get(field)
+            for token in tokenize(getattr(value, "value", value)):
+                terms[token] = max(terms.get(token, 0.0), weight)
+        self._docs[entity_id] = terms
+        self._display[entity_id] = (self.search_type.title(row), self.search_type.subtitle(row))
+        for term, weight in terms.items():
+            self._postings.setdefault(term, {})[entity_id] = weight
+        updated_at = row.get("updated_at")
+        if updated_at is not None and (self._max_updated_at is None or updated_at > self._max_updated_at):
+            self._max_updated_at = updated_at
+
+    def _remove(self, entity_id: int):
+        terms = self._docs.pop(entity_id, None)
+        if terms is None:
+            return
+        del self._display[entity_id]
+        for term in terms:
+            ids = self._postings.get(term)
+            if ids is not None:
+                ids.pop(entity_id, None)
+                if not ids:
+                    del self._postings[term]
+
+    def put(self, row: Dict):
+        """写入或更新一条记录（未加载时忽略，下次使用时整体加载）"""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(row["id"])
+            self._add(row)
+
+    def discard(self, entity_id: int):
+        with self._lock:
+            self._remove(entity_id)
+
+    def _signature(self) -> Tuple:
+        return len(self._docs), max(self._docs, default=None), self._max_updated_at
+
+    def _db_signature(self, db: Session) -> Tuple:
+        model = self.search_type.model
+        return tuple(db.execute(select(func.count(model.id), func.max(model.id), func.max(model.updated_at))).one())
+
+    def _rebuild(self, db: Session):
+        model = self.search_type.model
+        columns = [getattr(model, name) for name in self.search_type.columns]
+        self._docs, self._display, self._postings, self._max_updated_at = {}, {}, {}, None
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(*columns).where(model.id > last_id).order_by(model.id).limit(SEARCH_LOAD_BATCH)
+            ).all()
+            for row in rows:
+                self._add(dict(row._mapping))
+            if len(rows) < SEARCH_LOAD_BATCH:
+                break
+            last_id = rows[-1].id
+        self.rebuilds += 1
+        _stats["rebuilds"] += 1
+
+    def _load_changes(self, db: Session):
+        """读取其他进程的新增和修改：ID大于内存中的最大ID，或更新时间不早于最大更新时间"""
+        model = self.search_type.model
+        columns = [getattr(model, name) for name in self.search_type.columns]
+        changed = model.id > max(self._docs, default=0)
+        if self._max_updated_at is not None:
+            # 更新时间可能只精确到秒，同一秒内的修改也要读到
+            changed = or_(changed, model.updated_at > self._max_updated_at - timedelta(seconds=1))
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(*columns).where(changed, model.id > last_id).order_by(model.id).limit(SEARCH_LOAD_BATCH)
+            ).all()
+            for row in rows:
+                row = dict(row._mapping)
+                self._remove(row["id"])
+                self._add(row)
+            if len(rows) < SEARCH_LOAD_BATCH:
+                break
+            last_id = rows[-1].id
+
+    def _remove_deleted(self, db: Session):
+        """只读ID列，移除表中已不存在的记录（其他进程删除、预约归档）"""
+        model = self.search_type.model
+        existing = set()
+        last_id = 0
+        while True:
+            ids = db.execute(
+                select(model.id).where(model.id > last_id).order_by(model.id).limit(SEARCH_LOAD_BATCH)
+            ).scalars().all()
+            existing.update(ids)
+            if len(ids) < SEARCH_LOAD_BATCH:
+                break
+            last_id = ids[-1]
+        for entity_id in [entity_id for entity_id in self._docs if entity_id not in existing]:
+            self._remove(entity_id)
+
+    def _ensure_fresh(self, db: Session):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+                return
+            if self._loaded and self._signature() != self._db_signature(db):
+                self._load_changes(db)
+                signature = self._db_signature(db)
+                if len(self._docs) != signature[0]:
+                    self._remove_deleted(db)
+                    # 被删除的可能正是更新时间最大的记录
+                    self._max_updated_at = signature[2]
+                self.refreshes += 1
+            if not self._loaded or self._signature() != self._db_signature(db):
+                self._rebuild(db)
+                self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """下次使用时与数据库核对"""
+        self._checked_at = None
+
+    def search(self, db: Session, terms: Sequence[str],
+               limit: int = SEARCH_MAX_HITS) -> Tuple[int, List[Tuple[float, int, Tuple[str, Optional[str]]]]]:
+        """返回 (命中总数, 得分最高的 limit 个 (得分, ID, (标题, 副标题)))；标题在锁内取出，不受之后的删除影响"""
+        self._ensure_fresh(db)
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if not postings or any(ids is None for ids in postings):
+                return 0, []
+            postings.sort(key=len)
+            matched = set(postings[0])
+            for ids in postings[1:]:
+                matched.intersection_update(ids)
+                if not matched:
+                    return 0, []
+            total_docs = len(self._docs)
+            idf = [math.log(1 + total_docs / len(ids)) for ids in postings]
+            scored = [
+                (sum(weight * ids[entity_id] for weight, ids in zip(idf, postings)), entity_id)
+                for entity_id in matched
+            ]
+            top = heapq.nlargest(limit, scored, key=lambda item: (item[0], item[1]))
+            return len(scored), [(score, entity_id, self._display[entity_id]) for score, entity_id in top]
+
+    def stats(self) -> Dict:
+        return {"documents": len(self._docs), "terms": len(self._postings), "rebuilds": self.rebuilds,
+                "refreshes": self.refreshes}
+
+
+# 每个数据库引擎一套索引：{类型: TableIndex}
+_indexes: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+# 重建次数按模块累计：索引随引擎回收后不会减少
+_stats = {"queries": 0, "rebuilds": 0}
+
+
+def index_for(db: Session, type_name: str) -> TableIndex:
+    bind = db.get_bind()
+    indexes = _indexes.get(bind)
+    if indexes is None:
+        with _indexes_lock:
+            indexes = _indexes.setdefault(
+                bind, {name: TableIndex(search_type) for name, search_type in SEARCH_TYPES.items()}
+            )
+    return indexes[type_name]
+
+
+def _type_of(model) -> str:
+    for name, search_type in SEARCH_TYPES.items():
+        if search_type.model is model:
+            return name
+    raise KeyError(model.__tablename__)
+
+
+def search(db: Session, q: str, types: Optional[Sequence[str]] = None, skip: int = 0,
+           limit: int = 20) -> Tuple[List[Dict], int]:
+    """跨类型搜索，返回 (按得分排序的一页结果, 命中总数)"""
+    terms = query_terms(q)
+    if not terms:
+        return [], 0
+    _stats["queries"] += 1
+    total = 0
+    hits = []
+    for type_name in types or SEARCH_TYPES:
+        index = index_for(db, type_name)
+        count, top = index.search(db, terms)
+        total += count
+        hits.extend((score, type_name, entity_id, display) for score, entity_id, display in top)
+    # 得分相同时按类型顺序、ID从新到旧
+    order = list(SEARCH_TYPES)
+    hits.sort(key=lambda hit: (-hit[0], order.index(hit[1]), -hit[2]))
+    results = []
+    for score, type_name, entity_id, (title, subtitle) in hits[skip:skip + limit]:
+        results.append({
+            "type": type_name,
+            "id": entity_id,
+            "score": round(score, 4),
+            "title": title,
+            "subtitle": subtitle,
+        })
+    return results, total
+
+
+def entity_saved(db: Session, entity):
+    """crud 创建、修改提交后调用"""
+    search_type = SEARCH_TYPES[_type_of(type(entity))]
+    index_for(db, search_type.name).put({column: getattr(entity, column) for column in search_type.columns})
+
+
+def entity_deleted(db: Session, model, entity_id: int):
+    """crud 删除提交后调用"""
+    index_for(db, _type_of(model)).discard(entity_id)
+
+
+def get_stats() -> Dict:
+    totals = {"documents": 0, "terms": 0}
+    for indexes in list(_indexes.values()):
+        for index in list(indexes.values()):
+            stats = index.stats()
+            totals["documents"] += stats["documents"]
+            totals["terms"] += stats["terms"]
+    return {**_stats, **totals}
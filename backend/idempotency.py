@@ -0,0 +1,248 @@
+"""
+POST 接口的幂等键
+
+诊所网络不稳定，前端会重试 POST /api/appointments、POST /api/patients，产生重复记录。
+客户端在请求头中带 Idempotency-Key（每次新建操作生成一个UUID，重试时保持不变）：
+
+- 第一次请求：插入一条“处理中”记录占住这个键（主键唯一，并发的重复请求只有一个能插入成功），
+  执行创建，把响应状态码和响应体写回这条记录（创建与响应在同一事务中提交）
+- 重试：直接返回保存的响应（响应头 Idempotent-Replayed: true），不再调用 crud.create_*
+- 并发的重复请求：短暂轮询等待第一次请求完成后返回同一响应，等待超时返回 409
+- 同一个键、不同的请求体：返回 422
+- 创建失败时删除记录，客户端可以用同一个键重试；处理中断时创建不会提交，
+  记录超过 IDEMPOTENCY_LOCK_TIMEOUT 后可以被重新占用
+
+记录保留 IDEMPOTENCY_TTL_HOURS 小时，过期记录在请求时顺带分批清理，
+也可以用 python manage.py cleanup-idempotency 定时清理。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Union
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+
+import crud
+from models import IdempotencyRecord
+
+# 记录保留时间（小时）
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# 并发的重复请求最多等待第一次请求完成的时间（秒）
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "2"))
+# “处理中”记录超过此时间（秒）视为第一次请求已中断，可以被重新占用
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "30"))
+# 每占用多少个键顺带清理一批过期记录
+IDEMPOTENCY_CLEANUP_EVERY = int(os.getenv("IDEMPOTENCY_CLEANUP_EVERY", "100"))
+IDEMPOTENCY_CLEANUP_BATCH = 500
+
+MAX_KEY_LENGTH = 128
+POLL_INTERVAL = 0.05
+REPLAY_HEADER = "Idempotent-Replayed"
+
+_stats = {"executed": 0, "replayed": 0, "waited": 0, "in_progress_conflicts": 0, "mismatches": 0, "cleaned": 0}
+
+
+def request_hash(payload) -> str:
+    """请求体摘要：字段排序后的紧凑JSON的 SHA-256"""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump(mode="json")
+    data = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _replay(record: IdempotencyRecord) -> Response:
+    _stats["replayed"] += 1
+    return Response(
+        content=record.response_body,
+        status_code=record.status_code,
+        media_type="application/json",
+        headers={REPLAY_HEADER: "true"},
+    )
+
+
+def _claim(db: Session, scope: str, key: str, digest: str, now: datetime) -> bool:
+    """插入“处理中”记录占住键，成功返回 True；键已存在返回 False"""
+    db.add(IdempotencyRecord(
+        scope=scope, key=key, request_hash=digest,
+        created_at=now, expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+    ))
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+
+
+def _load(db: Session, scope: str, key: str) -> Optional[IdempotencyRecord]:
+    db.expire_all()
+    return db.get(IdempotencyRecord, (scope, key))
+
+
+def _release(db: Session, scope: str, key: str, claimed_at: datetime):
+    """删除本次请求占用的记录（已被其他请求重新占用时不删除）"""
+    db.rollback()
+    db.execute(
+        delete(IdempotencyRecord)
+        .where(
+            IdempotencyRecord.scope == scope,
+            IdempotencyRecord.key == key,
+            IdempotencyRecord.created_at == claimed_at,
+        )
+    )
+    db.commit()
+
+
+class _ClaimLost(Exception):
+    """保存响应时记录已被其他请求重新占用"""
+
+
+def _takeover(db: Session, record: IdempotencyRecord, digest: str, now: datetime) -> bool:
+    """重新占用已过期或处理中断的记录（条件更新，并发时只有一个成功）"""
+    result = db.execute(
+        update(IdempotencyRecord)
+        .where(
+            IdempotencyRecord.scope == record.scope,
+            IdempotencyRecord.key == record.key,
+            IdempotencyRecord.created_at == record.created_at,
+        )
+        .values(
+            request_hash=digest, status_code=None, response_body=None,
+            created_at=now, expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+        )
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def cleanup_expired(db: Session, batch_size: int = IDEMPOTENCY_CLEANUP_BATCH, now: Optional[datetime] = None) -> int:
+    """删除一批过期记录，返回删除数量"""
+    now = now or datetime.now()
+    expired = [
+        row.key for row in db.query(IdempotencyRecord.scope, IdempotencyRecord.key)
+        .filter(IdempotencyRecord.expires_at < now)
+        .limit(batch_size)
+    ]
+    if not expired:
+        return 0
+    result = db.execute(
+        delete(IdempotencyRecord)
+        .where(IdempotencyRecord.expires_at < now, IdempotencyRecord.key.in_(expired))
+    )
+    db.commit()
+    _stats["cleaned"] += result.rowcount
+    return result.rowcount
+
+
+def cleanup_all_expired(db: Session, batch_size: int = IDEMPOTENCY_CLEANUP_BATCH) -> int:
+    total = 0
+    while True:
+        deleted = cleanup_expired(db, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+async def execute(
+    db: Session,
+    scope: str,
+    key: Optional[str],
+    payload,
+    handler: Callable[[], Union[BaseModel, Response]],
+    status_code: int = 200,
+):
+    """
+    以幂等方式执行 handler（负责创建并返回响应模型，在线程池中执行）
+
+    key 为空时直接执行 handler，与不支持幂等键时的行为相同。
+    """
+    if key is None:
+        return await run_in_threadpool(handler)
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key 长度必须在 1-{MAX_KEY_LENGTH} 之间")
+
+    digest = request_hash(payload)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    waited = False
+    while True:
+        now = datetime.now()
+        if _claim(db, scope, key, digest, now):
+            break
+        record = _load(db, scope, key)
+        if record is None:
+            continue  # 记录刚被删除（第一次请求失败），重新占用
+        if record.expires_at < now or (
+            record.status_code is None
+            and record.created_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+        ):
+            if _takeover(db, record, digest, now):
+                break
+            continue
+        if record.request_hash != digest:
+            _stats["mismatches"] += 1
+            raise HTTPException(status_code=422, detail="Idempotency-Key 已用于内容不同的请求")
+        if record.status_code is not None:
+            return _replay(record)
+        # 第一次请求仍在处理中：短暂等待
+        if time.monotonic() >= deadline:
+            _stats["in_progress_conflicts"] += 1
+            raise HTTPException(
+                status_code=409, detail="相同 Idempotency-Key 的请求正在处理中", headers={"Retry-After": "1"}
+            )
+        if not waited:
+            _stats["waited"] += 1
+            waited = True
+        await asyncio.sleep(POLL_INTERVAL)
+
+    _stats["executed"] += 1
+    if _stats["executed"] % IDEMPOTENCY_CLEANUP_EVERY == 0:
+        cleanup_expired(db)
+
+    body = await run_in_threadpool(_run, db, scope, key, now, handler, status_code)
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def _run(db: Session, scope: str, key: str, claimed_at: datetime, handler: Callable, status_code: int) -> str:
+    """
+    执行 handler 并保存响应，创建与响应在同一事务中提交：
+    中途崩溃时两者都不提交，记录保持“处理中”，超时后被重新占用也不会重复创建
+    """
+    try:
+        with crud.single_transaction(db):
+            response = handler()
+            body = json.dumps(jsonable_encoder(response), ensure_ascii=False, separators=(",", ":"))
+            # 条件更新：处理太慢、记录已被其他请求重新占用时放弃本次创建
+            result = db.execute(
+                update(IdempotencyRecord)
+                .where(
+                    IdempotencyRecord.scope == scope,
+                    IdempotencyRecord.key == key,
+                    IdempotencyRecord.created_at == claimed_at,
+                )
+                .values(status_code=status_code, response_body=body)
+            )
+            if result.rowcount != 1:
+                raise _ClaimLost()
+    except _ClaimLost:
+        _stats["in_progress_conflicts"] += 1
+        raise HTTPException(
+            status_code=409, detail="相同 Idempotency-Key 的请求正在处理中", headers={"Retry-After": "1"}
+        )
+    except BaseException:
+        _release(db, scope, key, claimed_at)
+        raise
+    return body
+
+
+def get_stats() -> Dict:
+    return dict(_stats)
@@ -0,0 +1,343 @@
+"""
+后台任务
+
+月度报表、导出等耗时计算放在请求处理函数里执行，会长时间占用一个数据库连接和一个Web工作线程，
+挤占挂号等交互请求。这里把它们作为后台任务交给进程池执行：
+
+- 提交：POST /api/jobs 在 jobs 表中写入一条 queued 记录后立即返回任务ID
+- 执行：进程池中的工作进程执行任务，结果写入 JOB_RESULT_DIR 下的文件
+- 进度：任务函数调用 context.progress(done, total)，按 JOB_PROGRESS_INTERVAL 秒节流写回 jobs 表
+- 取消：DELETE /api/jobs/{id}，排队中的任务直接取消，运行中的任务在下一次汇报进度时停止
+- 下载：GET /api/jobs/{id}/result，结果文件保留 JOB_RESULT_TTL_HOURS 小时
+- 并发上限：最多 JOB_MAX_CONCURRENT 个任务同时执行，排队的任务超过 JOB_MAX_QUEUED 时拒绝提交
+
+任务状态全部保存在 jobs 表中，多个Web进程（各自有进程池）之间查询和取消的结果一致。
+任务类型用 register 注册，注册任务类型的模块列在 JOB_MODULES 中，工作进程按需导入。
+"""
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Type
+
+from pydantic import BaseModel
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from models import Job
+
+logger = logging.getLogger("hospitalrun.jobs")
+
+# 执行器：process（进程池，默认）或 thread（线程池，适合开发环境）
+JOB_EXECUTOR = os.getenv("JOB_EXECUTOR", "process")
+# 同时执行的任务数上限（每个Web进程）
+JOB_MAX_CONCURRENT = int(os.getenv("JOB_MAX_CONCURRENT", "2"))
+# 排队等待执行的任务数上限（每个Web进程）
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "20"))
+# 结果文件目录
+JOB_RESULT_DIR = os.getenv("JOB_RESULT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "job_results"))
+# 结果文件和任务记录的保留时间（小时）
+JOB_RESULT_TTL_HOURS = float(os.getenv("JOB_RESULT_TTL_HOURS", "24"))
+# 进度写回数据库的最小间隔（秒）
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1"))
+# 排队/运行中的任务超过此时间（秒）没有任何更新，视为工作进程已退出，标记为失败
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "3600"))
+
+# 注册任务类型的模块
+JOB_MODULES = ["exports", "reports", "dedupe"]
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+CLEANUP_BATCH = 500
+
+
+class JobKind:
+    """任务类型：func(context, params, out) 把结果写入文本文件 out，返回完成说明"""
+
+    __slots__ = ("name", "func", "params_schema", "media_type", "suffix", "encoding", "description")
+
+    def __init__(self, name: str, func: Callable, params_schema: Type[BaseModel], media_type: str,
+                 suffix: str, encoding: str, description: str):
+        self.name = name
+        self.func = func
+        self.params_schema = params_schema
+        self.media_type = media_type
+        self.suffix = suffix
+        self.encoding = encoding
+        self.description = description
+
+
+JOB_KINDS: Dict[str, JobKind] = {}
+
+
+def register(name: str, params_schema: Type[BaseModel], media_type: str = "application/json",
+             suffix: str = ".json", encoding: str = "utf-8", description: str = ""):
+    """注册任务类型的装饰器"""
+    def decorator(func):
+        JOB_KINDS[name] = JobKind(name, func, params_schema, media_type, suffix, encoding, description)
+        return func
+    return decorator
+
+
+def load_kinds():
+    for module in JOB_MODULES:
+        importlib.import_module(module)
+
+
+class JobCancelled(Exception):
+    """任务已被取消（由 JobContext.progress 抛出）"""
+
+
+class JobQueueFull(Exception):
+    """排队的任务已达上限"""
+
+
+class JobContext:
+    """传给任务函数：打开数据库会话、汇报进度、响应取消"""
+
+    def __init__(self, job_id: str, session_factory: Callable[[], Session],
+                 read_session_factory: Callable[[], Session], interval: float = JOB_PROGRESS_INTERVAL):
+        self.job_id = job_id
+        self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self.interval = interval
+        self._last = time.monotonic()
+
+    def session(self) -> Session:
+        """读取业务数据用的会话（有只读副本时走副本，调用方负责 close）"""
+        return self._read_session_factory()
+
+    def write_session(self) -> Session:
+        """需要写入业务数据时使用的主库会话（调用方负责 close）"""
+        return self._session_factory()
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None, force: bool = False):
+        """汇报进度并检查取消；距上次写入不足 interval 秒时直接返回"""
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        values = {"updated_at": datetime.now()}
+        if total:
+            values["progress"] = min(99, done * 100 // total)
+        if message:
+            values["message"] = message[:200]
+        with self._session_factory() as db:
+            db.execute(update(Job).where(Job.id == self.job_id).values(**values))
+            db.commit()
+            cancel_requested = db.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+def _remove(path: Optional[str]):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _finish(session_factory: Callable[[], Session], job_id: str, status: str, **values):
+    now = datetime.now()
+    with session_factory() as db:
+        db.execute(
+            update(Job).where(Job.id == job_id).values(
+                status=status, finished_at=now, updated_at=now,
+                expires_at=now + timedelta(hours=JOB_RESULT_TTL_HOURS), **values
+            )
+        )
+        db.commit()
+
+
+def run_job(job_id: str, result_dir: str, session_factory: Optional[Callable[[], Session]] = None) -> Optional[str]:
+    """
+    执行一个任务，返回最终状态（进程池的入口，参数必须可以 pickle）
+
+    session_factory 为空时使用 database.SessionLocal（工作进程自己的连接池）；
+    线程池执行时由 JobManager 传入。
+    """
+    if session_factory is None:
+        from database import SessionLocal, get_read_session
+        session_factory, read_session_factory = SessionLocal, get_read_session
+    else:
+        read_session_factory = session_factory
+    load_kinds()
+
+    now = datetime.now()
+    with session_factory() as db:
+        # 条件更新：已取消的任务不再执行
+        started = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == QUEUED, Job.cancel_requested.is_(False))
+            .values(status=RUNNING, started_at=now, updated_at=now)
+        ).rowcount
+        db.commit()
+        if not started:
+            return None
+        job = db.get(Job, job_id)
+        kind, params = job.kind, json.loads(job.params or "{}")
+
+    spec = JOB_KINDS[kind]
+    os.makedirs(result_dir, exist_ok=True)
+    path = os.path.join(result_dir, job_id + spec.suffix)
+    partial = path + ".part"
+    context = JobContext(job_id, session_factory, read_session_factory)
+    try:
+        with open(partial, "w", encoding=spec.encoding, newline="") as out:
+            message = spec.func(context, spec.params_schema(**params), out)
+        os.replace(partial, path)
+    except JobCancelled:
+        _remove(partial)
+        _finish(session_factory, job_id, CANCELLED, message="已取消")
+        return CANCELLED
+    except Exception as exc:
+        logger.exception("后台任务 %s（%s）失败", job_id, kind)
+        _remove(partial)
+        _finish(session_factory, job_id, FAILED, error=str(exc)[:2000])
+        return FAILED
+
+    _finish(
+        session_factory, job_id, SUCCEEDED, progress=100, message=message,
+        result_path=path, result_size=os.path.getsize(path),
+    )
+    return SUCCEEDED
+
+
+class JobManager:
+    """提交任务到执行器，跟踪本进程提交的任务"""
+
+    def __init__(self, executor: Optional[Executor] = None, session_factory: Optional[Callable[[], Session]] = None,
+                 result_dir: str = JOB_RESULT_DIR, max_concurrent: int = JOB_MAX_CONCURRENT,
+                 max_queued: int = JOB_MAX_QUEUED):
+        self._executor = executor
+        # 只在线程池执行时传给 run_job（sessionmaker 不能 pickle 到工作进程）
+        self.session_factory = session_factory
+        self.result_dir = result_dir
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._futures: Dict[str, Future] = {}
+        self.submitted = 0
+        self.rejected = 0
+
+    @property
+    def executor(self) -> Executor:
+        # 第一次提交任务时才创建（不拖慢Web进程启动）
+        if self._executor is None:
+            if JOB_EXECUTOR == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="job")
+            else:
+                # spawn：工作进程不继承Web进程的事件循环、线程和数据库连接
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_concurrent, mp_context=multiprocessing.get_context("spawn")
+                )
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        """本进程提交、尚未结束的任务数（执行中 + 排队中）"""
+        return sum(1 for future in self._futures.values() if not future.done())
+
+    def submit(self, db: Session, kind: str, params: Dict) -> Job:
+        if self.pending >= self.max_concurrent + self.max_queued:
+            self.rejected += 1
+            raise JobQueueFull()
+        self.cleanup(db)
+
+        now = datetime.now()
+        job = Job(
+            id=uuid.uuid4().hex, kind=kind, params=json.dumps(params, ensure_ascii=False),
+            status=QUEUED, progress=0, cancel_requested=False, created_at=now, updated_at=now,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+
+        future = self.executor.submit(run_job, job.id, self.result_dir, self.session_factory)
+        self._futures[job.id] = future
+        future.add_done_callback(lambda _, job_id=job.id: self._futures.pop(job_id, None))
+        self.submitted += 1
+        return job
+
+    def cancel(self, db: Session, job_id: str) -> Optional[Job]:
+        """请求取消任务；任务不存在返回 None"""
+        job = db.get(Job, job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+        now = datetime.now()
+        # 排队中的任务直接标记为已取消（工作进程开始执行时的条件更新会跳过它）
+        db.execute(
+            update(Job).where(Job.id == job_id, Job.status == QUEUED).values(
+                status=CANCELLED, cancel_requested=True, message="已取消", finished_at=now, updated_at=now,
+                expires_at=now + timedelta(hours=JOB_RESULT_TTL_HOURS),
+            )
+        )
+        db.execute(update(Job).where(Job.id == job_id, Job.status == RUNNING).values(cancel_requested=True))
+        db.commit()
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+        db.refresh(job)
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None):
+        """等待本进程提交的任务结束"""
+        future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+
+    def cleanup(self, db: Session, now: Optional[datetime] = None) -> int:
+        """删除一批过期的任务记录和结果文件，返回删除数量；长时间没有更新的任务标记为失败"""
+        now = now or datetime.now()
+        db.execute(
+            update(Job)
+            .where(Job.status.in_(ACTIVE_STATUSES), Job.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS))
+            .values(
+                status=FAILED, error="任务长时间没有进度更新（工作进程可能已退出）", finished_at=now,
+                expires_at=now + timedelta(hours=JOB_RESULT_TTL_HOURS),
+            )
+        )
+        expired = db.query(Job).filter(Job.expires_at < now).limit(CLEANUP_BATCH).all()
+        for job in expired:
+            _remove(job.result_path)
+            db.delete(job)
+        db.commit()
+        return len(expired)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+manager = JobManager()
+
+
+def get_manager() -> JobManager:
+    """路由依赖（测试中可替换为使用线程池的 JobManager）"""
+    return manager
+
+
+def get_stats() -> Dict:
+    return {
+        "executor": JOB_EXECUTOR,
+        "max_concurrent": manager.max_concurrent,
+        "max_queued": manager.max_queued,
+        "pending": manager.pending,
+        "submitted": manager.submitted,
+        "rejected": manager.rejected,
+    }
@@ -1,19 +1,42 @@
+import asyncio
+import os
+
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import uvicorn
+
+from admission import AdmissionControlMiddleware
+from coalescing import RequestCoalescingMiddleware
+from compression import CompressionMiddleware
+from database import dispose_engines, get_pool_stats
+import admission
+import archive
+import cache
+import changelog
+import coalescing
+import dedupe
+import doctor_directory
+import fulltext
+import idempotency
+import jobs
+import name_index
+import reminders
+import waiting_list
 
 # 导入路由
 from routes.patients import router as patients_router
 from routes.doctors import router as doctors_router
 from routes.appointments import router as appointments_router
 from routes.dashboard import router as dashboard_router
+from routes.jobs import router as jobs_router
+from routes.reports import router as reports_router
+from routes.waiting_list import router as waiting_list_router
+from routes.autocomplete import router as autocomplete_router
+from routes.search import router as search_router
+from routes.changes import router as changes_router
 
-# 创建数据库表
-from database import Base, engine
-from models import Patient, Doctor, Appointment
+# 启动时是否自动建表（默认关闭，生产环境使用 python manage.py init-db）
+AUTO_CREATE_TABLES = os.getenv("AUTO_CREATE_TABLES", "").lower() in ("1", "true", "yes")
 
 # 创建应用
 app = FastAPI(
@@ -24,6 +47,12 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# 准入控制：按路由类别限制并发，过载时快速返回503（放在CORS内侧，503响应也带CORS头）
+app.add_middleware(AdmissionControlMiddleware)
+
+# 合并白名单路径上相同的并发GET请求（在准入控制外侧，被合并的请求不占用并发名额）
+app.add_middleware(RequestCoalescingMiddleware)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -33,6 +62,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩（zstd/br/gzip协商，阈值和级别见 compression.py 的环境变量）
+app.add_middleware(CompressionMiddleware)
+
 # 异常处理器
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -53,6 +85,12 @@ app.include_router(patients_router, prefix="/api")
 app.include_router(doctors_router, prefix="/api")
 app.include_router(appointments_router, prefix="/api")
 app.include_router(dashboard_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+app.include_router(reports_router, prefix="/api")
+app.include_router(waiting_list_router, prefix="/api")
+app.include_router(autocomplete_router, prefix="/api")
+app.include_router(search_router, prefix="/api")
+app.include_router(changes_router, prefix="/api")
 
 # 健康检查端点
 @app.get("/health", tags=["health"])
@@ -60,12 +98,92 @@ async def health_check():
     """健康检查接口"""
     return {"status": "healthy"}
 
-# 创建数据库表
-@app.on_event("startup")
-async def create_tables():
-    """应用启动时创建数据库表"""
-    Base.metadata.create_all(bind=engine)
-    print("数据库表创建完成")
+# 运行指标
+@app.get("/metrics", tags=["health"])
+async def metrics():
+    """运行指标：数据库连接池、读写分离和缓存统计"""
+    return {
+        "database": get_pool_stats(),
+        "doctor_directory": doctor_directory.get_stats(),
+        "entity_cache": cache.get_stats(),
+        "archive": archive.get_stats(),
+        "admission": admission.get_stats(),
+        "coalescing": coalescing.get_stats(),
+        "idempotency": idempotency.get_stats(),
+        "jobs": jobs.get_stats(),
+        "waiting_list": waiting_list.get_stats(),
+        "reminders": reminders.get_stats(),
+        "dedupe": dedupe.get_stats(),
+        "name_index": name_index.get_stats(),
+        "search": fulltext.get_stats(),
+        "changes": changelog.get_stats(),
+    }
+
+# 创建数据库表（可选，仅开发环境使用）
+if AUTO_CREATE_TABLES:
+    @app.on_event("startup")
+    async def create_tables():
+        """应用启动时创建数据库表"""
+        from manage import init_db
+        init_db()
+
+# 进程内定时归档历史预约（默认关闭，生产环境建议用 cron 执行 manage.py archive-appointments）
+if archive.ARCHIVE_INTERVAL_SECONDS > 0:
+    _archive_task = None
+
+    @app.on_event("startup")
+    async def start_archiver():
+        global _archive_task
+        _archive_task = asyncio.create_task(archive.run_periodically())
+
+    @app.on_event("shutdown")
+    async def stop_archiver():
+        if _archive_task is not None:
+            _archive_task.cancel()
+
+# 进程内定时发送预约提醒（默认关闭，生产环境建议用 cron 执行 manage.py send-reminders）
+if reminders.REMINDER_INTERVAL_SECONDS > 0:
+    _reminder_task = None
+
+    @app.on_event("startup")
+    async def start_reminders():
+        global _reminder_task
+        _reminder_task = asyncio.create_task(reminders.run_periodically(reminders.ReminderScheduler()))
+
+    @app.on_event("shutdown")
+    async def stop_reminders():
+        if _reminder_task is not None:
+            _reminder_task.cancel()
+
+# 进程内定时清理、压缩变更日志（默认关闭，生产环境建议用 cron 执行 manage.py cleanup-changes）
+if changelog.CHANGE_LOG_INTERVAL_SECONDS > 0:
+    _changelog_task = None
+
+    @app.on_event("startup")
+    async def start_changelog_cleanup():
+        global _changelog_task
+        _changelog_task = asyncio.create_task(changelog.run_periodically())
+
+    @app.on_event("shutdown")
+    async def stop_changelog_cleanup():
+        if _changelog_task is not None:
+            _changelog_task.cancel()
+
+# 关闭时停止后台任务进程池（运行中的任务由 cleanup 在超时后标记为失败）
+@app.on_event("shutdown")
+async def stop_jobs():
+    jobs.manager.shutdown()
+
+# 关闭时保存姓名索引快照，重启后核对一致即可直接加载
+@app.on_event("shutdown")
+async def save_name_index():
+    name_index.save_all()
+
+# 关闭时释放数据库连接
+@app.on_event("shutdown")
+async def close_database():
+    """优雅退出：请求处理完毕后关闭连接池"""
+    dispose_engines()
 
 # 根路径
 @app.get("/", tags=["root"])
@@ -83,4 +201,6 @@ async def read_root():
     }
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    # 开发模式；生产环境请使用 python serve.py
+    from serve import main as serve
+    serve(["--reload"])
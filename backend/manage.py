@@ -0,0 +1,293 @@
+"""
+HospitalRun 后端管理命令
+
+数据库结构管理不放在Web进程里做，部署或升级时单独执行：
+
+    python manage.py init-db        # 创建缺失的数据库表
+    python manage.py add-columns    # 为已有数据库的表补充模型中新增的列
+    python manage.py create-indexes # 为已有数据库补建模型中声明的索引
+    python manage.py check-plans    # 检查 crud 查询是否出现全表扫描
+    python manage.py archive-appointments  # 把历史预约分批搬到归档表
+    python manage.py rebuild-archive-counts  # 按归档表重建按医生的归档计数
+    python manage.py cleanup-idempotency   # 删除过期的幂等键记录
+    python manage.py cleanup-jobs          # 删除过期的后台任务记录和结果文件
+    python manage.py send-reminders        # 发送一轮预约提醒
+    python manage.py cleanup-changes       # 清理过期的变更日志并压缩
+"""
+import argparse
+import logging
+import sys
+from typing import List
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+
+logger = logging.getLogger("hospitalrun.manage")
+
+
+def init_db(bind=None):
+    """创建所有缺失的数据库表（已存在的表不受影响）"""
+    from database import Base, engine
+    import models  # noqa: F401 - 注册模型到 Base.metadata
+
+    Base.metadata.create_all(bind=bind or engine)
+    logger.info("数据库表创建完成")
+
+
+def missing_columns(bind) -> List:
+    """找出模型中声明、但数据库已有表中还不存在的列"""
+    from database import Base
+    import models  # noqa: F401 - 注册模型到 Base.metadata
+
+    inspector = inspect(bind)
+    result = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        result.extend(column for column in table.columns if column.name not in existing)
+    return result
+
+
+def add_columns(bind=None, dry_run: bool = False) -> List[str]:
+    """
+    为已有数据库的表补充缺失的列，返回执行（或将要执行）的SQL
+
+    新增的非空列需要在模型中声明 server_default（如 version 列默认 1），已有行取默认值。
+    """
+    from database import engine
+
+    bind = bind or engine
+    compiler = bind.dialect.ddl_compiler(bind.dialect, None)
+    statements = [
+        f"ALTER TABLE {column.table.name} ADD COLUMN {compiler.get_column_specification(column)}"
+        for column in missing_columns(bind)
+    ]
+
+    if not dry_run:
+        with bind.begin() as conn:
+            for sql in statements:
+                logger.info("添加列: %s", sql)
+                conn.exec_driver_sql(sql)
+    return statements
+
+
+def missing_indexes(bind) -> List:
+    """
+    找出模型中声明、但数据库中还不存在的索引
+
+    已存在同名索引，或已有索引（含主键）的前缀列与之相同的，视为已覆盖。
+    按 DATABASE_MySQL_DDL.md 建的库索引名不同（如 idx_name），靠列比较避免重复建索引。
+    """
+    from database import Base
+    import models  # noqa: F401 - 注册模型到 Base.metadata
+
+    inspector = inspect(bind)
+    result = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = inspector.get_indexes(table.name)
+        existing_names = {index["name"] for index in existing}
+        existing_columns = [tuple(index["column_names"]) for index in existing]
+        existing_columns.append(tuple(inspector.get_pk_constraint(table.name)["constrained_columns"]))
+
+        for index in sorted(table.indexes, key=lambda item: item.name):
+            columns = tuple(column.name for column in index.columns)
+            if index.name in existing_names:
+                continue
+            if any(present[:len(columns)] == columns for present in existing_columns):
+                continue
+            result.append(index)
+    return result
+
+
+def create_indexes(bind=None, dry_run: bool = False) -> List[str]:
+    """
+    为已有数据库补建缺失的索引，返回执行（或将要执行）的SQL
+
+    PostgreSQL 使用 CREATE INDEX CONCURRENTLY，MySQL InnoDB 默认在线建索引，均不阻塞读写。
+    """
+    from database import engine
+
+    bind = bind or engine
+    statements = []
+    for index in missing_indexes(bind):
+        sql = str(CreateIndex(index).compile(dialect=bind.dialect))
+        if bind.dialect.name == "postgresql":
+            sql = sql.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+        statements.append(sql)
+
+    if not dry_run:
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for sql in statements:
+                logger.info("创建索引: %s", sql)
+                conn.exec_driver_sql(sql)
+    return statements
+
+
+def check_plans() -> int:
+    """对当前数据库（配置了只读副本时为副本）运行 query_plan.CRUD_PLAN_CHECKS，有全表扫描或未捕获到查询时返回 1"""
+    from database import get_read_session
+    from query_plan import check_crud_plans, format_report
+
+    db = get_read_session()
+    try:
+        failures = check_crud_plans(db)
+    finally:
+        db.close()
+
+    for name, report in failures:
+        label = "全表扫描" if report.full_scans else "未检查"
+        print(f"[{label}] {name}\n{format_report(report)}\n")
+    if failures:
+        return 1
+    logger.info("所有 crud 查询均使用索引")
+    return 0
+
+
+def archive_appointments(days: int = None, batch_size: int = None, max_batches: int = None) -> int:
+    """归档预约时间早于 days 天前的预约，返回归档数量"""
+    import archive
+
+    days = archive.ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or archive.ARCHIVE_BATCH_SIZE
+    total = archive.archive_appointments(
+        cutoff=archive.archive_cutoff(days), batch_size=batch_size, max_batches=max_batches
+    )
+    logger.info("共归档 %s 条预约", total)
+    return total
+
+
+def rebuild_archive_counts() -> int:
+    """按归档表重建按医生的归档计数，返回医生数"""
+    import archive
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        doctors = archive.rebuild_archived_counts(db)
+    finally:
+        db.close()
+    logger.info("已重建 %s 位医生的归档计数", doctors)
+    return doctors
+
+
+def cleanup_idempotency() -> int:
+    """删除过期的幂等键记录，返回删除数量"""
+    import idempotency
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        total = idempotency.cleanup_all_expired(db)
+    finally:
+        db.close()
+    logger.info("共删除 %s 条过期的幂等键记录", total)
+    return total
+
+
+def cleanup_jobs() -> int:
+    """删除过期的后台任务记录和结果文件，返回删除数量"""
+    import jobs
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        total = 0
+        while True:
+            deleted = jobs.manager.cleanup(db)
+            total += deleted
+            if deleted < jobs.CLEANUP_BATCH:
+                break
+    finally:
+        db.close()
+    logger.info("共删除 %s 个过期的后台任务", total)
+    return total
+
+
+def send_reminders() -> int:
+    """发送一轮预约提醒，返回发送成功的数量"""
+    import reminders
+
+    sent = reminders.ReminderScheduler().run_once()
+    logger.info("共发送 %s 条预约提醒", sent)
+    return sent
+
+
+def cleanup_changes() -> int:
+    """清理过期的变更日志并压缩，返回删除行数"""
+    import changelog
+
+    purged, compacted = changelog.cleanup()
+    return purged + compacted
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="HospitalRun 后端管理命令")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("init-db", help="创建缺失的数据库表")
+
+    columns = subparsers.add_parser("add-columns", help="为已有数据库的表补充缺失的列")
+    columns.add_argument("--sql", action="store_true", help="只打印SQL，不执行")
+
+    indexes = subparsers.add_parser("create-indexes", help="为已有数据库补建缺失的索引")
+    indexes.add_argument("--sql", action="store_true", help="只打印SQL，不执行")
+
+    subparsers.add_parser("check-plans", help="检查 crud 查询是否出现全表扫描")
+
+    archiving = subparsers.add_parser("archive-appointments", help="把历史预约分批搬到归档表")
+    archiving.add_argument("--days", type=int, default=None, help="归档预约时间早于多少天前的预约（默认 ARCHIVE_AFTER_DAYS）")
+    archiving.add_argument("--batch-size", type=int, default=None, help="每批（每个事务）搬移的数量（默认 ARCHIVE_BATCH_SIZE）")
+    archiving.add_argument("--max-batches", type=int, default=None, help="本次最多执行的批数")
+
+    subparsers.add_parser("rebuild-archive-counts", help="按归档表重建按医生的归档计数")
+    subparsers.add_parser("cleanup-idempotency", help="删除过期的幂等键记录")
+    subparsers.add_parser("cleanup-jobs", help="删除过期的后台任务记录和结果文件")
+    subparsers.add_parser("send-reminders", help="发送一轮预约提醒")
+    subparsers.add_parser("cleanup-changes", help="清理过期的变更日志并压缩")
+
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = build_parser().parse_args(argv)
+
+    if args.command == "init-db":
+        init_db()
+    elif args.command == "add-columns":
+        statements = add_columns(dry_run=args.sql)
+        if args.sql:
+            for sql in statements:
+                print(f"{sql};")
+        elif not statements:
+            logger.info("所有列均已存在")
+    elif args.command == "create-indexes":
+        statements = create_indexes(dry_run=args.sql)
+        if args.sql:
+            for sql in statements:
+                print(f"{sql};")
+        elif not statements:
+            logger.info("所有索引均已存在")
+    elif args.command == "check-plans":
+        return check_plans()
+    elif args.command == "archive-appointments":
+        archive_appointments(args.days, args.batch_size, args.max_batches)
+    elif args.command == "rebuild-archive-counts":
+        rebuild_archive_counts()
+    elif args.command == "cleanup-idempotency":
+        cleanup_idempotency()
+    elif args.command == "cleanup-jobs":
+        cleanup_jobs()
+    elif args.command == "send-reminders":
+        send_reminders()
+    elif args.command == "cleanup-changes":
+        cleanup_changes()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,18 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, func, Enum
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Boolean, func, Enum, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from database import Base
 
+# 索引命名与 DATABASE_PostgreSQL_DDL.md 一致（表名前缀保证在SQLite/PostgreSQL中全局唯一）。
+# 预约表的 doctor_name、appointment_time 单列索引由以它们开头的复合索引覆盖，不再单独创建。
+
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (
+        Index("idx_patients_name", "name"),
+        Index("idx_patients_phone", "phone"),
+        # 按性别筛选 + 按id分页
+        Index("idx_patients_gender_id", "gender", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True, comment='患者ID')
     name = Column(String(100), nullable=False, comment='患者姓名')
@@ -13,11 +22,17 @@ class Patient(Base):
     address = Column(Text, comment='家庭地址')
     medical_condition = Column(Text, nullable=False, comment='病情描述')
     notes = Column(Text, comment='备注信息')
+    version = Column(Integer, nullable=False, default=1, server_default='1', comment='版本号（乐观锁）')
     created_at = Column(DateTime, default=func.now(), comment='创建时间')
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
 
 class Doctor(Base):
     __tablename__ = "doctors"
+    __table_args__ = (
+        Index("idx_doctors_name", "name"),
+        Index("idx_doctors_specialty", "specialty"),
+        Index("idx_doctors_status", "status"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True, comment='医生ID')
     name = Column(String(100), nullable=False, comment='医生姓名')
@@ -26,11 +41,20 @@ class Doctor(Base):
     phone = Column(String(20), comment='联系电话')
     status = Column(Enum('在职', '休息中', '离职'), nullable=False, default='在职', comment='工作状态')
     notes = Column(Text, comment='备注信息（如：主任医师）')
+    version = Column(Integer, nullable=False, default=1, server_default='1', comment='版本号（乐观锁）')
     created_at = Column(DateTime, default=func.now(), comment='创建时间')
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
 
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        Index("idx_appointments_patient_name", "patient_name"),
+        Index("idx_appointments_status", "status"),
+        # 某医生某时间段的预约；也覆盖只按医生姓名的查询
+        Index("idx_appointments_doctor_time", "doctor_name", "appointment_time"),
+        # 今日/本周按时间范围统计及按状态计数；也覆盖只按时间的查询
+        Index("idx_appointments_time_status", "appointment_time", "status"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True, comment='预约ID')
     patient_name = Column(String(100), nullable=False, comment='患者姓名')
@@ -39,5 +63,155 @@ class Appointment(Base):
     status = Column(Enum('pending', 'confirmed', 'cancelled'), nullable=False, default='pending', comment='预约状态：待确认/已确认/已取消')
     reason = Column(Text, comment='预约原因')
     notes = Column(Text, comment='备注信息')
+    version = Column(Integer, nullable=False, default=1, server_default='1', comment='版本号（乐观锁）')
     created_at = Column(DateTime, default=func.now(), comment='创建时间')
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), comment='更新时间')
+
+# 预约归档表：archive.py 把早于截止时间的预约从 appointments 整行搬到这里（保留原ID）。
+# 当天/本周/近期统计只查热表；按日期范围、医生、患者的历史查询同时读两张表。
+class ArchivedAppointment(Base):
+    __tablename__ = "appointments_archive"
+    __table_args__ = (
+        Index("idx_appointments_archive_patient_name", "patient_name"),
+        Index("idx_appointments_archive_doctor_time", "doctor_name", "appointment_time"),
+        Index("idx_appointments_archive_time_status", "appointment_time", "status"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False, comment='预约ID（与原预约相同）')
+    patient_name = Column(String(100), nullable=False, comment='患者姓名')
+    doctor_name = Column(String(100), nullable=False, comment='医生姓名')
+    appointment_time = Column(DateTime, nullable=False, comment='预约时间')
+    status = Column(Enum('pending', 'confirmed', 'cancelled'), nullable=False, default='pending', comment='预约状态：待确认/已确认/已取消')
+    reason = Column(Text, comment='预约原因')
+    notes = Column(Text, comment='备注信息')
+    version = Column(Integer, nullable=False, default=1, server_default='1', comment='版本号（乐观锁）')
+    created_at = Column(DateTime, comment='创建时间')
+    updated_at = Column(DateTime, comment='更新时间')
+    archived_at = Column(DateTime, default=func.now(), comment='归档时间')
+
+
+# 归档预约按医生的计数（archive.py）：每批归档在同一事务中累加，
+# 仪表盘的科室预约数读这张小表，不再对整个归档表分组计数
+class ArchivedAppointmentCount(Base):
+    __tablename__ = "appointments_archive_counts"
+
+    doctor_name = Column(String(100), primary_key=True, comment='医生姓名')
+    appointment_count = Column(Integer, nullable=False, default=0, server_default='0', comment='已归档的预约数')
+
+
+# 幂等键记录：POST 请求的第一次响应，重试时直接返回（idempotency.py）。
+# status_code 为空表示第一次请求仍在处理中。
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("idx_idempotency_keys_expires_at", "expires_at"),
+    )
+
+    scope = Column(String(64), primary_key=True, comment='接口（如 POST /api/patients）')
+    key = Column(String(128), primary_key=True, comment='客户端提供的 Idempotency-Key')
+    request_hash = Column(String(64), nullable=False, comment='请求体摘要（SHA-256）')
+    status_code = Column(Integer, comment='响应状态码，处理中为空')
+    response_body = Column(Text, comment='响应体（JSON）')
+    created_at = Column(DateTime, nullable=False, comment='创建时间')
+    expires_at = Column(DateTime, nullable=False, comment='过期时间')
+
+
+# 后台任务（jobs.py）：报表、导出等耗时计算在进程池中执行，这里记录状态、进度和结果文件
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("idx_jobs_status_created_at", "status", "created_at"),
+        Index("idx_jobs_expires_at", "expires_at"),
+    )
+
+    id = Column(String(32), primary_key=True, comment='任务ID')
+    kind = Column(String(50), nullable=False, comment='任务类型')
+    params = Column(Text, comment='任务参数（JSON）')
+    status = Column(String(20), nullable=False, default='queued', comment='状态：queued/running/succeeded/failed/cancelled')
+    progress = Column(Integer, nullable=False, default=0, comment='进度（0-100）')
+    message = Column(String(200), comment='进度说明')
+    cancel_requested = Column(Boolean, nullable=False, default=False, comment='是否已请求取消')
+    result_path = Column(String(255), comment='结果文件路径')
+    result_size = Column(Integer, comment='结果文件大小（字节）')
+    error = Column(Text, comment='失败原因')
+    created_at = Column(DateTime, nullable=False, comment='提交时间')
+    started_at = Column(DateTime, comment='开始时间')
+    updated_at = Column(DateTime, comment='最近一次进度更新时间')
+    finished_at = Column(DateTime, comment='结束时间')
+    expires_at = Column(DateTime, comment='结果文件过期时间')
+
+
+# 现场候诊队列（waiting_list.py）：按医生、按天排号，内存中维护队列，每次变更写入此表用于崩溃恢复
+class WaitingListEntry(Base):
+    __tablename__ = "waiting_list"
+    __table_args__ = (
+        UniqueConstraint("doctor_name", "queue_date", "number", name="uq_waiting_list_doctor_date_number"),
+        Index("idx_waiting_list_doctor_date_status", "doctor_name", "queue_date", "status"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment='排号记录ID')
+    doctor_name = Column(String(100), nullable=False, comment='医生姓名')
+    queue_date = Column(Date, nullable=False, comment='排号日期')
+    number = Column(Integer, nullable=False, comment='当天的排队号')
+    patient_name = Column(String(100), nullable=False, comment='患者姓名')
+    reason = Column(Text, comment='就诊原因')
+    status = Column(String(20), nullable=False, default='waiting', comment='状态：waiting/called/cancelled')
+    position = Column(Integer, nullable=False, comment='叫号顺序（过号后移到队尾）')
+    skips = Column(Integer, nullable=False, default=0, comment='过号次数')
+    appointment_id = Column(Integer, comment='叫号后生成的预约ID')
+    created_at = Column(DateTime, nullable=False, comment='取号时间')
+    called_at = Column(DateTime, comment='叫号时间')
+
+
+# 预约提醒记录（reminders.py）：先插入再发送，主键保证每个预约最多提醒一次
+class AppointmentReminder(Base):
+    __tablename__ = "appointment_reminders"
+    __table_args__ = (
+        Index("idx_appointment_reminders_appointment_time", "appointment_time"),
+    )
+
+    appointment_id = Column(Integer, primary_key=True, autoincrement=False, comment='预约ID')
+    appointment_time = Column(DateTime, nullable=False, comment='预约时间')
+    status = Column(String(20), nullable=False, default='claimed', comment='状态：claimed/sent/failed')
+    error = Column(Text, comment='发送失败原因')
+    claimed_at = Column(DateTime, nullable=False, comment='认领时间')
+    sent_at = Column(DateTime, comment='发送时间')
+
+
+# 预约提醒进度（reminders.py）：只有一行，保存上一轮窗口上界和上次补扫时间，
+# cron 每次启动新进程执行 send-reminders 时接着上一轮推进
+class ReminderState(Base):
+    __tablename__ = "reminder_state"
+
+    id = Column(Integer, primary_key=True, autoincrement=False, comment='固定为1')
+    watermark = Column(DateTime, comment='上一轮窗口的上界（预约时间）')
+    last_catchup_at = Column(DateTime, comment='上次补扫整个提前量窗口的时间')
+
+
+# 患者查重分块索引（dedupe.py）：每位患者的若干分块键（规范化电话、姓名拼音、首字母+年龄段），
+# 只有分块键相同的患者才两两比较；按 (block_key, patient_id) 排序流式读取即可逐块处理
+class PatientBlockKey(Base):
+    __tablename__ = "patient_block_keys"
+    __table_args__ = (
+        Index("idx_patient_block_keys_patient_id", "patient_id"),
+    )
+
+    block_key = Column(String(120), primary_key=True, comment='分块键（如 phone:13800000001）')
+    patient_id = Column(Integer, primary_key=True, autoincrement=False, comment='患者ID')
+
+
+# 变更日志（changelog.py）：crud 每次写入在同一事务中追加一行，自增ID即增量同步的游标；
+# 不保存整行数据，读取时按ID取当前数据。定期压缩（同一记录只保留最新一行）并按保留期清理
+class ChangeLogEntry(Base):
+    __tablename__ = "change_log"
+    __table_args__ = (
+        Index("idx_change_log_entity", "entity_type", "entity_id", "id"),
+        Index("idx_change_log_changed_at", "changed_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment='变更序号（同步游标）')
+    entity_type = Column(String(20), nullable=False, comment='类型：patient/doctor/appointment')
+    entity_id = Column(Integer, nullable=False, comment='记录ID')
+    op = Column(String(10), nullable=False, comment='操作：insert/update/delete')
+    version = Column(Integer, comment='变更后的版本号，删除时为空')
+    changed_at = Column(DateTime, nullable=False, comment='变更时间')
@@ -0,0 +1,420 @@
+"""
+姓名模糊搜索与前缀补全索引
+
+get_patients / get_doctors 的 search 是 contains() 子串匹配，姓名里有一个错别字、拼音拼错一个
+字母就什么也搜不到。fuzzy=true 时改用这里的 n-gram 索引，按相似度排序：
+
+- 姓名规范化（全角转半角、小写、去掉空格和标点）后切成 n-gram：拉丁字母/拼音用三元组，
+  汉字信息量大，用二元组；首尾加边界符，短姓名也有足够的 n-gram。安装了 pypinyin 时
+  汉字姓名同时按拼音切分，“张三”与“zhang san”、同音错字“张山”都能互相找到
+- 倒排表：n-gram → 患者/医生ID集合；相似度为 Dice 系数 2|A∩B| / (|A|+|B|)
+- 查询时对查询的各个 n-gram 的倒排表计数，得到每个姓名共有的 n-gram 数，配合预先保存的
+  每个姓名的 n-gram 数直接算出相似度，不需要重新切分候选姓名；只保留前 FUZZY_MAX_RESULTS 个
+- 倒排表从短到长处理：每个新候选与其余倒排表求交集得到精确的共有数；不在已处理倒排表中的
+  姓名共有数有上限，上限达不到相似度下限、或已够 limit 个且都超过上限时停止，不再遍历
+  “^zh” 这类很长的倒排表
+
+同一份索引还维护一个按 (规范化姓名, ID) 排序的数组，供 GET /api/autocomplete 前缀补全：
+二分查找定位前缀起点后顺序取前 k 个，写入时用 insort 原地插入，不重建。
+
+索引在进程内（每个数据库、每张表一份），crud 写入后调用 entity_saved / entity_deleted 同步更新。
+每 FUZZY_INDEX_TTL 秒用一条聚合查询（行数、最大ID、最大更新时间）与数据库核对，不一致说明
+其他进程改过数据：只读取更新时间不早于内存中最大更新时间、或ID大于最大ID的行；补上后行数仍
+不一致说明有删除，才整体重建。重建后和进程退出时把索引快照写到 FUZZY_INDEX_DIR，进程重启时
+加载快照后同样只补上之后的变化，不必重新读表、切分。
+"""
+import bisect
+import hashlib
+import heapq
+import logging
+import math
+import os
+import pickle
+import threading
+import time
+import unicodedata
+import weakref
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from dedupe import name_parts
+
+logger = logging.getLogger("hospitalrun.name_index")
+
+# 相似度下限（0-1）
+FUZZY_MIN_SIMILARITY = float(os.getenv("FUZZY_MIN_SIMILARITY", "0.3"))
+# 最多返回的候选数
+FUZZY_MAX_RESULTS = int(os.getenv("FUZZY_MAX_RESULTS", "1000"))
+# 与数据库核对的间隔（秒）
+FUZZY_INDEX_TTL = float(os.getenv("FUZZY_INDEX_TTL", "300"))
+# 快照目录，为空时不保存快照
+FUZZY_INDEX_DIR = os.getenv(
+    "FUZZY_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_index")
+)
+# 前缀补全默认返回的条数
+AUTOCOMPLETE_LIMIT = int(os.getenv("AUTOCOMPLETE_LIMIT", "10"))
+# 重建时每批读取的行数
+FUZZY_LOAD_BATCH = int(os.getenv("FUZZY_LOAD_BATCH", "5000"))
+
+SNAPSHOT_FORMAT = 2
+
+
+def forms(name: Optional[str]) -> Set[str]:
+    """姓名的规范化写法：原文（去掉空格标点），以及拼音（安装了 pypinyin 且与原文不同时）"""
+    text = unicodedata.normalize("NFKC", name or "").lower()
+    plain = "".join(ch for ch in text if ch.isalnum())
+    result = {plain} if plain else set()
+    romanized = "".join(name_parts(name))
+    if romanized:
+        result.add(romanized)
+    return result
+
+
+def grams(name: Optional[str]) -> FrozenSet[str]:
+    result = set()
+    for form in forms(name):
+        n = 3 if form.isascii() else 2
+        padded = "^" * (n - 1) + form + "$"
+        result.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return frozenset(result)
+
+
+def similarity(query_grams: FrozenSet[str], name_grams: FrozenSet[str]) -> float:
+    if not query_grams or not name_grams:
+        return 0.0
+    return 2 * len(query_grams & name_grams) / (len(query_grams) + len(name_grams))
+
+
+class NameIndex:
+    """单个数据库单张表（患者或医生）的姓名 n-gram 索引"""
+
+    def __init__(self, model, snapshot_path: Optional[str] = None, ttl: float = FUZZY_INDEX_TTL):
+        self.model = model
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._names: Dict[int, str] = {}
+        # 每个姓名的 n-gram 数，计算相似度时不必重新切分
+        self._sizes: Dict[int, int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        # 前缀补全：按 (规范化姓名, ID) 排序的数组，二分查找前缀的起点
+        self._sorted: List[Tuple[str, int]] = []
+        self._max_updated_at: Optional[datetime] = None
+        self._loaded = False
+        self._checked_at: Optional[float] = None
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.snapshot_loads = 0
+        self.queries = 0
+        self.completions = 0
+
+    # ---------- 维护 ----------
+
+    def _add(self, entity_id: int, name: str, keep_sorted: bool = True):
+        name_grams = grams(name)
+        self._names[entity_id] = name
+        self._sizes[entity_id] = len(name_grams)
+        for gram in name_grams:
+            self._postings.setdefault(gram, set()).add(entity_id)
+        for form in forms(name):
+            if keep_sorted:
+                bisect.insort(self._sorted, (form, entity_id))
+            else:
+                self._sorted.append((form, entity_id))
+
+    def _remove(self, entity_id: int):
+        name = self._names.pop(entity_id, None)
+        if name is None:
+            return
+        del self._sizes[entity_id]
+        for gram in grams(name):
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(entity_id)
+                if not ids:
+                    del self._postings[gram]
+        for form in forms(name):
+            position = bisect.bisect_left(self._sorted, (form, entity_id))
+            if position < len(self._sorted) and self._sorted[position] == (form, entity_id):
+                del self._sorted[position]
+
+    def _put(self, entity_id: int, name: str, updated_at: Optional[datetime]):
+        if self._names.get(entity_id) != name:
+            self._remove(entity_id)
+            self._add(entity_id, name)
+        if updated_at is not None and (self._max_updated_at is None or updated_at > self._max_updated_at):
+            self._max_updated_at = updated_at
+
+    def put(self, entity_id: int, name: str, updated_at: Optional[datetime] = None):
+        """写入或更新一条记录（未加载时忽略，下次使用时整体加载）"""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._put(entity_id, name, updated_at)
+
+    def discard(self, entity_id: int):
+        with self._lock:
+            self._remove(entity_id)
+
+    def _signature(self) -> Tuple:
+        return len(self._names), max(self._names, default=None), self._max_updated_at
+
+    def _db_signature(self, db: Session) -> Tuple:
+        model = self.model
+        return tuple(db.execute(select(func.count(model.id), func.max(model.id), func.max(model.updated_at))).one())
+
+    def _rebuild(self, db: Session):
+        model = self.model
+        self._names, self._sizes, self._postings, self._sorted = {}, {}, {}, []
+        self._max_updated_at = None
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(model.id, model.name, model.updated_at)
+                .where(model.id > last_id).order_by(model.id).limit(FUZZY_LOAD_BATCH)
+            ).all()
+            for entity_id, name, updated_at in rows:
+                self._add(entity_id, name, keep_sorted=False)
+                if updated_at is not None and (self._max_updated_at is None or updated_at > self._max_updated_at):
+                    self._max_updated_at = updated_at
+            if len(rows) < FUZZY_LOAD_BATCH:
+                break
+            last_id = rows[-1].id
+        self._sorted.sort()
+        self.rebuilds += 1
+
+    def _load_changes(self, db: Session):
+        """读取其他进程的新增和修改：更新时间不早于内存中的最大更新时间，或ID大于最大ID"""
+        model = self.model
+        changed = model.id > max(self._names, default=0)
+        if self._max_updated_at is not None:
+            # 更新时间可能只精确到秒，同一秒内的修改也要读到（重复写入同名记录不改变索引）
+            changed = or_(changed, model.updated_at > self._max_updated_at - timedelta(seconds=1))
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(model.id, model.name, model.updated_at)
+                .where(changed, model.id > last_id).order_by(model.id).limit(FUZZY_LOAD_BATCH)
+            ).all()
+            for entity_id, name, updated_at in rows:
+                self._put(entity_id, name, updated_at)
+            if len(rows) < FUZZY_LOAD_BATCH:
+                break
+            last_id = rows[-1].id
+        self.refreshes += 1
+
+    def _ensure_fresh(self, db: Session):
+        if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+            return
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.ttl:
+                return
+            if not self._loaded:
+                # 进程启动后第一次使用时先尝试快照
+                self._loaded = self._load_snapshot()
+            if self._loaded and self._signature() != self._db_signature(db):
+                self._load_changes(db)
+            # 补上新增和修改后行数仍不一致说明有删除，整体重建
+            if not self._loaded or self._signature() != self._db_signature(db):
+                self._rebuild(db)
+                self._loaded = True
+                try:
+                    self.save()
+                except OSError:
+                    logger.warning("姓名索引快照 %s 保存失败", self.snapshot_path, exc_info=True)
+            self._checked_at = time.monotonic()
+
+    def invalidate(self):
+        """下次使用时与数据库核对"""
+        self._checked_at = None
+
+    # ---------- 快照 ----------
+
+    def _load_snapshot(self) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, "rb") as snapshot:
+                data = pickle.load(snapshot)
+        except Exception:
+            logger.warning("姓名索引快照 %s 无法读取，重新建立", self.snapshot_path, exc_info=True)
+            return False
+        if data.get("format") != SNAPSHOT_FORMAT:
+            return False
+        self._names, self._sizes, self._postings = data["names"], data["sizes"], data["postings"]
+        self._sorted = data["sorted"]
+        self._max_updated_at = data["max_updated_at"]
+        self.snapshot_loads += 1
+        return True
+
+    def save(self):
+        """把索引写到快照文件（先写临时文件再替换，进程中途退出不会留下半个快照）"""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            if not self._loaded:
+                return
+            data = {
+                "format": SNAPSHOT_FORMAT,
+                "signature": self._signature(),
+                "names": self._names,
+                "sizes": self._sizes,
+                "postings": self._postings,
+                "sorted": self._sorted,
+                "max_updated_at": self._max_updated_at,
+            }
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            temporary = self.snapshot_path + ".part"
+            with open(temporary, "wb") as snapshot:
+                pickle.dump(data, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.snapshot_path)
+
+    # ---------- 查询 ----------
+
+    def search(self, db: Session, query: str, limit: int = FUZZY_MAX_RESULTS,
+               min_similarity: float = FUZZY_MIN_SIMILARITY) -> List[Tuple[int, float]]:
+        """按相似度从高到低返回 (ID, 相似度)"""
+        query_grams = grams(query)
+        if not query_grams:
+            return []
+        self._ensure_fresh(db)
+        self.queries += 1
+        size = len(query_grams)
+        # 相似度达到下限至少要共有 min_shared 个 n-gram：2c/(size+c) >= min_similarity（姓名至少有 c 个 n-gram）
+        min_shared = max(1, math.ceil(min_similarity * size / (2 - min_similarity) - 1e-9))
+        sizes = self._sizes
+        # 当前前 limit 名：(相似度, -ID) 的小顶堆，堆顶是其中最差的一个
+        top: List[Tuple[float, int]] = []
+        seen: Set[int] = set()
+        with self._lock:
+            postings = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+            for position, ids in enumerate(postings):
+                # 不在前面几个倒排表中的姓名最多共有 remaining 个 n-gram
+                remaining = size - position
+                if remaining < min_shared:
+                    break
+                if len(top) >= limit and top[0][0] > 2 * remaining / (size + remaining):
+                    break
+                new = ids - seen if ids else ids
+                if not new:
+                    continue
+                seen |= new
+                # 新候选只需与后面的倒排表求交集即可得到共有数（集合运算在 C 中完成）
+                shared = Counter(new)
+                for later in postings[position + 1:]:
+                    shared.update(new.intersection(later))
+                for entity_id, count in shared.items():
+                    if count < min_shared:
+                        continue
+                    score = 2 * count / (size + sizes[entity_id])
+                    if score < min_similarity:
+                        continue
+                    if len(top) < limit:
+                        heapq.heappush(top, (score, -entity_id))
+                    elif (score, -entity_id) > top[0]:
+                        heapq.heapreplace(top, (score, -entity_id))
+        ordered = sorted(top, reverse=True)
+        return [(-negative_id, round(score, 4)) for score, negative_id in ordered]
+
+    def complete(self, db: Session, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Tuple[int, str]]:
+        """姓名以 prefix 开头的前 limit 个 (ID, 姓名)，按规范化姓名排序"""
+        prefixes = forms(prefix)
+        if not prefixes:
+            return []
+        self._ensure_fresh(db)
+        self.completions += 1
+        matches: Dict[int, str] = {}
+        with self._lock:
+            # 原文和拼音各自二分定位，取各自的前 limit 个再合并
+            for form in prefixes:
+                position = bisect.bisect_left(self._sorted, (form,))
+                found = 0
+                while position < len(self._sorted) and found < limit:
+                    key, entity_id = self._sorted[position]
+                    if not key.startswith(form):
+                        break
+                    if entity_id not in matches:
+                        matches[entity_id] = key
+                        found += 1
+                    position += 1
+            names = self._names
+            ordered = sorted(matches, key=lambda entity_id: (matches[entity_id], entity_id))[:limit]
+            return [(entity_id, names[entity_id]) for entity_id in ordered]
+
+    def stats(self) -> Dict:
+        return {
+            "names": len(self._names),
+            "grams": len(self._postings),
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+            "snapshot_loads": self.snapshot_loads,
+            "queries": self.queries,
+            "completions": self.completions,
+        }
+
+
+# 每个数据库引擎一套索引：{表名: NameIndex}
+_indexes: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def _snapshot_path(bind, model) -> Optional[str]:
+    # 内存数据库（测试）不保存快照
+    if not FUZZY_INDEX_DIR or bind.url.database in (None, "", ":memory:"):
+        return None
+    digest = hashlib.sha1(str(bind.url).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(FUZZY_INDEX_DIR, f"{model.__tablename__}-{digest}.pickle")
+
+
+def index_for(db: Session, model) -> NameIndex:
+    bind = db.get_bind()
+    indexes = _indexes.get(bind)
+    if indexes is None or model.__tablename__ not in indexes:
+        with _indexes_lock:
+            indexes = _indexes.setdefault(bind, {})
+            if model.__tablename__ not in indexes:
+                indexes[model.__tablename__] = NameIndex(model, _snapshot_path(bind, model))
+    return indexes[model.__tablename__]
+
+
+def search(db: Session, model, query: str, limit: int = FUZZY_MAX_RESULTS) -> List[Tuple[int, float]]:
+    return index_for(db, model).search(db, query, limit)
+
+
+def complete(db: Session, model, prefix: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Tuple[int, str]]:
+    return index_for(db, model).complete(db, prefix, limit)
+
+
+def entity_saved(db: Session, entity):
+    """create/update_patient、create/update_doctor 提交后调用"""
+    index_for(db, type(entity)).put(entity.id, entity.name, entity.updated_at)
+
+
+def entity_deleted(db: Session, model, entity_id: int):
+    """delete_patient / delete_doctor 提交后调用"""
+    index_for(db, model).discard(entity_id)
+
+
+def save_all():
+    """进程退出时保存全部快照"""
+    for indexes in list(_indexes.values()):
+        for index in list(indexes.values()):
+            try:
+                index.save()
+            except OSError:
+                logger.warning("姓名索引快照 %s 保存失败", index.snapshot_path, exc_info=True)
+
+
+def get_stats() -> Dict:
+    totals = {"indexes": 0, "names": 0, "grams": 0, "rebuilds": 0, "refreshes": 0, "snapshot_loads": 0, "queries": 0,
+              "completions": 0}
+    for indexes in list(_indexes.values()):
+        for index in list(indexes.values()):
+            totals["indexes"] += 1
+            for name, value in index.stats().items():
+                totals[name] += value
+    return totals
@@ -0,0 +1,195 @@
+"""
+查询计划检查工具
+
+捕获 crud 函数实际发出的 SQL，在执行它的同一连接上执行 EXPLAIN，
+找出全表扫描。读写分离会话的 SELECT 发往只读副本，因此主库和各副本上的语句都会捕获。用于防止 crud 改动悄悄退化为全表扫描：
+
+    python manage.py check-plans            # 对当前数据库检查 CRUD_PLAN_CHECKS
+
+测试中使用 assert_indexed(db, crud.get_doctors, status="在职")。
+
+支持 SQLite（EXPLAIN QUERY PLAN）、MySQL（EXPLAIN，type=ALL 视为全表扫描）
+和 PostgreSQL（EXPLAIN，Seq Scan 视为全表扫描）。
+"""
+import re
+from datetime import datetime
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import changelog
+import crud
+import dedupe
+import reminders
+
+
+@dataclass
+class PlanReport:
+    """一条 SQL 的执行计划及其中的全表扫描"""
+    sql: str
+    parameters: object
+    plan: List[str]
+    full_scans: List[str] = field(default_factory=list)
+
+
+# SQLite: "SCAN patients" / "SCAN TABLE patients" / "SCAN patients USING COVERING INDEX ..."
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(.*)$")
+_POSTGRES_SEQ_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+
+@contextmanager
+def capture_statements(bind) -> Iterator[List[Tuple[str, object]]]:
+    """在上下文中捕获 bind（引擎）上执行的所有 SQL 及参数"""
+    statements: List[Tuple[str, object]] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(bind, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(bind, "before_cursor_execute", before_cursor_execute)
+
+
+def session_engines(db: Session) -> List:
+    """会话可能使用的全部引擎：主库，以及读写分离会话（RoutingSession）的只读副本"""
+    engines = [db.get_bind()]
+    replica_set = getattr(db, "replica_set", None)
+    if replica_set is not None:
+        engines.extend(engine for engine in replica_set.engines if engine not in engines)
+    return engines
+
+
+@contextmanager
+def capture_session_statements(db: Session) -> Iterator[List[Tuple[object, str, object]]]:
+    """在上下文中捕获会话所有引擎上执行的 (引擎, SQL, 参数)"""
+    statements: List[Tuple[object, str, object]] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((conn.engine, statement, parameters))
+
+    engines = session_engines(db)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def explain(connection, sql: str, parameters=None) -> List[str]:
+    """执行 EXPLAIN，返回逐行的计划描述"""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, parameters or ())
+        return [row[-1] for row in rows]
+    if dialect in ("mysql", "mariadb"):
+        rows = connection.exec_driver_sql("EXPLAIN " + sql, parameters or ()).mappings()
+        return [
+            f"table={row.get('table')} type={row.get('type')} key={row.get('key')}"
+            for row in rows
+        ]
+    rows = connection.exec_driver_sql("EXPLAIN " + sql, parameters or ())
+    return [row[0] for row in rows]
+
+
+def find_full_scans(dialect: str, plan: Sequence[str]) -> List[str]:
+    """从计划描述中找出被全表扫描的表名"""
+    tables = []
+    for line in plan:
+        line = line.strip()
+        if dialect == "sqlite":
+            match = _SQLITE_SCAN.match(line)
+            if match and "INDEX" not in match.group(2):
+                tables.append(match.group(1))
+        elif dialect in ("mysql", "mariadb"):
+            if " type=ALL " in f" {line} ":
+                tables.append(line.split()[0].split("=", 1)[1])
+        else:
+            tables.extend(_POSTGRES_SEQ_SCAN.findall(line))
+    return tables
+
+
+def analyze_call(db: Session, fn: Callable, *args, **kwargs) -> List[PlanReport]:
+    """执行 fn(db, ...)，对其中每条 SELECT 在执行它的引擎（主库或副本）的会话连接上生成执行计划报告"""
+    with capture_session_statements(db) as statements:
+        fn(db, *args, **kwargs)
+
+    reports = []
+    seen = set()
+    for engine, sql, parameters in statements:
+        # 同一条SQL（如逐行关联查询）只解释一次
+        if (engine, sql) in seen or not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        seen.add((engine, sql))
+        # 会话事务中该引擎的连接仍在使用，EXPLAIN 与原查询在同一连接上执行
+        connection = db.connection(bind_arguments={"bind": engine})
+        plan = explain(connection, sql, parameters)
+        reports.append(PlanReport(sql, parameters, plan, find_full_scans(connection.dialect.name, plan)))
+    return reports
+
+
+def unexpected_scans(reports: Sequence[PlanReport], allow_scans: Sequence[str] = ()) -> List[PlanReport]:
+    """过滤出扫描了不在 allow_scans 中的表的报告"""
+    return [
+        report for report in reports
+        if any(table not in allow_scans for table in report.full_scans)
+    ]
+
+
+def format_report(report: PlanReport) -> str:
+    return "\n".join([report.sql.strip(), *("    " + line for line in report.plan)])
+
+
+def assert_indexed(db: Session, fn: Callable, *args, allow_scans: Sequence[str] = (), **kwargs):
+    """断言 fn 发出的查询除 allow_scans 中的表外不做全表扫描"""
+    offending = unexpected_scans(analyze_call(db, fn, *args, **kwargs), allow_scans)
+    if offending:
+        details = "\n\n".join(format_report(report) for report in offending)
+        raise AssertionError(f"{fn.__name__} 出现全表扫描:\n{details}")
+
+
+# ============================================
+# crud 查询计划检查清单
+# ============================================
+# (名称, 调用, 允许全表扫描的表)
+# 允许的扫描都是有意为之：无条件分页/计数、contains() 模糊搜索无法使用B树索引、
+# 医生目录缓存（doctor_directory）首次使用时整表加载医生，
+# 仪表盘整表读取按医生的归档计数（每位医生一行的小表）。
+# 预约提醒按时间窗口读取，必须走 (appointment_time, status) 索引；增量查重只读新患者和相关分块的分块键。
+
+CRUD_PLAN_CHECKS: List[Tuple[str, Callable, Tuple[str, ...]]] = [
+    ("get_patients", lambda db: crud.get_patients(db), ("patients",)),
+    ("get_patients(gender)", lambda db: crud.get_patients(db, gender="男"), ()),
+    ("get_patients(search)", lambda db: crud.get_patients(db, search="张"), ("patients",)),
+    ("get_doctors(specialty)", lambda db: crud.get_doctors(db, specialty="internal_medicine"), ()),
+    ("get_doctors(status)", lambda db: crud.get_doctors(db, status="在职"), ()),
+    ("get_appointments(date range)",
+     lambda db: crud.get_appointments(db, date_from="2024-01-01", date_to="2024-01-31"), ("doctors",)),
+    ("get_appointments(doctor)", lambda db: crud.get_appointments(db, doctor="李医生"), ("doctors",)),
+    ("get_appointments(status)", lambda db: crud.get_appointments(db, status="pending"), ("doctors",)),
+    ("get_dashboard_summary", crud.get_dashboard_summary, ("patients", "doctors", "appointments_archive_counts")),
+    ("reminders.due_batch",
+     lambda db: reminders.due_batch(db, datetime(2024, 1, 1), datetime(2024, 1, 1, 1), (datetime(2024, 1, 1), 1)), ()),
+    ("dedupe.new_block_keys", lambda db: dedupe.new_block_keys(db, 100), ()),
+    ("dedupe.block_members", lambda db: dedupe.block_members(db, "phone:13800000001"), ()),
+    ("changelog.head", changelog.head, ()),
+    ("changelog.read_changes", lambda db: changelog.read_changes(db, 0), ()),
+]
+
+
+def check_crud_plans(db: Session) -> List[Tuple[str, PlanReport]]:
+    """运行全部检查，返回 (名称, 违规报告) 列表；没有捕获到任何 SELECT 的检查也算失败（什么都没检查）"""
+    failures = []
+    for name, call, allow_scans in CRUD_PLAN_CHECKS:
+        reports = analyze_call(db, call)
+        if not reports:
+            failures.append((name, PlanReport("", None, ["未捕获到任何 SELECT，无法检查"])))
+        for report in unexpected_scans(reports, allow_scans):
+            failures.append((name, report))
+    return failures
@@ -0,0 +1,306 @@
+"""
+预约提醒
+
+在预约时间前 REMINDER_LEAD_HOURS 小时给已确认预约的患者发送短信/邮件提醒：
+
+    python manage.py send-reminders          # 执行一轮，适合 cron 每分钟执行
+    REMINDER_INTERVAL_SECONDS=60             # 或在Web进程内定时执行
+
+每一轮只读取一个很窄的时间窗口：预约时间落在 (上一轮的窗口上界, 现在 + 提前量] 内、状态为
+confirmed 的预约，走 (appointment_time, status) 索引的范围扫描，按 (appointment_time, id)
+键集分页，每批 REMINDER_BATCH_SIZE 条，从不扫描整张表。
+窗口推进只能发现“提前量以外就已确认”的预约；提前量以内才创建或确认的预约，
+由每 REMINDER_CATCHUP_SECONDS 秒一次的补扫（整个提前量窗口）发现。
+窗口上界和上次补扫时间保存在 reminder_state 表（一行），cron 每次启动新进程也能接着上一轮推进。
+
+最多提醒一次：发送前先向 appointment_reminders 插入一条认领记录（主键为预约ID）并提交，
+插入失败说明已被认领（包括其他进程），跳过；发送失败只记录原因，不重试。
+
+发送方式可插拔：REMINDER_SENDER=file 时写入本地 JSON Lines 文件（开发和测试用），
+也可以设为 "模块:工厂函数"，工厂函数返回带 send(message) 方法的对象（如短信网关客户端）。
+"""
+import asyncio
+import importlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Appointment, AppointmentReminder, Patient, ReminderState
+
+logger = logging.getLogger("hospitalrun.reminders")
+
+# 提前多少小时提醒
+REMINDER_LEAD_HOURS = float(os.getenv("REMINDER_LEAD_HOURS", "24"))
+# 每批读取的预约数
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+# 补扫整个提前量窗口的间隔（秒）
+REMINDER_CATCHUP_SECONDS = float(os.getenv("REMINDER_CATCHUP_SECONDS", "1800"))
+# 提醒记录保留天数
+REMINDER_RETENTION_DAYS = int(os.getenv("REMINDER_RETENTION_DAYS", "30"))
+# Web进程内定时执行的间隔（秒），0 表示不在Web进程内执行
+REMINDER_INTERVAL_SECONDS = float(os.getenv("REMINDER_INTERVAL_SECONDS", "0"))
+# 发送方式：file 或 "模块:工厂函数"
+REMINDER_SENDER = os.getenv("REMINDER_SENDER", "file")
+# file 发送方式的输出文件
+REMINDER_OUTBOX = os.getenv(
+    "REMINDER_OUTBOX", os.path.join(os.path.dirname(os.path.abspath(__file__)), "reminder_outbox.jsonl")
+)
+
+# reminder_state 表中唯一一行的主键
+STATE_ID = 1
+
+CLAIMED = "claimed"
+SENT = "sent"
+FAILED = "failed"
+
+_stats_lock = threading.Lock()
+_stats = {"runs": 0, "scanned": 0, "claimed": 0, "sent": 0, "failed": 0, "last_run_at": None, "last_error": None}
+
+
+class ReminderMessage:
+    """一条待发送的提醒"""
+    __slots__ = ("appointment_id", "patient_name", "phone", "doctor_name", "appointment_time", "text")
+
+    def __init__(self, appointment_id: int, patient_name: str, phone: Optional[str], doctor_name: str,
+                 appointment_time: datetime):
+        self.appointment_id = appointment_id
+        self.patient_name = patient_name
+        self.phone = phone
+        self.doctor_name = doctor_name
+        self.appointment_time = appointment_time
+        self.text = (
+            f"{patient_name}您好，您预约了{doctor_name} "
+            f"{appointment_time.month}月{appointment_time.day}日 {appointment_time:%H:%M} 的门诊，请按时就诊。"
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "appointment_id": self.appointment_id,
+            "patient_name": self.patient_name,
+            "phone": self.phone,
+            "doctor_name": self.doctor_name,
+            "appointment_time": self.appointment_time.isoformat(),
+            "text": self.text,
+        }
+
+
+class FileSender:
+    """把提醒追加写入本地 JSON Lines 文件，代替真实的短信/邮件网关"""
+
+    def __init__(self, path: str = REMINDER_OUTBOX):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, message: ReminderMessage):
+        line = json.dumps(message.to_dict(), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as outbox:
+            outbox.write(line + "\n")
+
+
+def load_sender(spec: str = REMINDER_SENDER):
+    """按 REMINDER_SENDER 创建发送器"""
+    if spec == "file":
+        return FileSender()
+    module_name, _, factory = spec.partition(":")
+    return getattr(importlib.import_module(module_name), factory)()
+
+
+def due_batch(db: Session, start: datetime, end: datetime, after: Optional[tuple] = None,
+              batch_size: int = REMINDER_BATCH_SIZE) -> List:
+    """(start, end] 内已确认的预约，按 (appointment_time, id) 排序，从键 after 之后取一批"""
+    query = (
+        select(Appointment.id, Appointment.patient_name, Appointment.doctor_name, Appointment.appointment_time)
+        .where(
+            Appointment.appointment_time > start,
+            Appointment.appointment_time <= end,
+            Appointment.status == "confirmed",
+        )
+        .order_by(Appointment.appointment_time, Appointment.id)
+        .limit(batch_size)
+    )
+    if after is not None:
+        last_time, last_id = after
+        query = query.where(or_(
+            Appointment.appointment_time > last_time,
+            and_(Appointment.appointment_time == last_time, Appointment.id > last_id),
+        ))
+    return db.execute(query).all()
+
+
+def claim(db: Session, rows: List, now: datetime) -> List:
+    """认领尚未提醒的预约并提交，返回认领成功的行"""
+    ids = [row.id for row in rows]
+    taken = set(db.execute(
+        select(AppointmentReminder.appointment_id).where(AppointmentReminder.appointment_id.in_(ids))
+    ).scalars())
+    candidates = [row for row in rows if row.id not in taken]
+    if not candidates:
+        return []
+
+    def values(row):
+        return {"appointment_id": row.id, "appointment_time": row.appointment_time,
+                "status": CLAIMED, "claimed_at": now}
+
+    try:
+        db.execute(insert(AppointmentReminder), [values(row) for row in candidates])
+        db.commit()
+        return candidates
+    except IntegrityError:
+        # 与其他进程同时认领：逐条插入，只保留自己插入成功的
+        db.rollback()
+    claimed = []
+    for row in candidates:
+        try:
+            db.execute(insert(AppointmentReminder), [values(row)])
+            db.commit()
+            claimed.append(row)
+        except IntegrityError:
+            db.rollback()
+    return claimed
+
+
+class ReminderScheduler:
+    """按时间窗口推进的提醒调度器"""
+
+    def __init__(self, session_factory: Callable[[], Session] = None, sender=None,
+                 lead_hours: float = REMINDER_LEAD_HOURS, batch_size: int = REMINDER_BATCH_SIZE,
+                 catchup_seconds: float = REMINDER_CATCHUP_SECONDS):
+        if session_factory is None:
+            from database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        self.sender = sender or load_sender()
+        self.lead = timedelta(hours=lead_hours)
+        self.batch_size = batch_size
+        self.catchup_seconds = catchup_seconds
+        # 上一轮窗口的上界；每轮开始时与 reminder_state 表合并，从未执行过时第一轮相当于一次补扫
+        self.watermark: Optional[datetime] = None
+        self.last_catchup: Optional[datetime] = None
+
+    def _load_state(self, db: Session):
+        """合并表中保存的进度（其他进程、上一次 cron 执行）"""
+        state = db.get(ReminderState, STATE_ID)
+        if state is None:
+            return
+        if state.watermark is not None:
+            self.watermark = max(filter(None, (self.watermark, state.watermark)))
+        if state.last_catchup_at is not None:
+            self.last_catchup = max(filter(None, (self.last_catchup, state.last_catchup_at)))
+
+    def _save_state(self, db: Session):
+        values = {"watermark": self.watermark, "last_catchup_at": self.last_catchup}
+        if not db.execute(update(ReminderState).where(ReminderState.id == STATE_ID).values(**values)).rowcount:
+            db.execute(insert(ReminderState).values(id=STATE_ID, **values))
+        try:
+            db.commit()
+        except IntegrityError:
+            # 另一个进程同时写入了第一行，进度以它为准
+            db.rollback()
+
+    def run_once(self, now: Optional[datetime] = None) -> int:
+        """执行一轮，返回发送成功的数量"""
+        now = now or datetime.now()
+        end = now + self.lead
+
+        sent = 0
+        db = self.session_factory()
+        try:
+            self._load_state(db)
+            catchup = (self.last_catchup is None or self.watermark is None
+                       or (now - self.last_catchup).total_seconds() >= self.catchup_seconds)
+            start = now if catchup else max(self.watermark, now)
+            after = None
+            while True:
+                rows = due_batch(db, start, end, after, self.batch_size)
+                if not rows:
+                    break
+                claimed = claim(db, rows, now)
+                with _stats_lock:
+                    _stats["scanned"] += len(rows)
+                    _stats["claimed"] += len(claimed)
+                sent += self._send(db, claimed)
+                if len(rows) < self.batch_size:
+                    break
+                after = (rows[-1].appointment_time, rows[-1].id)
+            self.watermark = end
+            if catchup:
+                self.last_catchup = now
+            self._save_state(db)
+            self._cleanup(db, now)
+        except Exception as exc:
+            with _stats_lock:
+                _stats["last_error"] = str(exc)
+            raise
+        finally:
+            db.close()
+            with _stats_lock:
+                _stats["runs"] += 1
+                _stats["last_run_at"] = now.isoformat()
+        return sent
+
+    def _send(self, db: Session, rows: List) -> int:
+        if not rows:
+            return 0
+        names = {row.patient_name for row in rows}
+        phones: Dict[str, Optional[str]] = {}
+        for name, phone in db.execute(
+            select(Patient.name, Patient.phone).where(Patient.name.in_(names)).order_by(Patient.id.desc())
+        ):
+            phones[name] = phone  # 同名患者取ID最小的一位
+
+        sent = 0
+        for row in rows:
+            message = ReminderMessage(row.id, row.patient_name, phones.get(row.patient_name),
+                                      row.doctor_name, row.appointment_time)
+            try:
+                self.sender.send(message)
+            except Exception as exc:
+                logger.warning("预约 %s 的提醒发送失败：%s", row.id, exc)
+                values = {"status": FAILED, "error": str(exc)[:2000]}
+                with _stats_lock:
+                    _stats["failed"] += 1
+            else:
+                values = {"status": SENT, "sent_at": datetime.now()}
+                sent += 1
+                with _stats_lock:
+                    _stats["sent"] += 1
+            db.execute(
+                update(AppointmentReminder).where(AppointmentReminder.appointment_id == row.id).values(**values)
+            )
+        db.commit()
+        return sent
+
+    def _cleanup(self, db: Session, now: datetime):
+        """删除一批预约时间早于保留期的提醒记录"""
+        cutoff = now - timedelta(days=REMINDER_RETENTION_DAYS)
+        ids = db.execute(
+            select(AppointmentReminder.appointment_id)
+            .where(AppointmentReminder.appointment_time < cutoff)
+            .limit(self.batch_size)
+        ).scalars().all()
+        if ids:
+            db.execute(delete(AppointmentReminder).where(AppointmentReminder.appointment_id.in_(ids)))
+            db.commit()
+
+
+async def run_periodically(scheduler: ReminderScheduler, interval: float = REMINDER_INTERVAL_SECONDS):
+    """Web进程内的定时提醒，每一轮在线程池中执行，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, scheduler.run_once)
+        except Exception:
+            logger.exception("预约提醒失败")
+        await asyncio.sleep(interval)
+
+
+def get_stats() -> Dict:
+    with _stats_lock:
+        return {"lead_hours": REMINDER_LEAD_HOURS, "sender": REMINDER_SENDER, **_stats}
@@ -0,0 +1,141 @@
+"""
+医生/科室月度利用率报表
+
+按预约时间范围流式读取一次预约（只取医生、时间、状态三列，热表和归档表各一次范围查询），
+边读边累加到每位医生的计数器中，内存占用只与医生人数有关，与预约数量无关：
+
+- booked：预约总数；confirmed / cancelled / pending：各状态数量
+- no_shows：预约时间已过、仍为 pending（既未确认也未取消）的预约，视为未到诊
+- no_show_rate：no_shows / 已过预约时间且未取消的预约数
+- busiest_hours：未取消预约最多的几个小时（0-23）
+
+科室汇总由医生计数器合并得到（医生的科室来自 doctors 表，不在表中的医生归入“未知”）。
+GET /api/reports/utilization 同步返回；数据量大时提交 utilization_report 后台任务（见 jobs.py）。
+"""
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import archive
+from exports import month_range
+from jobs import JobContext, register
+from models import Appointment, ArchivedAppointment, Doctor
+from schemas import UtilizationReportParams
+
+# 流式读取时每次从游标取的行数
+REPORT_FETCH_SIZE = int(os.getenv("REPORT_FETCH_SIZE", "1000"))
+# 返回的最繁忙小时数
+BUSIEST_HOURS = 3
+UNKNOWN_SPECIALTY = "未知"
+
+# 计数器下标
+BOOKED, CONFIRMED, CANCELLED, PENDING, NO_SHOWS, PAST_ACTIVE = range(6)
+HOURS_OFFSET = 6
+
+
+def new_counter() -> List[int]:
+    """[booked, confirmed, cancelled, pending, no_shows, past_active, 0点..23点]"""
+    return [0] * (HOURS_OFFSET + 24)
+
+
+def add_appointment(counter: List[int], appointment_time: datetime, status: str, now: datetime):
+    counter[BOOKED] += 1
+    if status == "cancelled":
+        counter[CANCELLED] += 1
+        return
+    counter[CONFIRMED if status == "confirmed" else PENDING] += 1
+    counter[HOURS_OFFSET + appointment_time.hour] += 1
+    if appointment_time < now:
+        counter[PAST_ACTIVE] += 1
+        if status == "pending":
+            counter[NO_SHOWS] += 1
+
+
+def merge(target: List[int], counter: List[int]):
+    for i, value in enumerate(counter):
+        target[i] += value
+
+
+def summarize(name: str, counter: List[int], specialty: Optional[str] = None) -> Dict:
+    hours = counter[HOURS_OFFSET:]
+    busiest = sorted((hour for hour in range(24) if hours[hour]), key=lambda hour: (-hours[hour], hour))
+    row = {
+        "name": name,
+        "booked": counter[BOOKED],
+        "confirmed": counter[CONFIRMED],
+        "cancelled": counter[CANCELLED],
+        "pending": counter[PENDING],
+        "no_shows": counter[NO_SHOWS],
+        "no_show_rate": round(counter[NO_SHOWS] / counter[PAST_ACTIVE], 4) if counter[PAST_ACTIVE] else 0.0,
+        "busiest_hours": busiest[:BUSIEST_HOURS],
+    }
+    if specialty is not None:
+        row["specialty"] = specialty
+    return row
+
+
+def stream_appointments(db: Session, start: datetime, end: datetime) -> Iterable[Tuple[str, datetime, str]]:
+    """逐行产出 [start, end) 内预约的 (医生, 时间, 状态)，预约时间可能早于归档边界时也读取归档表"""
+    models = [Appointment]
+    archived_until = archive.archived_until(db)
+    if archived_until is not None and start <= archived_until:
+        models.insert(0, ArchivedAppointment)
+    for model in models:
+        statement = (
+            select(model.doctor_name, model.appointment_time, model.status)
+            .where(model.appointment_time >= start, model.appointment_time < end)
+            .execution_options(yield_per=REPORT_FETCH_SIZE)
+        )
+        yield from db.execute(statement)
+
+
+def utilization_report(db: Session, month: str, now: Optional[datetime] = None,
+                       progress=None) -> Dict:
+    """计算 month（如 2024-05）的医生/科室利用率；progress(done) 每读取 REPORT_FETCH_SIZE 行调用一次"""
+    now = now or datetime.now()
+    start, end = month_range(month)
+    specialties = {name: specialty for name, specialty in db.execute(select(Doctor.name, Doctor.specialty))}
+
+    counters: Dict[str, List[int]] = {}
+    done = 0
+    for doctor_name, appointment_time, status in stream_appointments(db, start, end):
+        counter = counters.get(doctor_name)
+        if counter is None:
+            counter = counters[doctor_name] = new_counter()
+        add_appointment(counter, appointment_time, status, now)
+        done += 1
+        if progress is not None and done % REPORT_FETCH_SIZE == 0:
+            progress(done)
+
+    by_specialty: Dict[str, List[int]] = {}
+    doctors = []
+    for name in sorted(counters, key=lambda name: (-counters[name][BOOKED], name)):
+        specialty = specialties.get(name, UNKNOWN_SPECIALTY)
+        doctors.append(summarize(name, counters[name], specialty))
+        merge(by_specialty.setdefault(specialty, new_counter()), counters[name])
+
+    return {
+        "month": month,
+        "generated_at": now,
+        "total_appointments": done,
+        "doctors": doctors,
+        "specialties": [
+            summarize(specialty, by_specialty[specialty])
+            for specialty in sorted(by_specialty, key=lambda name: (-by_specialty[name][BOOKED], name))
+        ],
+    }
+
+
+@register("utilization_report", UtilizationReportParams, description="医生/科室月度利用率报表（JSON）")
+def run_utilization_report(context: JobContext, params: UtilizationReportParams, out) -> str:
+    db = context.session()
+    try:
+        report = utilization_report(db, params.month, progress=lambda done: context.progress(done))
+    finally:
+        db.close()
+    json.dump(report, out, ensure_ascii=False, default=lambda value: value.isoformat())
+    return f"共统计 {report['total_appointments']} 条预约、{len(report['doctors'])} 位医生"
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
 from typing import Optional
 from database import get_db
-from schemas import *
+from schemas import (
+    Appointment, AppointmentCreate, AppointmentUpdate, AppointmentListResponse, AppointmentWithDetails,
+    SuccessResponse
+)
+import columnar
 import crud
+import idempotency
+from versioning import conflict, parse_if_match, set_etag
 
 router = APIRouter(
     prefix="/appointments",
@@ -14,6 +20,7 @@ router = APIRouter(
 @router.post("/", response_model=SuccessResponse)
 async def create_appointment(
     appointment: AppointmentCreate,
+    idempotency_key: Optional[str] = Header(None, description="幂等键：重试时保持不变，重复请求返回第一次的响应"),
     db: Session = Depends(get_db)
 ):
     """
@@ -25,35 +32,43 @@ async def create_appointment(
     - **status**: 预约状态 (默认为"pending")
     - **reason**: 预约原因 (可选)
     - **notes**: 备注信息 (可选)
+
+    请求头 Idempotency-Key 可选：相同的键重试时直接返回第一次的响应，不会重复创建
     """
-    try:
-        db_appointment = crud.create_appointment(db, appointment)
-        response = SuccessResponse(
-            success=True,
-            data=Appointment.from_orm(db_appointment),
-            message="预约创建成功"
-        )
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    def create():
+        try:
+            db_appointment = crud.create_appointment(db, appointment)
+            response = SuccessResponse(
+                success=True,
+                data=Appointment.from_orm(db_appointment),
+                message="预约创建成功"
+            )
+            return response
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await idempotency.execute(db, "POST /api/appointments", idempotency_key, appointment, create)
 
 @router.get("/{appointment_id}", response_model=SuccessResponse)
-async def read_appointment(appointment_id: int, db: Session = Depends(get_db)):
+async def read_appointment(appointment_id: int, response: Response, db: Session = Depends(get_db)):
     """
-    根据ID获取预约信息
+    根据ID获取预约信息，ETag 响应头为记录的版本号
     """
     db_appointment = crud.get_appointment(db, appointment_id)
     if db_appointment is None:
         raise HTTPException(status_code=404, detail="预约不存在")
+    set_etag(response, db_appointment)
     return SuccessResponse(success=True, data=Appointment.from_orm(db_appointment))
 
 @router.get("/", response_model=AppointmentListResponse)
 async def read_appointments(
+    request: Request,
     date_from: Optional[str] = Query(None, description="开始日期 (YYYY-MM-DD)"),
     date_to: Optional[str] = Query(None, description="结束日期 (YYYY-MM-DD)"),
     status: Optional[str] = Query(None, description="预约状态"),
     doctor: Optional[str] = Query(None, description="医生姓名"),
     patient: Optional[str] = Query(None, description="患者姓名"),
+    format: Optional[str] = Query(None, pattern="^columns$", description="columns：列式紧凑格式"),
     db: Session = Depends(get_db)
 ):
     """
@@ -69,25 +84,35 @@ async def read_appointments(
         patient=patient
     )
 
-    return AppointmentListResponse(
+    response = AppointmentListResponse(
         appointments=appointments,
         today_summary=today_summary
     )
+    return columnar.respond(request, response, "appointments", AppointmentWithDetails, format)
 
 @router.put("/{appointment_id}", response_model=SuccessResponse)
 async def update_appointment(
     appointment_id: int,
     appointment: AppointmentUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="读取时的 ETag（版本号），不一致时返回409"),
     db: Session = Depends(get_db)
 ):
     """
     更新预约信息
 
     注意：编辑预约时预约时间可以是过去的日期
+
+    - 通过 If-Match 请求头或请求体中的 version 指定读取时的版本号，
+      记录已被他人修改时返回 409；两者都不提供时直接覆盖
     """
-    db_appointment = crud.update_appointment(db, appointment_id, appointment)
+    try:
+        db_appointment = crud.update_appointment(db, appointment_id, appointment, expected_version=parse_if_match(if_match))
+    except crud.VersionConflictError as e:
+        raise conflict(e)
     if db_appointment is None:
         raise HTTPException(status_code=404, detail="预约不存在")
+    set_etag(response, db_appointment)
     return SuccessResponse(
         success=True,
         data=Appointment.from_orm(db_appointment),
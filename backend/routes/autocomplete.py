@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from database import get_db
+from models import Doctor, Patient
+from schemas import AutocompleteItem, AutocompleteResponse
+import name_index
+
+router = APIRouter(
+    prefix="/autocomplete",
+    tags=["autocomplete"],
+    responses={404: {"description": "Not found"}},
+)
+
+MODELS = {"patient": Patient, "doctor": Doctor}
+
+@router.get("", response_model=AutocompleteResponse)
+async def autocomplete(
+    type: str = Query(..., pattern="^(patient|doctor)$", description="patient：患者；doctor：医生"),
+    q: str = Query(..., min_length=1, max_length=100, description="已输入的姓名前缀（汉字或拼音）"),
+    limit: int = Query(name_index.AUTOCOMPLETE_LIMIT, ge=1, le=50, description="最多返回的条数"),
+    db: Session = Depends(get_db)
+):
+    """
+    姓名补全：返回姓名以 q 开头的前 limit 个患者/医生（含ID），按姓名排序
+
+    大小写、全角、空格不影响匹配；安装 pypinyin 后输入拼音也能补全汉字姓名。
+    数据来自进程内的有序姓名数组（二分查找），不查询数据表
+    """
+    items = name_index.complete(db, MODELS[type], q, limit)
+    return AutocompleteResponse(
+        type=type,
+        q=q,
+        items=[AutocompleteItem(id=entity_id, name=name) for entity_id, name in items]
+    )
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+from database import get_db
+from schemas import ChangesResponse
+import changelog
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["changes"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("", response_model=ChangesResponse)
+async def read_changes(
+    since: Optional[int] = Query(None, ge=0, description="上次响应中的 cursor；为空时只返回当前游标"),
+    limit: int = Query(changelog.CHANGES_PAGE_LIMIT, ge=1, le=5000, description="每页最多读取的变更数"),
+    db: Session = Depends(get_db)
+):
+    """
+    增量同步：返回 since 之后患者、医生、预约的新增、修改和删除（墓碑），按变更顺序排列
+
+    首次同步先全量加载列表，再用不带 since 的请求取得当前 cursor；之后每次用上次的 cursor 请求，
+    has_more 为 true 时继续读取。游标早于日志保留范围时返回 410，需要重新全量加载
+    """
+    # 副本的延迟可能超过 CHANGES_SETTLE_SECONDS，游标会越过副本上尚未出现的变更，所以读主库
+    db.use_replica = False
+    if since is None:
+        return ChangesResponse(changes=[], cursor=changelog.head(db), has_more=False)
+    try:
+        changes, cursor, has_more = changelog.read_changes(db, since, limit)
+    except changelog.CursorExpiredError as exc:
+        raise HTTPException(status_code=410, detail=f"{exc}，请重新全量加载")
+    return ChangesResponse(changes=changes, cursor=cursor, has_more=has_more)
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from database import get_db
 from schemas import DashboardResponse
@@ -20,5 +21,6 @@ async def get_dashboard(db: Session = Depends(get_db)):
     - 近期预约：最近5个预约记录
     - 部门统计：各科室的医生数量和预约数量综合统计
     """
-    dashboard_data = get_dashboard_summary(db)
+    # 统计查询在线程池中执行，不阻塞事件循环（并发的相同请求才能在 coalescing 中合并）
+    dashboard_data = await run_in_threadpool(get_dashboard_summary, db)
     return dashboard_data
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Optional
 from database import get_db
-from schemas import *
+from schemas import (
+    Doctor, DoctorCreate, DoctorUpdate, DoctorListResponse, SuccessResponse
+)
+import columnar
 import crud
+from versioning import conflict, parse_if_match, set_etag
+
+# 只传 page 或 cursor 时的默认每页数量
+DEFAULT_PAGE_SIZE = 20
 
 router = APIRouter(
     prefix="/doctors",
@@ -38,52 +46,96 @@ async def create_doctor(
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{doctor_id}", response_model=SuccessResponse)
-async def read_doctor(doctor_id: int, db: Session = Depends(get_db)):
+async def read_doctor(doctor_id: int, response: Response, db: Session = Depends(get_db)):
     """
-    根据ID获取医生信息
+    根据ID获取医生信息，ETag 响应头为记录的版本号
     """
     db_doctor = crud.get_doctor(db, doctor_id)
     if db_doctor is None:
         raise HTTPException(status_code=404, detail="医生不存在")
+    set_etag(response, db_doctor)
     return SuccessResponse(success=True, data=Doctor.from_orm(db_doctor))
 
 @router.get("/", response_model=DoctorListResponse)
 async def read_doctors(
+    request: Request,
     specialty: Optional[str] = Query(None, description="专业科室筛选"),
     status: Optional[str] = Query(None, description="状态筛选"),
     search: Optional[str] = Query(None, description="搜索医生姓名"),
+    fuzzy: bool = Query(False, description="容错搜索：按姓名相似度排序（不支持 cursor 分页）"),
+    page: Optional[int] = Query(None, ge=1, description="页码（不传page/limit/cursor时返回全部）"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="每页数量"),
+    cursor: Optional[int] = Query(None, ge=0, description="游标：上一页返回的 next_cursor"),
+    format: Optional[str] = Query(None, pattern="^columns$", description="columns：列式紧凑格式"),
     db: Session = Depends(get_db)
 ):
     """
     获取医生列表，支持专业、状态和姓名的筛选
+
+    - 分页：page + limit，或 cursor + limit（键集分页，适合逐页加载大量医生）
+    - summary 中的统计始终针对全部筛选结果，与分页无关
+    - fuzzy=true：按姓名相似度排序的容错搜索，只支持 page + limit 分页
     """
-    doctors, summary = crud.get_doctors(
+    paginated = page is not None or limit is not None or cursor is not None
+    if paginated and limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    skip = (page - 1) * limit if page is not None and cursor is None else 0
+
+    # 查询在线程池中执行，不阻塞事件循环
+    doctors, summary = await run_in_threadpool(
+        crud.get_doctors,
         db=db,
         specialty=specialty,
         status=status,
-        search=search
+        search=search,
+        skip=skip,
+        limit=limit,
+        cursor=None if fuzzy and search else cursor,
+        fuzzy=fuzzy
     )
 
     # 将SQLAlchemy对象转换为Pydantic对象
     doctor_models = [Doctor.from_orm(doctor) for doctor in doctors]
 
-    return DoctorListResponse(
+    pagination = None
+    if paginated:
+        total = summary["total"]
+        pagination = {
+            "page": page,
+            "limit": limit,
+            "total": total,
+            "totalPages": (total + limit - 1) // limit,  # 向上取整
+            "next_cursor": doctors[-1].id if len(doctors) == limit and not (fuzzy and search) else None
+        }
+
+    response = DoctorListResponse(
         doctors=doctor_models,
-        summary=summary
+        summary=summary,
+        pagination=pagination
     )
+    return columnar.respond(request, response, "doctors", Doctor, format)
 
 @router.put("/{doctor_id}", response_model=SuccessResponse)
 async def update_doctor(
     doctor_id: int,
     doctor: DoctorUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="读取时的 ETag（版本号），不一致时返回409"),
     db: Session = Depends(get_db)
 ):
     """
     更新医生信息
+
+    - 通过 If-Match 请求头或请求体中的 version 指定读取时的版本号，
+      记录已被他人修改时返回 409；两者都不提供时直接覆盖
     """
-    db_doctor = crud.update_doctor(db, doctor_id, doctor)
+    try:
+        db_doctor = crud.update_doctor(db, doctor_id, doctor, expected_version=parse_if_match(if_match))
+    except crud.VersionConflictError as e:
+        raise conflict(e)
     if db_doctor is None:
         raise HTTPException(status_code=404, detail="医生不存在")
+    set_etag(response, db_doctor)
     return SuccessResponse(
         success=True,
         data=Doctor.from_orm(db_doctor),
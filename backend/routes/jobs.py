@@ -0,0 +1,116 @@
+import os
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from database import get_db
+from schemas import Job, JobSubmit, SuccessResponse
+import jobs
+from models import Job as JobRecord
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+jobs.load_kinds()
+
+
+def _get_job(db: Session, job_id: str) -> JobRecord:
+    job = db.get(JobRecord, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+
+@router.get("/kinds", response_model=SuccessResponse)
+async def list_job_kinds():
+    """
+    获取可提交的任务类型及其参数
+    """
+    kinds = [
+        {
+            "kind": kind.name,
+            "description": kind.description,
+            "media_type": kind.media_type,
+            "params": kind.params_schema.model_json_schema(),
+        }
+        for kind in jobs.JOB_KINDS.values()
+    ]
+    return SuccessResponse(success=True, data=kinds)
+
+
+@router.post("/", response_model=SuccessResponse, status_code=202)
+async def submit_job(
+    submit: JobSubmit,
+    db: Session = Depends(get_db),
+    manager: jobs.JobManager = Depends(jobs.get_manager)
+):
+    """
+    提交后台任务，立即返回任务ID
+
+    - **kind**: 任务类型（见 /api/jobs/kinds）
+    - **params**: 任务参数
+
+    通过 GET /api/jobs/{id} 查询进度，完成后从 GET /api/jobs/{id}/result 下载结果
+    """
+    kind = jobs.JOB_KINDS.get(submit.kind)
+    if kind is None:
+        raise HTTPException(status_code=400, detail=f"未知的任务类型：{submit.kind}")
+    try:
+        params = kind.params_schema(**submit.params)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        job = manager.submit(db, kind.name, params.model_dump(mode="json", exclude_none=True))
+    except jobs.JobQueueFull:
+        raise HTTPException(status_code=503, detail="后台任务排队已满，请稍后重试", headers={"Retry-After": "30"})
+    return SuccessResponse(success=True, data=Job.from_orm(job), message="任务已提交")
+
+
+@router.get("/{job_id}", response_model=SuccessResponse)
+async def read_job(job_id: str, db: Session = Depends(get_db)):
+    """
+    查询任务状态和进度
+    """
+    # 提交后立即轮询时副本上可能还没有这条任务，读主库
+    db.use_replica = False
+    return SuccessResponse(success=True, data=Job.from_orm(_get_job(db, job_id)))
+
+
+@router.get("/{job_id}/result")
+async def download_job_result(job_id: str, db: Session = Depends(get_db)):
+    """
+    下载任务结果文件（任务成功后可用，保留时间见 JOB_RESULT_TTL_HOURS）
+    """
+    # 任务状态刚由后台线程写入主库，副本上可能还是排队中或不存在
+    db.use_replica = False
+    job = _get_job(db, job_id)
+    if job.status != jobs.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"任务尚未成功完成（当前状态：{job.status}）")
+    if not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=410, detail="结果文件已过期")
+    kind = jobs.JOB_KINDS.get(job.kind)
+    return FileResponse(
+        job.result_path,
+        media_type=kind.media_type if kind else None,
+        filename=f"{job.kind}-{job.id}{kind.suffix if kind else ''}",
+    )
+
+
+@router.delete("/{job_id}", response_model=SuccessResponse)
+async def cancel_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    manager: jobs.JobManager = Depends(jobs.get_manager)
+):
+    """
+    取消任务：排队中的任务立即取消，运行中的任务在下一次汇报进度时停止
+    """
+    job = manager.cancel(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return SuccessResponse(success=True, data=Job.from_orm(job), message="已请求取消任务")
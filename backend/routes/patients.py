@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
+import json
 from database import get_db
-from schemas import *
+from schemas import (
+    Patient, PatientCreate, PatientUpdate, PatientListResponse, SuccessResponse
+)
+import columnar
 import crud
+import dedupe
+import idempotency
+from versioning import conflict, parse_if_match, set_etag
 
 router = APIRouter(
     prefix="/patients",
@@ -14,6 +22,7 @@ router = APIRouter(
 @router.post("/", response_model=SuccessResponse)
 async def create_patient(
     patient: PatientCreate,
+    idempotency_key: Optional[str] = Header(None, description="幂等键：重试时保持不变，重复请求返回第一次的响应"),
     db: Session = Depends(get_db)
 ):
     """
@@ -26,34 +35,69 @@ async def create_patient(
     - **address**: 家庭地址 (可选)
     - **medical_condition**: 病情描述 (必填)
     - **notes**: 备注信息 (可选)
+
+    请求头 Idempotency-Key 可选：相同的键重试时直接返回第一次的响应，不会重复创建
     """
-    try:
-        db_patient = crud.create_patient(db, patient)
-        response = SuccessResponse(
-            success=True,
-            data=Patient.from_orm(db_patient),
-            message="患者创建成功"
-        )
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    def create():
+        try:
+            db_patient = crud.create_patient(db, patient)
+            response = SuccessResponse(
+                success=True,
+                data=Patient.from_orm(db_patient),
+                message="患者创建成功"
+            )
+            return response
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await idempotency.execute(db, "POST /api/patients", idempotency_key, patient, create)
+
+@router.get("/duplicates")
+async def find_duplicate_patients(
+    since_id: Optional[int] = Query(None, ge=0, description="只查新患者：上次返回的 X-Next-Since-Id，为空时全量比较"),
+    min_score: float = Query(dedupe.DEFAULT_MIN_SCORE, ge=0, le=1, description="相似度下限"),
+    db: Session = Depends(get_db)
+):
+    """
+    疑似重复的患者（合并建议），JSON Lines 流式返回
+
+    - 只比较分块键（规范化电话、姓名拼音、首字母+年龄段）相同的患者
+    - 每行一条建议：patient_id 建议保留，duplicate_id 疑似重复，score 为相似度
+    - 响应头 X-Next-Since-Id 为下一次增量查重使用的 since_id
+
+    患者量大时的全量查重建议提交 patient_dedupe 后台任务（/api/jobs）
+    """
+    # 查重前会为新患者补建分块键（写操作），之前的读取也必须在主库上，否则按副本上
+    # 过时的数据补建会重复插入或漏掉新患者
+    db.use_replica = False
+    until_id = dedupe.last_patient_id(db)
+    suggestions = dedupe.find_duplicates(db, since_id, until_id, min_score=min_score)
+    return StreamingResponse(
+        (json.dumps(suggestion, ensure_ascii=False) + "\n" for suggestion in suggestions),
+        media_type="application/x-ndjson",
+        headers={"X-Next-Since-Id": str(until_id)},
+    )
 
 @router.get("/{patient_id}", response_model=SuccessResponse)
-async def read_patient(patient_id: int, db: Session = Depends(get_db)):
+async def read_patient(patient_id: int, response: Response, db: Session = Depends(get_db)):
     """
-    根据ID获取患者信息
+    根据ID获取患者信息，ETag 响应头为记录的版本号
     """
     db_patient = crud.get_patient(db, patient_id)
     if db_patient is None:
         raise HTTPException(status_code=404, detail="患者不存在")
+    set_etag(response, db_patient)
     return SuccessResponse(success=True, data=Patient.from_orm(db_patient))
 
 @router.get("/", response_model=PatientListResponse)
 async def read_patients(
+    request: Request,
     page: int = Query(1, ge=1, description="页码"),
     limit: int = Query(10, ge=1, le=100, description="每页数量"),
     search: Optional[str] = Query(None, description="搜索姓名/电话/病情"),
     gender: Optional[str] = Query(None, description="性别筛选 (男/女)"),
+    fuzzy: bool = Query(False, description="容错搜索：按姓名相似度排序，容忍错别字和拼音拼写错误"),
+    format: Optional[str] = Query(None, pattern="^columns$", description="columns：列式紧凑格式"),
     db: Session = Depends(get_db)
 ):
     """
@@ -65,7 +109,8 @@ async def read_patients(
         skip=skip,
         limit=limit,
         search=search,
-        gender=gender
+        gender=gender,
+        fuzzy=fuzzy
     )
 
     total_pages = (total + limit - 1) // limit  # 向上取整
@@ -73,7 +118,7 @@ async def read_patients(
     # 将SQLAlchemy对象转换为Pydantic对象
     patient_models = [Patient.from_orm(patient) for patient in patients]
 
-    return PatientListResponse(
+    response = PatientListResponse(
         patients=patient_models,
         pagination={
             "page": page,
@@ -82,19 +127,29 @@ async def read_patients(
             "totalPages": total_pages
         }
     )
+    return columnar.respond(request, response, "patients", Patient, format)
 
 @router.put("/{patient_id}", response_model=SuccessResponse)
 async def update_patient(
     patient_id: int,
     patient: PatientUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="读取时的 ETag（版本号），不一致时返回409"),
     db: Session = Depends(get_db)
 ):
     """
     更新患者信息
+
+    - 通过 If-Match 请求头或请求体中的 version 指定读取时的版本号，
+      记录已被他人修改时返回 409；两者都不提供时直接覆盖
     """
-    db_patient = crud.update_patient(db, patient_id, patient)
+    try:
+        db_patient = crud.update_patient(db, patient_id, patient, expected_version=parse_if_match(if_match))
+    except crud.VersionConflictError as e:
+        raise conflict(e)
     if db_patient is None:
         raise HTTPException(status_code=404, detail="患者不存在")
+    set_etag(response, db_patient)
     return SuccessResponse(
         success=True,
         data=Patient.from_orm(db_patient),
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from database import get_db
+from schemas import MONTH_PATTERN, UtilizationReport
+import reports
+
+router = APIRouter(
+    prefix="/reports",
+    tags=["reports"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("/utilization", response_model=UtilizationReport)
+async def get_utilization_report(
+    month: str = Query(..., pattern=MONTH_PATTERN, description="统计月份，如 2024-05"),
+    db: Session = Depends(get_db)
+):
+    """
+    医生/科室月度利用率
+
+    - 每位医生和每个科室的预约数、已确认数、已取消数、待确认数
+    - 未到诊数（预约时间已过仍为待确认）和未到诊率
+    - 最繁忙的小时
+
+    预约只读取一遍、边读边汇总；数据量大时可提交 utilization_report 后台任务（/api/jobs）
+    """
+    return await run_in_threadpool(reports.utilization_report, db, month)
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Optional
+from database import get_db
+from schemas import SearchResponse, SearchResult
+import fulltext
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("", response_model=SearchResponse)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200, description="搜索词"),
+    type: Optional[str] = Query(None, pattern="^(patient|doctor|appointment)$", description="只搜一种类型，为空时搜全部"),
+    page: int = Query(1, ge=1, description="页码"),
+    limit: int = Query(20, ge=1, le=100, description="每页数量"),
+    db: Session = Depends(get_db)
+):
+    """
+    统一搜索：同时搜索患者（姓名/电话/病情）、医生（姓名/科室）和预约（原因/备注）
+
+    所有搜索词都出现的记录才返回，按相关度排序；中文按相邻两字匹配，不需要分词。
+    数据来自进程内的倒排索引，不查询数据表。每种类型只对得分最高的
+    SEARCH_MAX_HITS 条排序分页，total 为全部命中数
+    """
+    # 核对、补读索引会查询数据库，放到线程池中执行，不阻塞事件循环
+    results, total = await run_in_threadpool(
+        fulltext.search, db, q, [type] if type else None, (page - 1) * limit, limit
+    )
+    return SearchResponse(
+        q=q,
+        results=[SearchResult(**result) for result in results],
+        pagination={
+            "page": page,
+            "limit": limit,
+            "total": total,
+            "totalPages": (total + limit - 1) // limit  # 向上取整
+        }
+    )
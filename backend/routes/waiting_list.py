@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from datetime import date
+from database import get_db
+from schemas import (
+    Appointment, SuccessResponse, WaitingListEntry, WaitingListJoin, WaitingListResponse
+)
+import waiting_list
+
+router = APIRouter(
+    prefix="/waiting-list",
+    tags=["waiting-list"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("/{doctor_name}", response_model=WaitingListResponse)
+async def read_waiting_list(doctor_name: str, db: Session = Depends(get_db)):
+    """
+    获取医生今天的候诊队列（按叫号顺序）
+    """
+    queue_date = date.today()
+    entries = waiting_list.waiting(db, doctor_name, queue_date)
+    return WaitingListResponse(
+        doctor_name=doctor_name,
+        queue_date=queue_date,
+        count=len(entries),
+        waiting=[WaitingListEntry.from_orm(entry) for entry in entries],
+    )
+
+@router.post("/{doctor_name}", response_model=SuccessResponse)
+async def join_waiting_list(doctor_name: str, join: WaitingListJoin, db: Session = Depends(get_db)):
+    """
+    现场取号
+
+    - **patient_name**: 患者姓名 (必填)
+    - **reason**: 就诊原因 (可选)
+
+    返回排队号和前面等待的人数
+    """
+    entry, ahead = waiting_list.enqueue(db, doctor_name, join.patient_name, join.reason)
+    return SuccessResponse(
+        success=True,
+        data={"entry": WaitingListEntry.from_orm(entry), "ahead": ahead},
+        message=f"取号成功：{entry.number} 号"
+    )
+
+@router.post("/{doctor_name}/call-next", response_model=SuccessResponse)
+async def call_next(doctor_name: str, db: Session = Depends(get_db)):
+    """
+    叫号：队首患者生成一条已确认的预约（预约时间为叫号时间）
+    """
+    try:
+        result = waiting_list.call_next(db, doctor_name)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="没有等待中的患者")
+    entry, appointment = result
+    return SuccessResponse(
+        success=True,
+        data={"entry": WaitingListEntry.from_orm(entry), "appointment": Appointment.from_orm(appointment)},
+        message=f"请 {entry.number} 号 {entry.patient_name} 就诊"
+    )
+
+@router.post("/{doctor_name}/{number}/skip", response_model=SuccessResponse)
+async def skip_entry(doctor_name: str, number: int, db: Session = Depends(get_db)):
+    """
+    过号：患者不在场，移到队尾
+    """
+    entry = waiting_list.skip(db, doctor_name, number)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="该排队号不在等待队列中")
+    return SuccessResponse(success=True, data=WaitingListEntry.from_orm(entry), message="已过号")
+
+@router.delete("/{doctor_name}/{number}", response_model=SuccessResponse)
+async def cancel_entry(doctor_name: str, number: int, db: Session = Depends(get_db)):
+    """
+    取消排号
+    """
+    entry = waiting_list.cancel(db, doctor_name, number)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="该排队号不在等待队列中")
+    return SuccessResponse(success=True, data=WaitingListEntry.from_orm(entry), message="已取消排号")
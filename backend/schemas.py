@@ -1,6 +1,7 @@
+import json
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List, Dict, Any
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 
 # 性别枚举
@@ -46,10 +47,11 @@ class PatientCreate(PatientBase):
     pass
 
 class PatientUpdate(PatientBase):
-    pass
+    version: Optional[int] = Field(None, ge=1, description="客户端读取时的版本号，不一致时拒绝更新")
 
 class Patient(PatientBase):
     id: int
+    version: int
     created_at: datetime
     updated_at: datetime
 
@@ -76,10 +78,11 @@ class DoctorCreate(DoctorBase):
     pass
 
 class DoctorUpdate(DoctorBase):
-    pass
+    version: Optional[int] = Field(None, ge=1, description="客户端读取时的版本号，不一致时拒绝更新")
 
 class Doctor(DoctorBase):
     id: int
+    version: int
     created_at: datetime
     updated_at: datetime
 
@@ -89,6 +92,7 @@ class Doctor(DoctorBase):
 class DoctorListResponse(BaseModel):
     doctors: List[Doctor]
     summary: Dict[str, Any]
+    pagination: Optional[Dict[str, Any]] = None
 
 # ============================================
 # 预约相关Schemas
@@ -110,6 +114,8 @@ class AppointmentCreate(AppointmentBase):
         return v
 
 class AppointmentUpdate(AppointmentBase):
+    version: Optional[int] = Field(None, ge=1, description="客户端读取时的版本号，不一致时拒绝更新")
+
     @validator('appointment_time')
     def validate_appointment_time_future_edit(cls, v):
         # 编辑时不强制验证未来时间
@@ -117,6 +123,7 @@ class AppointmentUpdate(AppointmentBase):
 
 class Appointment(AppointmentBase):
     id: int
+    version: int
     created_at: datetime
     updated_at: datetime
 
@@ -177,3 +184,157 @@ class DashboardResponse(BaseModel):
     summary: DashboardSummary
     recent_appointments: List[RecentAppointment]
     departments: List[DepartmentSummary]
+
+# ============================================
+# 后台任务 Schemas
+# ============================================
+
+# 月份参数，如 2024-05
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+class JobSubmit(BaseModel):
+    kind: str = Field(..., description="任务类型，见 GET /api/jobs/kinds")
+    params: Dict[str, Any] = Field(default_factory=dict, description="任务参数")
+
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str
+    progress: int
+    message: Optional[str] = None
+    params: Dict[str, Any] = Field(default_factory=dict)
+    error: Optional[str] = None
+    result_size: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    @validator('params', pre=True)
+    def parse_params(cls, v):
+        # 数据库中以JSON文本保存
+        if isinstance(v, str):
+            return json.loads(v)
+        return v or {}
+
+    class Config:
+        from_attributes = True
+
+class AppointmentExportParams(BaseModel):
+    month: Optional[str] = Field(None, pattern=MONTH_PATTERN, description="预约月份，如 2024-05，为空导出全部")
+    doctor_name: Optional[str] = None
+    status: Optional[AppointmentStatusEnum] = None
+
+class PatientExportParams(BaseModel):
+    gender: Optional[GenderEnum] = None
+
+# ============================================
+# 报表 Schemas
+# ============================================
+
+class UtilizationReportParams(BaseModel):
+    month: str = Field(..., pattern=MONTH_PATTERN, description="统计月份，如 2024-05")
+
+class UtilizationRow(BaseModel):
+    name: str
+    specialty: Optional[str] = None
+    booked: int
+    confirmed: int
+    cancelled: int
+    pending: int
+    no_shows: int
+    no_show_rate: float
+    busiest_hours: List[int]
+
+class UtilizationReport(BaseModel):
+    month: str
+    generated_at: datetime
+    total_appointments: int
+    doctors: List[UtilizationRow]
+    specialties: List[UtilizationRow]
+
+# ============================================
+# 现场候诊队列 Schemas
+# ============================================
+
+class WaitingListJoin(BaseModel):
+    patient_name: str = Field(..., max_length=100, description="患者姓名")
+    reason: Optional[str] = Field(None, description="就诊原因")
+
+class WaitingListEntry(BaseModel):
+    id: int
+    doctor_name: str
+    queue_date: date
+    number: int
+    patient_name: str
+    reason: Optional[str] = None
+    status: str
+    skips: int
+    appointment_id: Optional[int] = None
+    created_at: datetime
+    called_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class WaitingListResponse(BaseModel):
+    doctor_name: str
+    queue_date: date
+    count: int
+    waiting: List[WaitingListEntry]
+
+# ============================================
+# 患者查重 Schemas
+# ============================================
+
+class PatientDedupeParams(BaseModel):
+    since_id: Optional[int] = Field(None, ge=0, description="只查新患者：ID大于此值的患者与已有患者比较，为空时全量比较")
+    rebuild: bool = Field(False, description="全量比较前重建全部患者的分块键（患者信息修改后使用）")
+    min_score: float = Field(0.5, ge=0, le=1, description="相似度下限")
+
+# ============================================
+# 姓名补全 Schemas
+# ============================================
+
+class AutocompleteItem(BaseModel):
+    id: int
+    name: str
+
+class AutocompleteResponse(BaseModel):
+    type: str
+    q: str
+    items: List[AutocompleteItem]
+
+# ============================================
+# 统一搜索 Schemas
+# ============================================
+
+class SearchResult(BaseModel):
+    type: str = Field(..., description="patient / doctor / appointment")
+    id: int
+    score: float = Field(..., description="相关度得分，越大越靠前")
+    title: str
+    subtitle: Optional[str] = None
+
+class SearchResponse(BaseModel):
+    q: str
+    results: List[SearchResult]
+    pagination: Dict[str, Any]
+
+# ============================================
+# 增量同步 Schemas
+# ============================================
+
+class ChangeEntry(BaseModel):
+    cursor: int = Field(..., description="变更序号")
+    type: str = Field(..., description="patient / doctor / appointment")
+    id: int
+    op: str = Field(..., description="insert / update / delete（insert、update 均按存在则替换处理）")
+    version: Optional[int] = None
+    changed_at: datetime
+    data: Optional[Dict[str, Any]] = Field(None, description="当前数据，删除时为空")
+
+class ChangesResponse(BaseModel):
+    changes: List[ChangeEntry]
+    cursor: int = Field(..., description="下次请求的 since")
+    has_more: bool = Field(..., description="为 true 时立即用 cursor 继续读取")
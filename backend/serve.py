@@ -0,0 +1,105 @@
+"""
+生产环境服务入口
+
+    python serve.py                     # 按CPU核数启动多个工作进程
+    python serve.py --workers 4 --port 8000
+    python serve.py --reload            # 开发模式（单进程、自动重载）
+
+- 自动使用 uvloop / httptools（已安装时）
+- 收到 SIGTERM 后停止接受新连接，等待进行中的请求完成（最长 --graceful-timeout 秒）
+- 数据库连接总数按工作进程数平均分配，避免多进程时连接数超过数据库上限
+"""
+import argparse
+import importlib.util
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+
+def _module_available(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def default_workers() -> int:
+    """默认工作进程数：WEB_CONCURRENCY 或CPU核数"""
+    return int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+
+def derive_pool_settings(max_connections: int, workers: int) -> Tuple[int, int]:
+    """
+    按工作进程数分配数据库连接
+
+    每个进程的 pool_size + max_overflow 不超过 max_connections / workers，
+    其中约四分之三作为常驻连接，其余作为突发溢出。
+    """
+    per_worker = max(1, max_connections // max(1, workers))
+    pool_size = max(1, per_worker * 3 // 4)
+    max_overflow = per_worker - pool_size
+    return pool_size, max_overflow
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="HospitalRun API 服务")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"), help="监听地址")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")), help="监听端口")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数（默认CPU核数）")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("KEEP_ALIVE", "5")),
+                        help="HTTP keep-alive 超时（秒）")
+    parser.add_argument("--backlog", type=int, default=int(os.getenv("BACKLOG", "2048")),
+                        help="TCP 监听队列长度")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="收到 SIGTERM 后等待进行中请求完成的最长时间（秒）")
+    parser.add_argument("--db-max-connections", type=int,
+                        default=int(os.getenv("DB_MAX_CONNECTIONS", "64")),
+                        help="所有工作进程合计的数据库连接上限")
+    parser.add_argument("--reload", action="store_true", help="开发模式：单进程并在代码变更时重载")
+    return parser
+
+
+def build_config(args: argparse.Namespace) -> Tuple[Dict, Dict[str, str]]:
+    """
+    根据命令行参数生成 uvicorn 配置和需要传给工作进程的环境变量
+
+    返回 (uvicorn.run 的关键字参数, 环境变量)
+    """
+    workers = 1 if args.reload else (args.workers or default_workers())
+    pool_size, max_overflow = derive_pool_settings(args.db_max_connections, workers)
+
+    config = {
+        "host": "127.0.0.1" if args.reload and args.host == "0.0.0.0" else args.host,
+        "port": args.port,
+        "loop": "uvloop" if _module_available("uvloop") else "asyncio",
+        "http": "httptools" if _module_available("httptools") else "h11",
+        "timeout_keep_alive": args.keep_alive,
+        "backlog": args.backlog,
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "proxy_headers": True,
+        "access_log": False,
+    }
+    if args.reload:
+        config["reload"] = True
+        config["access_log"] = True
+    else:
+        config["workers"] = workers
+
+    env = {
+        # 用户显式配置的连接池参数优先
+        "DB_POOL_SIZE": os.getenv("DB_POOL_SIZE", str(pool_size)),
+        "DB_MAX_OVERFLOW": os.getenv("DB_MAX_OVERFLOW", str(max_overflow)),
+    }
+    return config, env
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import uvicorn
+
+    args = build_parser().parse_args(argv)
+    config, env = build_config(args)
+    # 工作进程由 uvicorn 派生，通过环境变量继承连接池配置
+    os.environ.update(env)
+    uvicorn.run("main:app", **config)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+准入控制测试
+测试 admission.py 的路由分类、并发上限、有界队列和 503 快速失败
+"""
+import asyncio
+import re
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import admission
+from admission import AdmissionControlMiddleware, ConcurrencyLimiter, classify
+from main import app
+
+
+class TestClassify:
+    """路由分类测试"""
+
+    def test_route_classes(self):
+        """测试按前缀分类"""
+        assert classify("/api/patients/1") == "interactive"
+        assert classify("/api/appointments/") == "interactive"
+        assert classify("/api/dashboard/") == "report"
+        assert classify("/api/jobs/", method="POST") == "export"
+        assert classify("/api/jobs/abc/result") == "export"
+        assert classify("/api/jobs/abc") == "interactive"
+
+    def test_every_mounted_route_classified(self):
+        """测试应用挂载的每个路由都按预期分类，且每条分类规则至少匹配一个路由"""
+        expected = {
+            "/api/patients": "interactive",
+            "/api/doctors": "interactive",
+            "/api/appointments": "interactive",
+            "/api/dashboard": "report",
+            "/api/reports": "report",
+            "/api/jobs": "interactive",
+            "/api/waiting-list": "interactive",
+            "/api/autocomplete": "interactive",
+            "/api/search": "interactive",
+            "/api/changes": "interactive",
+        }
+        heavy_jobs = {("POST", "/api/jobs/"), ("GET", "/api/jobs/{job_id}/result")}
+        used_rules = set()
+        for route in app.routes:
+            path = route.path
+            for method in getattr(route, "methods", None) or ["GET"]:
+                concrete = re.sub(r"\{[^}]+\}", "1", path)
+                if not path.startswith("/api/"):
+                    assert classify(concrete, method=method) is None, path
+                    continue
+                prefix = "/" + "/".join(path.strip("/").split("/")[:2])
+                assert prefix in expected, f"未声明类别的路由前缀：{prefix}"
+                want = "export" if (method, path) in heavy_jobs else expected[prefix]
+                assert classify(concrete, method=method) == want, (method, path)
+                used_rules.update(
+                    rule for rule in admission.ROUTE_CLASSES
+                    if classify(concrete, [rule], method) == rule[2]
+                )
+
+        assert used_rules == set(admission.ROUTE_CLASSES)
+
+    def test_unlimited_paths(self):
+        """测试健康检查、指标和文档不受限制"""
+        assert classify("/health") is None
+        assert classify("/metrics") is None
+        assert classify("/docs") is None
+        assert classify("/apis") is None
+
+
+class TestConcurrencyLimiter:
+    """并发上限与队列测试"""
+
+    def test_admits_up_to_limit_then_queues(self):
+        """测试超过并发上限的请求排队，释放后依次获得名额"""
+        async def scenario():
+            limiter = ConcurrencyLimiter("test", limit=1, queue_size=1, retry_after=1, queue_timeout=1)
+            assert await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            assert limiter.waiting == 1
+            limiter.release()
+            assert await waiter
+            limiter.release()
+            return limiter.stats()
+
+        stats = asyncio.run(scenario())
+        assert stats["admitted"] == 2
+        assert stats["queued"] == 1
+        assert stats["active"] == 0
+
+    def test_rejects_when_queue_full(self):
+        """测试队列已满时立即拒绝"""
+        async def scenario():
+            limiter = ConcurrencyLimiter("test", limit=1, queue_size=0, retry_after=1, queue_timeout=1)
+            assert await limiter.acquire()
+            assert await limiter.acquire() is False
+            return limiter.stats()
+
+        assert asyncio.run(scenario())["rejected"] == 1
+
+    def test_rejects_after_queue_timeout(self):
+        """测试排队超时后拒绝"""
+        async def scenario():
+            limiter = ConcurrencyLimiter("test", limit=1, queue_size=5, retry_after=1, queue_timeout=0.01)
+            assert await limiter.acquire()
+            assert await limiter.acquire() is False
+            return limiter.stats()
+
+        stats = asyncio.run(scenario())
+        assert stats["timed_out"] == 1
+        assert stats["waiting"] == 0
+
+
+def _app(limiters):
+    """一个可以挂起请求的测试应用"""
+    gate = asyncio.Event()
+
+    async def slow(request):
+        await gate.wait()
+        return JSONResponse({"ok": True})
+
+    async def fast(request):
+        return JSONResponse({"ok": True})
+
+    app = Starlette(routes=[
+        Route("/api/dashboard/", slow),
+        Route("/api/patients/", fast),
+    ])
+    return AdmissionControlMiddleware(app, limiters=limiters), gate
+
+
+class TestMiddleware:
+    """中间件测试"""
+
+    def test_overloaded_class_returns_503_and_others_proceed(self):
+        """测试报表过载时返回503和Retry-After，挂号接口不受影响"""
+        async def scenario():
+            limiters = {
+                "interactive": ConcurrencyLimiter("interactive", 5, 5, 1),
+                "report": ConcurrencyLimiter("report", 1, 0, 7),
+            }
+            app, gate = _app(limiters)
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                first = asyncio.ensure_future(client.get("/api/dashboard/"))
+                await asyncio.sleep(0.05)
+                rejected = await client.get("/api/dashboard/")
+                booking = await client.get("/api/patients/")
+                gate.set()
+                return (await first), rejected, booking, limiters
+
+        first, rejected, booking, limiters = asyncio.run(scenario())
+        assert first.status_code == 200
+        assert rejected.status_code == 503
+        assert rejected.headers["retry-after"] == "7"
+        assert rejected.json()["error"]["code"] == "SERVICE_OVERLOADED"
+        assert booking.status_code == 200
+        assert limiters["report"].stats()["rejected"] == 1
+        assert limiters["report"].stats()["active"] == 0
+
+    def test_metrics_expose_admission(self, client):
+        """测试 /metrics 包含各类别的限流统计"""
+        data = client.get("/metrics").json()["admission"]
+
+        assert set(data["classes"]) == {"interactive", "report", "export"}
+        assert "rejected" in data["classes"]["interactive"]
@@ -303,6 +303,112 @@ class TestAppointmentUpdate:
         assert response.json()['data']['status'] == "cancelled"
 
 
+class TestAppointmentOptimisticConcurrency:
+    """预约乐观锁测试"""
+
+    def _update_data(self, appointment, **overrides):
+        data = {
+            "patient_name": appointment.patient_name,
+            "doctor_name": appointment.doctor_name,
+            "appointment_time": appointment.appointment_time.isoformat(),
+            "status": "confirmed",
+        }
+        data.update(overrides)
+        return data
+
+    def test_read_returns_version_and_etag(self, client, create_appointment):
+        """测试详情接口返回版本号和 ETag"""
+        appointment = create_appointment()
+
+        response = client.get(f"/api/appointments/{appointment.id}")
+
+        assert response.json()['data']['version'] == 1
+        assert response.headers['etag'] == '"1"'
+
+    def test_update_increments_version(self, client, create_appointment):
+        """测试每次更新版本号加1"""
+        appointment = create_appointment()
+
+        response = client.put(
+            f"/api/appointments/{appointment.id}",
+            json=self._update_data(appointment),
+            headers={"If-Match": '"1"'}
+        )
+
+        assert response.status_code == 200
+        assert response.json()['data']['version'] == 2
+        assert response.headers['etag'] == '"2"'
+
+    def test_concurrent_edit_conflicts(self, client, create_appointment):
+        """测试前台和医生基于同一版本修改时，后提交的返回409"""
+        appointment = create_appointment()
+        url = f"/api/appointments/{appointment.id}"
+
+        reception = client.put(url, json=self._update_data(appointment, notes="前台"), headers={"If-Match": '"1"'})
+        doctor = client.put(url, json=self._update_data(appointment, notes="医生"), headers={"If-Match": '"1"'})
+
+        assert reception.status_code == 200
+        assert doctor.status_code == 409
+        assert doctor.headers['etag'] == '"2"'
+        assert client.get(url).json()['data']['notes'] == "前台"
+
+    def test_version_in_body(self, client, create_appointment):
+        """测试通过请求体中的 version 做条件更新"""
+        appointment = create_appointment()
+        url = f"/api/appointments/{appointment.id}"
+
+        stale = client.put(url, json=self._update_data(appointment, version=5))
+        current = client.put(url, json=self._update_data(appointment, version=1))
+
+        assert stale.status_code == 409
+        assert current.status_code == 200
+
+    def test_if_match_takes_precedence_over_body(self, client, create_appointment):
+        """测试 If-Match 优先于请求体中的 version"""
+        appointment = create_appointment()
+
+        response = client.put(
+            f"/api/appointments/{appointment.id}",
+            json=self._update_data(appointment, version=5),
+            headers={"If-Match": 'W/"1"'}
+        )
+
+        assert response.status_code == 200
+
+    def test_without_version_overwrites(self, client, create_appointment):
+        """测试不提供版本号时直接覆盖（兼容旧客户端）"""
+        appointment = create_appointment()
+        url = f"/api/appointments/{appointment.id}"
+
+        client.put(url, json=self._update_data(appointment))
+        response = client.put(url, json=self._update_data(appointment, status="cancelled"))
+
+        assert response.status_code == 200
+        assert response.json()['data']['version'] == 3
+
+    def test_conditional_update_of_missing_appointment(self, client, create_appointment):
+        """测试带版本号更新不存在的预约返回404"""
+        appointment = create_appointment()
+
+        response = client.put(
+            "/api/appointments/99999", json=self._update_data(appointment), headers={"If-Match": '"1"'}
+        )
+
+        assert response.status_code == 404
+
+    def test_invalid_if_match(self, client, create_appointment):
+        """测试无法解析的 If-Match 返回400"""
+        appointment = create_appointment()
+
+        response = client.put(
+            f"/api/appointments/{appointment.id}",
+            json=self._update_data(appointment),
+            headers={"If-Match": '"abc"'}
+        )
+
+        assert response.status_code == 400
+
+
 class TestAppointmentDelete:
     """测试删除预约 API"""
 
@@ -158,6 +158,47 @@ class TestDoctorRead:
         assert 'status_count' in summary
         assert summary['total'] == 6
 
+    def test_get_doctors_without_pagination_returns_all(self, client, multiple_doctors):
+        """测试不传分页参数时返回全部医生"""
+        response = client.get("/api/doctors/")
+
+        data = response.json()
+        assert len(data['doctors']) == 6
+        assert data['pagination'] is None
+
+    def test_get_doctors_page_pagination(self, client, multiple_doctors):
+        """测试页码分页"""
+        response = client.get("/api/doctors/?page=2&limit=4")
+
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data['doctors']) == 2
+        assert data['pagination']['total'] == 6
+        assert data['pagination']['totalPages'] == 2
+        assert data['pagination']['next_cursor'] is None
+        assert data['summary']['total'] == 6
+
+    def test_get_doctors_cursor_pagination(self, client, multiple_doctors):
+        """测试游标分页逐页加载全部医生"""
+        seen = []
+        cursor = None
+        while True:
+            url = "/api/doctors/?limit=4" + (f"&cursor={cursor}" if cursor is not None else "")
+            data = client.get(url).json()
+            seen.extend(d['id'] for d in data['doctors'])
+            cursor = data['pagination']['next_cursor']
+            if cursor is None:
+                break
+
+        assert len(seen) == 6
+        assert seen == sorted(seen)
+
+    def test_get_doctors_invalid_limit(self, client):
+        """测试无效的每页数量"""
+        response = client.get("/api/doctors/?limit=0")
+
+        assert response.status_code == 422
+
 
 class TestDoctorUpdate:
     """测试更新医生 API"""
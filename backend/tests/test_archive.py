@@ -0,0 +1,198 @@
+"""
+预约归档测试
+测试 archive.py 的分批归档以及 crud 对归档表的透明读取
+"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy.orm import sessionmaker
+
+import archive
+import crud
+import fulltext
+from models import Appointment, ArchivedAppointment, ArchivedAppointmentCount
+from query_plan import capture_statements
+
+
+@pytest.fixture
+def session_factory(test_engine):
+    """归档任务使用的会话工厂（与 test_db 同一数据库）"""
+    return sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+
+
+@pytest.fixture
+def old_and_new(create_appointment):
+    """三条两年前的预约和一条明天的预约"""
+    two_years_ago = datetime.now() - timedelta(days=730)
+    old = [
+        create_appointment(patient_name=f"老患者{i}", doctor_name="李医生",
+                           appointment_time=two_years_ago + timedelta(hours=i), status="confirmed")
+        for i in range(3)
+    ]
+    new = create_appointment(patient_name="新患者", doctor_name="李医生")
+    return [appointment.id for appointment in old], new.id
+
+
+class TestArchiveJob:
+    """归档任务测试"""
+
+    def test_moves_rows_older_than_cutoff(self, test_db, session_factory, old_and_new):
+        """测试早于截止时间的预约整行搬到归档表"""
+        old_ids, new_id = old_and_new
+
+        moved = archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365), pause=0)
+
+        assert moved == 3
+        test_db.expire_all()
+        assert [a.id for a in test_db.query(Appointment)] == [new_id]
+        archived = test_db.query(ArchivedAppointment).order_by(ArchivedAppointment.id).all()
+        assert [a.id for a in archived] == old_ids
+        assert archived[0].patient_name == "老患者0"
+        assert archived[0].status == "confirmed"
+        assert archived[0].archived_at is not None
+
+    def test_each_batch_commits_separately(self, session_factory, old_and_new):
+        """测试按批提交：每批一个事务"""
+        commits = []
+        factory = lambda: _recording_session(session_factory, commits)
+
+        moved = archive.archive_appointments(factory, cutoff=archive.archive_cutoff(365), batch_size=2, pause=0)
+
+        assert moved == 3
+        assert commits == [2, 1]
+
+    def test_max_batches(self, test_db, session_factory, old_and_new):
+        """测试限制本次执行的批数"""
+        moved = archive.archive_appointments(
+            session_factory, cutoff=archive.archive_cutoff(365), batch_size=1, max_batches=2, pause=0
+        )
+
+        assert moved == 2
+        assert test_db.query(ArchivedAppointment).count() == 2
+
+    def test_nothing_to_archive(self, session_factory, create_appointment):
+        """测试没有历史预约时不做任何事"""
+        create_appointment()
+
+        assert archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365)) == 0
+
+    def test_archived_rows_leave_entity_cache(self, test_db, session_factory, old_and_new):
+        """测试归档后缓存中不再有热表记录"""
+        old_ids, _ = old_and_new
+        crud.get_appointment(test_db, old_ids[0])
+
+        archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365), pause=0)
+        test_db.expunge_all()
+
+        assert isinstance(crud.get_appointment(test_db, old_ids[0]), ArchivedAppointment)
+
+    def test_archived_rows_leave_search_index(self, test_db, session_factory, old_and_new):
+        """测试归档后全文索引中不再有这批预约，不需要重新核对或重建"""
+        fulltext.search(test_db, "复诊")
+        index = fulltext.index_for(test_db, "appointment")
+        before = index.stats()
+        assert before["documents"] == 4
+
+        archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365), pause=0)
+
+        after = index.stats()
+        assert after["documents"] == 1
+        assert (after["rebuilds"], after["refreshes"]) == (before["rebuilds"], before["refreshes"])
+
+    def test_archive_counts_accumulate_per_batch(self, test_db, session_factory, old_and_new, create_appointment):
+        """测试每批归档累加按医生的归档计数"""
+        create_appointment(doctor_name="王医生", appointment_time=datetime.now() - timedelta(days=800))
+
+        archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365), batch_size=2, pause=0)
+
+        assert archive.archived_counts(test_db) == {"李医生": 3, "王医生": 1}
+
+    def test_rebuild_archive_counts(self, test_db, session_factory, old_and_new):
+        """测试按归档表重建计数（升级前已有归档数据时）"""
+        archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365), pause=0)
+        test_db.query(ArchivedAppointmentCount).delete()
+        test_db.commit()
+
+        assert archive.rebuild_archived_counts(test_db) == 1
+        assert archive.archived_counts(test_db) == {"李医生": 3}
+
+
+def _recording_session(session_factory, commits):
+    """记录每次提交前本批搬移数量的会话"""
+    db = session_factory()
+    original_commit = db.commit
+
+    def commit():
+        commits.append(db.query(ArchivedAppointment).count() - sum(commits))
+        original_commit()
+
+    db.commit = commit
+    return db
+
+
+class TestTransparentReads:
+    """历史查询同时读取热表和归档表"""
+
+    @pytest.fixture
+    def archived(self, test_db, session_factory, old_and_new):
+        archive.archive_appointments(session_factory, cutoff=archive.archive_cutoff(365), pause=0)
+        test_db.expire_all()
+        return old_and_new
+
+    def test_list_without_time_filter_skips_archive(self, test_db, archived):
+        """测试不带时间条件的预约列表只查热表，不读归档表"""
+        with capture_statements(test_db.get_bind()) as statements:
+            appointments, _ = crud.get_appointments(test_db, doctor="李医生")
+
+        assert [a["patient_name"] for a in appointments] == ["新患者"]
+        assert not any("appointments_archive" in sql for sql, _ in statements)
+
+    def test_list_includes_archived_when_range_reaches_archive(self, test_db, archived):
+        """测试时间范围早于归档边界时包含归档的预约"""
+        day = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
+
+        appointments, _ = crud.get_appointments(test_db, doctor="李医生", date_to=day)
+
+        assert len(appointments) == 4
+
+    def test_history_date_range(self, test_db, archived):
+        """测试按历史日期范围查询"""
+        day = (datetime.now() - timedelta(days=730)).strftime('%Y-%m-%d')
+
+        appointments, _ = crud.get_appointments(test_db, date_from=day, date_to=day)
+
+        assert {a["patient_name"] for a in appointments} >= {"老患者0"}
+
+    def test_recent_range_skips_archive(self, test_db, archived):
+        """测试查询范围晚于归档边界时不读归档表"""
+        today = datetime.now().strftime('%Y-%m-%d')
+
+        with capture_statements(test_db.get_bind()) as statements:
+            appointments, _ = crud.get_appointments(test_db, date_from=today)
+
+        assert [a["patient_name"] for a in appointments] == ["新患者"]
+        assert not any("FROM appointments_archive " in sql and "max(" not in sql for sql, _ in statements)
+
+    def test_detail_reads_archive(self, test_db, archived):
+        """测试按ID读取已归档的预约"""
+        old_ids, _ = archived
+
+        appointment = crud.get_appointment(test_db, old_ids[1])
+
+        assert appointment.patient_name == "老患者1"
+
+    def test_dashboard_counts_include_archive(self, test_db, archived, create_doctor):
+        """测试仪表盘科室预约数包含归档的预约"""
+        create_doctor(name="李医生", specialty="内科")
+
+        with capture_statements(test_db.get_bind()) as statements:
+            departments = {d["name"]: d for d in crud.get_dashboard_summary(test_db)["departments"]}
+
+        assert departments["内科"]["appointment_count"] == 4
+        # 归档部分读计数表，不对整个归档表分组计数
+        assert not any("FROM appointments_archive " in sql for sql, _ in statements)
+
+    def test_today_summary_ignores_archive(self, test_db, archived):
+        """测试今日统计只查热表"""
+        _, today_summary = crud.get_appointments(test_db)
+
+        assert today_summary["total"] == 0
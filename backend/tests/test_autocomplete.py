@@ -0,0 +1,89 @@
+"""
+姓名补全测试
+测试 name_index.py 的有序数组前缀查找、随写入更新，以及 /api/autocomplete 接口
+"""
+import crud
+import name_index
+from models import Patient
+from query_plan import capture_statements
+from schemas import DoctorCreate, PatientCreate, PatientUpdate
+
+
+def _patient(db, name):
+    return crud.create_patient(db, PatientCreate(name=name, age=30, gender="男", medical_condition="感冒"))
+
+
+def _complete(client, type, q, **params):
+    response = client.get("/api/autocomplete", params={"type": type, "q": q, **params})
+    assert response.status_code == 200, response.text
+    return response.json()["items"]
+
+
+class TestAutocompleteApi:
+    """补全接口测试"""
+
+    def test_patient_prefix_with_ids(self, client, test_db):
+        """测试按前缀返回患者ID和姓名，按姓名排序"""
+        zhang_wei = _patient(test_db, "Zhang Wei")
+        zhang_san = _patient(test_db, "Zhang San")
+        _patient(test_db, "Li Si")
+
+        items = _complete(client, "patient", "zhang")
+
+        assert items == [{"id": zhang_san.id, "name": "Zhang San"}, {"id": zhang_wei.id, "name": "Zhang Wei"}]
+
+    def test_case_width_and_spaces_ignored(self, client, test_db):
+        _patient(test_db, "Zhang San")
+        assert [item["name"] for item in _complete(client, "patient", "ＺＨＡＮＧ s")] == ["Zhang San"]
+
+    def test_chinese_prefix(self, client, test_db):
+        _patient(test_db, "张三")
+        _patient(test_db, "张三丰")
+        _patient(test_db, "李四")
+
+        assert [item["name"] for item in _complete(client, "patient", "张三")] == ["张三", "张三丰"]
+
+    def test_limit(self, client, test_db):
+        for i in range(5):
+            _patient(test_db, f"Wang {i}")
+        assert [item["name"] for item in _complete(client, "patient", "wang", limit=2)] == ["Wang 0", "Wang 1"]
+
+    def test_doctor(self, client, test_db, sample_doctor_data):
+        doctor = crud.create_doctor(test_db, DoctorCreate(**{**sample_doctor_data, "name": "李医生"}))
+        assert _complete(client, "doctor", "李") == [{"id": doctor.id, "name": "李医生"}]
+        assert _complete(client, "patient", "李") == []
+
+    def test_invalid_type(self, client):
+        assert client.get("/api/autocomplete", params={"type": "nurse", "q": "a"}).status_code == 422
+        assert client.get("/api/autocomplete", params={"type": "patient", "q": ""}).status_code == 422
+
+
+class TestIncrementalUpdates:
+    """写入后增量更新测试"""
+
+    def test_writes_update_sorted_array(self, test_db):
+        """测试创建、改名、删除后补全结果立即变化，不重建索引"""
+        patient = _patient(test_db, "Zhang San")
+        assert name_index.complete(test_db, Patient, "zh") == [(patient.id, "Zhang San")]
+        index = name_index.index_for(test_db, Patient)
+        rebuilds = index.rebuilds
+
+        other = _patient(test_db, "Zhao Liu")
+        crud.update_patient(test_db, patient.id, PatientUpdate(name="Chen San", age=30, gender="男",
+                                                               medical_condition="感冒"))
+        assert name_index.complete(test_db, Patient, "zh") == [(other.id, "Zhao Liu")]
+        assert name_index.complete(test_db, Patient, "chen") == [(patient.id, "Chen San")]
+
+        crud.delete_patient(test_db, other.id)
+        assert name_index.complete(test_db, Patient, "zh") == []
+        assert index.rebuilds == rebuilds
+
+    def test_no_queries_once_loaded(self, test_db):
+        """测试索引加载后补全不查询数据库"""
+        _patient(test_db, "Zhang San")
+        name_index.complete(test_db, Patient, "zh")
+
+        with capture_statements(test_db.get_bind()) as statements:
+            name_index.complete(test_db, Patient, "zhang")
+
+        assert statements == []
@@ -0,0 +1,197 @@
+"""
+实体缓存测试
+测试 cache.py 的 LRU/TTL 行为以及 crud 读写路径上的缓存
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import cache
+import crud
+from cache import LRUCache
+from database import Base, ReplicaSet, RoutingSession
+from models import Patient, Appointment
+from query_plan import capture_statements
+from schemas import PatientUpdate, AppointmentUpdate
+
+
+class TestLRUCache:
+    """LRU 容器测试"""
+
+    def test_hit_and_miss(self):
+        """测试命中与未命中计数"""
+        lru = LRUCache(maxsize=2)
+        lru.put(1, "a")
+
+        assert lru.get(1) == "a"
+        assert lru.get(2) is None
+        assert lru.stats()["hits"] == 1
+        assert lru.stats()["misses"] == 1
+
+    def test_evicts_least_recently_used(self):
+        """测试超过容量淘汰最久未使用的条目"""
+        lru = LRUCache(maxsize=2)
+        lru.put(1, "a")
+        lru.put(2, "b")
+        lru.get(1)
+        lru.put(3, "c")
+
+        assert lru.get(2) is None
+        assert lru.get(1) == "a"
+        assert lru.get(3) == "c"
+        assert lru.stats()["evictions"] == 1
+
+    def test_ttl_expiry(self):
+        """测试过期条目视为未命中"""
+        lru = LRUCache(maxsize=2, ttl=0)
+        lru.put(1, "a")
+
+        assert lru.get(1) is None
+        assert lru.stats()["expirations"] == 1
+        assert len(lru) == 0
+
+    def test_zero_size_disables_cache(self):
+        """测试容量为0时不缓存"""
+        lru = LRUCache(maxsize=0)
+        lru.put(1, "a")
+
+        assert len(lru) == 0
+
+    def test_older_version_not_replacing_newer(self):
+        """测试带版本号写入时，旧版本不覆盖已缓存的新版本"""
+        lru = LRUCache(maxsize=2)
+        lru.put(1, "v2", version=2)
+        lru.put(1, "v1", version=1)
+        assert lru.get(1) == "v2"
+        assert lru.stats()["stale_puts"] == 1
+
+        lru.put(1, "v3", version=3)
+        assert lru.get(1) == "v3"
+
+
+class TestReadThrough:
+    """crud 读取路径测试"""
+
+    def test_second_read_skips_database(self, test_db, create_patient):
+        """测试另一个会话第二次读取不查询数据库"""
+        patient = create_patient(name="复诊患者")
+        test_db.expunge_all()
+
+        assert crud.get_patient(test_db, patient.id).name == "复诊患者"
+        test_db.expunge_all()
+        with capture_statements(test_db.get_bind()) as statements:
+            cached = crud.get_patient(test_db, patient.id)
+
+        assert statements == []
+        assert cached.name == "复诊患者"
+        assert cached in test_db
+
+    def test_missing_entity_not_cached(self, test_db):
+        """测试不存在的ID返回 None"""
+        assert crud.get_patient(test_db, 999) is None
+        assert len(cache.caches_for(test_db)[Patient]) == 0
+
+    def test_cached_instance_can_be_updated(self, test_db, create_patient, sample_patient_data):
+        """测试从缓存重建的对象可以直接修改"""
+        patient = create_patient()
+        crud.get_patient(test_db, patient.id)
+        test_db.expunge_all()
+
+        updated = crud.update_patient(test_db, patient.id, PatientUpdate(**{**sample_patient_data, "age": 61}))
+        test_db.expunge_all()
+
+        assert updated.age == 61
+        assert test_db.get(Patient, patient.id).age == 61
+        assert crud.get_patient(test_db, patient.id).age == 61
+
+    def test_miss_interleaved_with_write_keeps_newer_version(self, test_db, test_engine, create_patient,
+                                                            sample_patient_data, monkeypatch):
+        """测试未命中读到旧版本后、写缓存前有并发写入时，旧值不覆盖写入者缓存的新值"""
+        patient = create_patient()
+        cache.clear()
+        original = cache._snapshot
+        written = []
+
+        def write_between_read_and_put(instance):
+            snapshot = original(instance)
+            if not written:
+                written.append(snapshot["version"])
+                crud.update_patient(test_db, patient.id, PatientUpdate(**{**sample_patient_data, "name": "改名"}))
+            return snapshot
+
+        reader = sessionmaker(autoflush=False, bind=test_engine)()
+        try:
+            monkeypatch.setattr(cache, "_snapshot", write_between_read_and_put)
+            assert crud.get_patient(reader, patient.id).version == 1
+        finally:
+            reader.close()
+
+        assert written == [1]
+        test_db.expunge_all()
+        with capture_statements(test_db.get_bind()) as statements:
+            cached = crud.get_patient(test_db, patient.id)
+        assert statements == []
+        assert (cached.name, cached.version) == ("改名", 2)
+
+    def test_replica_read_not_cached(self, test_db, test_engine, create_patient, tmp_path):
+        """测试从副本读到的（可能落后的）值不写入缓存"""
+        patient = create_patient(name="主库姓名")
+        cache.clear()
+        replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        Base.metadata.create_all(bind=replica)
+        with replica.begin() as conn:
+            conn.execute(Patient.__table__.insert().values(
+                id=patient.id, name="副本旧姓名", age=patient.age, gender=patient.gender,
+                medical_condition=patient.medical_condition, version=1,
+            ))
+        factory = sessionmaker(class_=RoutingSession, autoflush=False, bind=test_engine,
+                               replica_set=ReplicaSet([replica], lag_probe=lambda engine: 0.0))
+        db = factory()
+        db.use_replica = True
+        try:
+            assert crud.get_patient(db, patient.id).name == "副本旧姓名"
+        finally:
+            db.close()
+            replica.dispose()
+
+        test_db.expunge_all()
+        assert crud.get_patient(test_db, patient.id).name == "主库姓名"
+
+
+class TestInvalidation:
+    """写入路径失效测试"""
+
+    def test_update_refreshes_cache(self, test_db, create_appointment, sample_appointment_data):
+        """测试修改后缓存中是最新值"""
+        appointment = create_appointment()
+        crud.get_appointment(test_db, appointment.id)
+
+        crud.update_appointment(
+            test_db, appointment.id, AppointmentUpdate(**{**sample_appointment_data, "status": "confirmed"})
+        )
+        test_db.expunge_all()
+
+        assert crud.get_appointment(test_db, appointment.id).status == "confirmed"
+
+    def test_delete_evicts(self, test_db, create_patient):
+        """测试删除后不再从缓存返回"""
+        patient = create_patient()
+        crud.get_patient(test_db, patient.id)
+
+        assert crud.delete_patient(test_db, patient.id) is True
+        test_db.expunge_all()
+
+        assert crud.get_patient(test_db, patient.id) is None
+
+    def test_stats_reported(self, test_db, create_appointment, client):
+        """测试 /metrics 包含缓存统计"""
+        appointment = create_appointment()
+        test_db.expunge_all()
+        crud.get_appointment(test_db, appointment.id)
+        test_db.expunge_all()
+        crud.get_appointment(test_db, appointment.id)
+
+        stats = cache.caches_for(test_db)[Appointment].stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 1
+        assert "appointments" in client.get("/metrics").json()["entity_cache"]
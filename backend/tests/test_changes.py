@@ -0,0 +1,249 @@
+"""
+增量同步测试
+测试 changelog.py 的变更日志写入、合并、墓碑、清理与压缩，以及 /api/changes 接口
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import changelog
+import crud
+from database import Base, ReplicaSet, RoutingSession, get_db
+from main import app
+from models import ChangeLogEntry
+from schemas import AppointmentCreate, DoctorCreate, PatientCreate, PatientUpdate
+
+
+@pytest.fixture(autouse=True)
+def no_settle_delay(monkeypatch):
+    monkeypatch.setattr(changelog, "CHANGES_SETTLE_SECONDS", 0)
+
+
+def _patient(db, name="张三"):
+    return crud.create_patient(db, PatientCreate(name=name, age=30, gender="男", medical_condition="感冒"))
+
+
+def _rename(db, patient, name):
+    return crud.update_patient(db, patient.id, PatientUpdate(
+        name=name, age=30, gender="男", medical_condition="感冒", version=patient.version
+    ))
+
+
+def _changes(client, since, **params):
+    response = client.get("/api/changes", params={"since": since, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _ops(body):
+    return [(item["type"], item["id"], item["op"]) for item in body["changes"]]
+
+
+def _log(db):
+    return [(row.entity_type, row.entity_id, row.op) for row in db.query(ChangeLogEntry).order_by(ChangeLogEntry.id)]
+
+
+class TestRecording:
+    """crud 写入变更日志测试"""
+
+    def test_every_write_logged(self, test_db, sample_doctor_data):
+        patient = _patient(test_db)
+        _rename(test_db, patient, "张三丰")
+        doctor = crud.create_doctor(test_db, DoctorCreate(**sample_doctor_data))
+        appointment = crud.create_appointment(test_db, AppointmentCreate(
+            patient_name="张三丰", doctor_name="李医生", appointment_time=datetime.now() + timedelta(days=1)
+        ))
+        crud.delete_appointment(test_db, appointment.id)
+        crud.delete_patient(test_db, 99999)
+
+        assert _log(test_db) == [
+            ("patient", patient.id, "insert"),
+            ("patient", patient.id, "update"),
+            ("doctor", doctor.id, "insert"),
+            ("appointment", appointment.id, "insert"),
+            ("appointment", appointment.id, "delete"),
+        ]
+
+    def test_failed_write_not_logged(self, test_db):
+        """测试版本冲突的更新不写日志"""
+        patient = _patient(test_db)
+        _rename(test_db, patient, "新名字")
+
+        with pytest.raises(crud.VersionConflictError):
+            crud.update_patient(test_db, patient.id, PatientUpdate(
+                name="过期", age=30, gender="男", medical_condition="感冒", version=1
+            ))
+
+        assert [op for _, _, op in _log(test_db)] == ["insert", "update"]
+
+
+class TestChangesApi:
+    """增量同步接口测试"""
+
+    def test_initial_cursor_then_deltas(self, client, test_db):
+        _patient(test_db)
+        head = client.get("/api/changes").json()
+        assert head["changes"] == [] and head["cursor"] == 1
+
+        second = _patient(test_db, "李四")
+        body = _changes(client, head["cursor"])
+
+        assert _ops(body) == [("patient", second.id, "insert")]
+        assert body["changes"][0]["data"]["name"] == "李四"
+        assert body["has_more"] is False
+        assert _changes(client, body["cursor"])["changes"] == []
+
+    def test_updates_merged_with_current_data(self, client, test_db):
+        """测试同一页内多次修改合并为一条，数据为当前值"""
+        patient = _patient(test_db)
+        patient = _rename(test_db, patient, "张三丰")
+        _rename(test_db, patient, "张君宝")
+
+        body = _changes(client, 0)
+
+        assert _ops(body) == [("patient", patient.id, "insert")]
+        assert body["changes"][0]["data"]["name"] == "张君宝"
+        assert body["changes"][0]["version"] == 3
+
+    def test_tombstone(self, client, test_db):
+        patient = _patient(test_db)
+        cursor = _changes(client, 0)["cursor"]
+        crud.delete_patient(test_db, patient.id)
+
+        body = _changes(client, cursor)
+
+        assert _ops(body) == [("patient", patient.id, "delete")]
+        assert body["changes"][0]["data"] is None
+
+    def test_order_and_paging(self, client, test_db):
+        """测试按最后一次变更排序，分页读取不重复不遗漏"""
+        first = _patient(test_db, "甲")
+        second = _patient(test_db, "乙")
+        _rename(test_db, first, "甲二")
+        third = _patient(test_db, "丙")
+
+        page = _changes(client, 0, limit=2)
+        assert _ops(page) == [("patient", first.id, "insert"), ("patient", second.id, "insert")]
+        assert page["has_more"] is True
+
+        rest = _changes(client, page["cursor"], limit=2)
+        assert _ops(rest) == [("patient", first.id, "update"), ("patient", third.id, "insert")]
+        assert rest["has_more"] is False
+
+    def test_deleted_later_skipped_until_tombstone(self, client, test_db):
+        """测试页内的修改对应记录已在之后删除时不返回数据，墓碑在下一页"""
+        patient = _patient(test_db)
+        _rename(test_db, patient, "新名字")
+        crud.delete_patient(test_db, patient.id)
+
+        page = _changes(client, 0, limit=2)
+        assert page["changes"] == [] and page["has_more"] is True
+        assert _ops(_changes(client, page["cursor"])) == [("patient", patient.id, "delete")]
+
+    def test_unsettled_changes_held_back(self, client, test_db, monkeypatch):
+        """测试刚写入的变更在稳定时间内不返回，游标不越过它"""
+        _patient(test_db)
+        monkeypatch.setattr(changelog, "CHANGES_SETTLE_SECONDS", 60)
+
+        assert _changes(client, 0) == {"changes": [], "cursor": 0, "has_more": False}
+        assert client.get("/api/changes").json()["cursor"] == 0
+
+    def test_reads_primary_not_lagging_replica(self, client, test_db, test_engine, tmp_path):
+        """测试 GET 请求的会话开启了副本时，变更日志仍从主库读取"""
+        replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        Base.metadata.create_all(bind=replica)
+        factory = sessionmaker(class_=RoutingSession, autoflush=False, bind=test_engine,
+                               replica_set=ReplicaSet([replica], lag_probe=lambda engine: 0.0))
+
+        def replica_get_db():
+            db = factory()
+            db.use_replica = True
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = replica_get_db
+        try:
+            patient = _patient(test_db)
+            assert _ops(_changes(client, 0)) == [("patient", patient.id, "insert")]
+            assert client.get("/api/changes").json()["cursor"] == 1
+        finally:
+            replica.dispose()
+
+    def test_invalid_params(self, client):
+        assert client.get("/api/changes", params={"since": -1}).status_code == 422
+        assert client.get("/api/changes", params={"since": 0, "limit": 0}).status_code == 422
+
+
+class TestRetention:
+    """清理与压缩测试"""
+
+    def _age(self, db, days):
+        db.query(ChangeLogEntry).update({ChangeLogEntry.changed_at: datetime.now() - timedelta(days=days)})
+        db.commit()
+
+    def test_compaction_keeps_latest_per_record(self, test_db):
+        a = _patient(test_db, "甲")
+        b = _patient(test_db, "乙")
+        a = _rename(test_db, a, "甲二")
+        _rename(test_db, a, "甲三")
+        crud.delete_patient(test_db, b.id)
+
+        assert changelog.compact(test_db, batch_size=2) == 2
+
+        # 最早的一行保留，用于判断游标是否过期
+        assert _log(test_db) == [
+            ("patient", a.id, "insert"),
+            ("patient", a.id, "update"),
+            ("patient", b.id, "delete"),
+        ]
+
+    def test_compacted_feed_still_converges(self, client, test_db):
+        """测试压缩后从旧游标同步仍得到最终状态"""
+        _patient(test_db, "甲")
+        b = _patient(test_db, "乙")
+        cursor = _changes(client, 0)["cursor"]
+        b = _rename(test_db, b, "乙二")
+        _rename(test_db, b, "乙三")
+        changelog.compact(test_db)
+
+        body = _changes(client, cursor)
+
+        assert _ops(body) == [("patient", b.id, "update")]
+        assert body["changes"][0]["data"]["name"] == "乙三"
+
+    def test_purge_keeps_newest_and_expires_old_cursors(self, client, test_db):
+        for name in ("甲", "乙", "丙"):
+            _patient(test_db, name)
+        self._age(test_db, 60)
+        latest = _patient(test_db, "丁")
+
+        assert changelog.purge_expired(test_db, datetime.now() - timedelta(days=30), batch_size=2) == 3
+        assert [entity_id for _, entity_id, _ in _log(test_db)] == [latest.id]
+
+        response = client.get("/api/changes", params={"since": 1})
+        assert response.status_code == 410
+        assert _ops(_changes(client, 3)) == [("patient", latest.id, "insert")]
+
+    def test_purge_never_empties_log(self, client, test_db):
+        """测试全部过期时仍保留最新一行，旧游标能被识别为过期"""
+        _patient(test_db, "甲")
+        _patient(test_db, "乙")
+        self._age(test_db, 60)
+
+        changelog.purge_expired(test_db, datetime.now() - timedelta(days=30))
+
+        assert len(_log(test_db)) == 1
+        assert client.get("/api/changes", params={"since": 0}).status_code == 410
+        assert _changes(client, 2)["changes"] == []
+
+    def test_cleanup(self, test_db):
+        _patient(test_db)
+        self._age(test_db, 60)
+        _patient(test_db)
+
+        assert changelog.cleanup(lambda: test_db) == (1, 0)
+        assert changelog.get_stats()["runs"] >= 1
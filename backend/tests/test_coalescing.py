@@ -0,0 +1,177 @@
+"""
+请求合并测试
+测试 coalescing.py 对相同并发 GET 请求的合并
+"""
+import asyncio
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import coalescing
+from coalescing import RequestCoalescingMiddleware, normalize_query
+from database import get_db
+from main import app as main_app
+from models import Doctor
+
+
+def _app(fail_first=False):
+    """记录实际计算次数的测试应用，gate 打开前请求一直挂起"""
+    state = {"calls": 0}
+    gate = asyncio.Event()
+
+    async def dashboard(request):
+        state["calls"] += 1
+        await gate.wait()
+        if fail_first and state["calls"] == 1:
+            raise RuntimeError("数据库错误")
+        return JSONResponse({"calls": state["calls"], "query": str(request.query_params)})
+
+    app = Starlette(routes=[
+        Route("/api/dashboard/", dashboard),
+        Route("/api/patients/", dashboard),
+    ])
+    return RequestCoalescingMiddleware(app, paths=["/api/dashboard"]), state, gate
+
+
+async def _concurrent(app, gate, urls, headers=None):
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        requests = [asyncio.ensure_future(client.get(url, headers=headers)) for url in urls]
+        await asyncio.sleep(0.05)
+        gate.set()
+        return await asyncio.gather(*requests)
+
+
+class TestNormalizeQuery:
+    """查询参数规范化测试"""
+
+    def test_order_independent(self):
+        """测试参数顺序不影响合并键"""
+        assert normalize_query(b"b=2&a=1") == normalize_query(b"a=1&b=2")
+        assert normalize_query(b"a=1") != normalize_query(b"a=2")
+
+
+class TestCoalescing:
+    """合并行为测试"""
+
+    def test_identical_requests_share_one_computation(self):
+        """测试相同的并发请求只计算一次"""
+        app, state, gate = _app()
+        before = coalescing.get_stats()["coalesced"]
+
+        responses = asyncio.run(_concurrent(app, gate, ["/api/dashboard/?a=1&b=2"] * 4 + ["/api/dashboard/?b=2&a=1"]))
+
+        assert state["calls"] == 1
+        assert all(r.status_code == 200 and r.json()["calls"] == 1 for r in responses)
+        assert coalescing.get_stats()["coalesced"] - before == 4
+        assert app.in_flight == 0
+
+    def test_different_queries_not_coalesced(self):
+        """测试查询参数不同的请求分别计算"""
+        app, state, gate = _app()
+
+        asyncio.run(_concurrent(app, gate, ["/api/dashboard/?page=1", "/api/dashboard/?page=2"]))
+
+        assert state["calls"] == 2
+
+    def test_paths_outside_allowlist_not_coalesced(self):
+        """测试白名单以外的路径不合并"""
+        app, state, gate = _app()
+
+        asyncio.run(_concurrent(app, gate, ["/api/patients/"] * 3))
+
+        assert state["calls"] == 3
+
+    def test_leader_failure_followers_retry(self):
+        """测试 leader 出错时等待的请求各自重新处理"""
+        app, state, gate = _app(fail_first=True)
+
+        responses = asyncio.run(_concurrent(app, gate, ["/api/dashboard/"] * 3))
+
+        assert sorted(r.status_code for r in responses) == [200, 200, 500]
+        assert state["calls"] == 3
+
+    def test_cancelled_leader_releases_followers(self):
+        """测试 leader 被取消（客户端断开）时，等待的请求不会永远挂起，而是各自重新处理"""
+        app, state, gate = _app()
+        scope = {
+            "type": "http", "method": "GET", "path": "/api/dashboard/", "raw_path": b"/api/dashboard/",
+            "root_path": "", "scheme": "http", "query_string": b"", "headers": [],
+            "server": ("test", 80), "client": ("test", 1), "http_version": "1.1",
+        }
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def run():
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            leader = asyncio.ensure_future(app(dict(scope), receive, send))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(app(dict(scope), receive, send))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            await asyncio.sleep(0.01)
+            gate.set()
+            await asyncio.wait_for(follower, timeout=2)
+            return sent
+
+        sent = asyncio.run(run())
+
+        assert state["calls"] == 2
+        assert [m["status"] for m in sent if m["type"] == "http.response.start"] == [200]
+        assert app.in_flight == 0
+
+    def test_sequential_requests_recompute(self):
+        """测试先后到达（不重叠）的请求各自计算"""
+        app, state, gate = _app()
+        gate.set()
+
+        async def sequential():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+                await client.get("/api/dashboard/")
+                await client.get("/api/dashboard/")
+
+        asyncio.run(sequential())
+        assert state["calls"] == 2
+
+    def test_full_stack_gzip_and_cors(self, client, test_db):
+        """测试经过完整中间件栈（压缩、CORS）时，等待的请求得到未被 leader 的响应头污染的响应"""
+        for i in range(20):
+            test_db.add(Doctor(name=f"医生{i}", specialty="内科", experience="10年", phone=f"1380000{i:04d}"))
+        test_db.commit()
+
+        async def slow_get_db():
+            # 让 leader 停留在路由内，其余请求到达时能合并
+            await asyncio.sleep(0.05)
+            yield test_db
+
+        main_app.dependency_overrides[get_db] = slow_get_db
+        before = coalescing.get_stats()["coalesced"]
+        headers = {"Accept-Encoding": "gzip", "Origin": "http://localhost:3000"}
+
+        async def concurrent():
+            transport = httpx.ASGITransport(app=main_app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return await asyncio.gather(*[http.get("/api/doctors/", headers=headers) for _ in range(6)])
+
+        responses = asyncio.run(concurrent())
+
+        assert coalescing.get_stats()["coalesced"] > before
+        for response in responses:
+            assert response.status_code == 200
+            assert response.headers["content-encoding"] == "gzip"
+            assert len(response.json()["doctors"]) == 20
+            assert response.headers.get_list("access-control-allow-origin") == ["http://localhost:3000"]
+
+    def test_metrics(self, client):
+        """测试 /metrics 包含合并统计"""
+        data = client.get("/metrics").json()["coalescing"]
+
+        assert "/api/dashboard" in data["paths"]
+        assert "coalesced" in data
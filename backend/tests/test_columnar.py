@@ -0,0 +1,138 @@
+"""
+列式响应格式测试
+测试 columnar.py 的编码以及列表接口的 format=columns / MessagePack 协商
+"""
+import json
+import pytest
+
+import columnar
+from schemas import Doctor, Patient
+
+
+class TestColumnEncoding:
+    """列式编码测试"""
+
+    def test_to_columns(self):
+        """测试字段名只出现一次，枚举字典编码"""
+        rows = [
+            {"id": 1, "name": "张三", "gender": "男"},
+            {"id": 2, "name": "李四", "gender": "女"},
+            {"id": 3, "name": "王五", "gender": "男"},
+        ]
+
+        table = columnar.to_columns(rows, ["id", "name", "gender"], ["gender"])
+
+        assert table["count"] == 3
+        assert table["fields"] == ["id", "name", "gender"]
+        assert table["columns"] == [[1, 2, 3], ["张三", "李四", "王五"], [0, 1, 0]]
+        assert table["dictionaries"] == {"gender": ["男", "女"]}
+
+    def test_round_trip(self):
+        """测试解码后与原数据一致"""
+        rows = [{"id": i, "status": ["pending", "confirmed"][i % 2]} for i in range(5)]
+
+        table = columnar.to_columns(rows, ["id", "status"], ["status"])
+
+        assert columnar.from_columns(table) == rows
+
+    def test_empty_list(self):
+        """测试空列表"""
+        table = columnar.to_columns([], ["id"], [])
+
+        assert table["count"] == 0
+        assert table["columns"] == [[]]
+
+    def test_enum_fields_from_schema(self):
+        """测试从 Pydantic 模型识别枚举字段"""
+        assert columnar.enum_fields(Patient) == ["gender"]
+        assert columnar.enum_fields(Doctor) == ["specialty", "status"]
+
+
+class TestColumnsFormatAPI:
+    """列表接口 format=columns 测试"""
+
+    def test_patients_columns(self, client, multiple_patients):
+        """测试患者列表列式格式"""
+        response = client.get("/api/patients/?format=columns&limit=100")
+
+        assert response.status_code == 200
+        data = response.json()
+        table = data["patients"]
+        assert table["format"] == "columns"
+        assert table["count"] == 5
+        assert set(table["dictionaries"]["gender"]) == {"男", "女"}
+        assert data["pagination"]["total"] == 5
+
+        decoded = columnar.from_columns(table)
+        plain = client.get("/api/patients/?limit=100").json()["patients"]
+        assert decoded == plain
+
+    def test_doctors_columns(self, client, multiple_doctors):
+        """测试医生列表列式格式，summary 不变"""
+        data = client.get("/api/doctors/?format=columns").json()
+
+        assert data["doctors"]["count"] == 6
+        assert "specialty" in data["doctors"]["dictionaries"]
+        assert data["summary"]["total"] == 6
+
+    def test_appointments_columns_smaller(self, client, create_appointment):
+        """测试预约列表列式格式体积更小"""
+        for i in range(50):
+            create_appointment(patient_name=f"患者{i}", status=["pending", "confirmed", "cancelled"][i % 3])
+
+        plain = client.get("/api/appointments/")
+        columns = client.get("/api/appointments/?format=columns")
+
+        assert columns.json()["appointments"]["dictionaries"]["status"] == ["pending", "confirmed", "cancelled"]
+        assert len(columns.content) < len(plain.content) / 2
+
+    def test_unknown_format_rejected(self, client):
+        """测试不支持的 format 返回422"""
+        assert client.get("/api/patients/?format=rows").status_code == 422
+
+
+class TestMessagePack:
+    """MessagePack 内容协商测试"""
+
+    def test_msgpack_response(self, client, multiple_patients):
+        """测试 Accept: application/msgpack 返回 MessagePack"""
+        msgpack = pytest.importorskip("msgpack")
+
+        response = client.get("/api/patients/?format=columns", headers={"Accept": "application/msgpack"})
+
+        assert response.headers["content-type"] == "application/msgpack"
+        data = msgpack.unpackb(response.content, raw=False)
+        assert data["patients"]["count"] == 5
+
+    def test_falls_back_to_json_without_msgpack(self, client, multiple_patients, monkeypatch):
+        """测试未安装 msgpack 时返回 JSON"""
+        monkeypatch.setattr(columnar, "msgpack", None)
+
+        response = client.get("/api/patients/", headers={"Accept": "application/msgpack"})
+
+        assert response.headers["content-type"].startswith("application/json")
+        assert len(json.loads(response.content)["patients"]) == 5
+
+    @pytest.mark.parametrize("accept, expected", [
+        ("application/msgpack", True),
+        ("application/x-msgpack;q=0.9, application/json;q=0.5", True),
+        ("application/msgpack;q=0", False),
+        ("application/json, application/msgpack;q=0.5", False),
+        ("*/*", False),
+        ("application/msgpack;q=0.8, application/*;q=0.5", True),
+        ("", False),
+    ])
+    def test_accept_q_values(self, monkeypatch, accept, expected):
+        """测试按媒体范围和 q 值协商，q=0 表示拒绝"""
+        from starlette.requests import Request
+
+        monkeypatch.setattr(columnar, "msgpack", object())
+        request = Request({"type": "http", "method": "GET", "headers": [(b"accept", accept.encode())]})
+        assert columnar.accepts_msgpack(request) is expected
+
+    def test_vary_accept(self, client, multiple_patients):
+        """测试列表响应带 Vary: Accept"""
+        for headers in ({}, {"Accept": "application/msgpack;q=0"}):
+            response = client.get("/api/patients/", headers=headers)
+            assert response.headers["content-type"].startswith("application/json")
+            assert "accept" in response.headers["vary"].lower()
@@ -0,0 +1,159 @@
+"""
+响应压缩中间件测试
+测试 compression.py 的编码协商、大小阈值和流式压缩
+"""
+import gzip
+import zlib
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from compression import CompressionMiddleware, parse_accept_encoding, select_encoding
+
+
+def build_app(**kwargs):
+    """构造只包含压缩中间件的测试应用"""
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, **kwargs)
+
+    @app.get("/small")
+    async def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/large")
+    async def large():
+        return PlainTextResponse("内科" * 1000)
+
+    @app.get("/stream")
+    async def stream():
+        def rows():
+            for i in range(50):
+                yield f"{i},张三,李医生,confirmed\n".encode("utf-8")
+        return StreamingResponse(rows(), media_type="text/csv")
+
+    @app.get("/image")
+    async def image():
+        return PlainTextResponse("x" * 2000, media_type="image/png")
+
+    return app
+
+
+class TestEncodingNegotiation:
+    """编码协商测试"""
+
+    def test_parse_accept_encoding_with_q_values(self):
+        """测试解析q值"""
+        parsed = parse_accept_encoding("gzip;q=0.5, br, zstd;q=0")
+        assert parsed == {"gzip": 0.5, "br": 1.0, "zstd": 0.0}
+
+    def test_select_prefers_server_order_on_tie(self):
+        """测试q值相同时使用服务端偏好"""
+        assert select_encoding("gzip, br", ["br", "gzip"]) == "br"
+
+    def test_select_respects_client_q_values(self):
+        """测试客户端q值优先"""
+        assert select_encoding("gzip, br;q=0.5", ["br", "gzip"]) == "gzip"
+
+    def test_select_excludes_q_zero(self):
+        """测试q=0表示拒绝"""
+        assert select_encoding("gzip;q=0", ["gzip"]) is None
+
+    def test_select_wildcard(self):
+        """测试通配符"""
+        assert select_encoding("*", ["gzip"]) == "gzip"
+
+    def test_select_unavailable_encoding(self):
+        """测试服务端不支持的编码"""
+        assert select_encoding("br", ["gzip"]) is None
+
+
+class TestCompressionMiddleware:
+    """压缩中间件测试"""
+
+    def test_small_response_not_compressed(self):
+        """测试小于阈值的响应不压缩"""
+        client = TestClient(build_app(minimum_size=500, encodings=["gzip"]))
+        response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert response.text == "ok"
+
+    def test_large_response_gzip(self):
+        """测试大响应使用gzip压缩"""
+        client = TestClient(build_app(minimum_size=500, encodings=["gzip"]))
+        response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["vary"]
+        assert int(response.headers["content-length"]) < len(("内科" * 1000).encode("utf-8"))
+        assert response.text == "内科" * 1000
+
+    def test_no_accept_encoding(self):
+        """测试客户端不接受压缩"""
+        client = TestClient(build_app(encodings=["gzip"]))
+        response = client.get("/large", headers={"Accept-Encoding": "identity"})
+
+        assert "content-encoding" not in response.headers
+        assert response.text == "内科" * 1000
+
+    def test_incompressible_content_type_skipped(self):
+        """测试已压缩的内容类型不再压缩"""
+        client = TestClient(build_app(minimum_size=10, encodings=["gzip"]))
+        response = client.get("/image", headers={"Accept-Encoding": "gzip"})
+
+        assert "content-encoding" not in response.headers
+
+    def test_streaming_response_compressed_per_chunk(self):
+        """测试流式响应逐块压缩"""
+        client = TestClient(build_app(minimum_size=10_000, encodings=["gzip"]))
+        with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+            assert response.headers["content-encoding"] == "gzip"
+            assert "content-length" not in response.headers
+            raw = b"".join(response.iter_raw())
+
+        text = gzip.decompress(raw).decode("utf-8")
+        assert text.count("\n") == 50
+        assert text.startswith("0,张三,李医生,confirmed")
+
+    def test_compression_level_configurable(self):
+        """测试压缩级别可配置"""
+        fast = TestClient(build_app(minimum_size=0, gzip_level=1, encodings=["gzip"]))
+        response = fast.get("/large", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+
+    def test_brotli_when_available(self):
+        """测试brotli压缩（需要安装brotli）"""
+        brotli = pytest.importorskip("brotli")
+        client = TestClient(build_app(minimum_size=0, encodings=["br", "gzip"]))
+        with client.stream("GET", "/large", headers={"Accept-Encoding": "br, gzip"}) as response:
+            assert response.headers["content-encoding"] == "br"
+            raw = b"".join(response.iter_raw())
+        assert brotli.decompress(raw).decode("utf-8") == "内科" * 1000
+
+    def test_zstd_when_available(self):
+        """测试zstd压缩（需要安装zstandard）"""
+        zstandard = pytest.importorskip("zstandard")
+        client = TestClient(build_app(minimum_size=0, encodings=["zstd", "gzip"]))
+        with client.stream("GET", "/stream", headers={"Accept-Encoding": "zstd"}) as response:
+            assert response.headers["content-encoding"] == "zstd"
+            raw = b"".join(response.iter_raw())
+        text = zstandard.ZstdDecompressor().decompressobj().decompress(raw).decode("utf-8")
+        assert text.count("\n") == 50
+
+
+class TestCompressionOnApi:
+    """API响应压缩集成测试"""
+
+    def test_patient_list_compressed(self, client, create_patient):
+        """测试患者列表响应被压缩"""
+        for i in range(20):
+            create_patient(name=f"患者{i}", medical_condition="高血压，需要定期复查观察")
+
+        response = client.get("/api/patients/?limit=20", headers={"Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.json()["patients"]) == 20
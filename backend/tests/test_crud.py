@@ -5,6 +5,7 @@ CRUD 操作测试
 import pytest
 from datetime import datetime, timedelta
 from crud import (
+    VersionConflictError,
     # 患者 CRUD
     get_patient, get_patients, create_patient, update_patient, delete_patient,
     # 医生 CRUD
@@ -19,6 +20,7 @@ from schemas import (
     DoctorCreate, DoctorUpdate,
     AppointmentCreate, AppointmentUpdate
 )
+from query_plan import capture_statements
 
 
 class TestPatientCRUD:
@@ -211,6 +213,42 @@ class TestDoctorCRUD:
         for specialty in ["内科", "外科", "儿科", "妇产科", "眼科", "口腔科"]:
             assert summary['specialty_count'].get(specialty) == 1
 
+    def test_get_doctors_summary_covers_all_pages(self, test_db, multiple_doctors):
+        """测试分页时统计仍针对全部筛选结果"""
+        doctors, summary = get_doctors(test_db, limit=2)
+
+        assert len(doctors) == 2
+        assert summary['total'] == 6
+        assert sum(summary['status_count'].values()) == 6
+
+    def test_get_doctors_offset_pagination(self, test_db, multiple_doctors):
+        """测试按偏移分页"""
+        first_page, _ = get_doctors(test_db, skip=0, limit=4)
+        second_page, _ = get_doctors(test_db, skip=4, limit=4)
+
+        ids = [d.id for d in first_page] + [d.id for d in second_page]
+        assert len(second_page) == 2
+        assert ids == sorted(ids)
+        assert len(set(ids)) == 6
+
+    def test_get_doctors_cursor_pagination(self, test_db, multiple_doctors):
+        """测试键集分页"""
+        first_page, _ = get_doctors(test_db, limit=3)
+        second_page, _ = get_doctors(test_db, limit=3, cursor=first_page[-1].id)
+
+        assert all(d.id > first_page[-1].id for d in second_page)
+        assert len(second_page) == 3
+
+    def test_get_doctors_summary_with_filter(self, test_db, multiple_doctors):
+        """测试筛选后的分组统计"""
+        doctors, summary = get_doctors(test_db, specialty="surgery")
+
+        assert summary == {
+            "total": 1,
+            "specialty_count": {"外科": 1},
+            "status_count": {"在职": 1}
+        }
+
     def test_update_doctor(self, test_db, create_doctor):
         """测试更新医生"""
         doctor = create_doctor(name="原始姓名", status="在职")
@@ -535,3 +573,103 @@ class TestCRUDEdgeCases:
         patients, total = get_patients(test_db, skip=0, limit=1000)
         assert len(patients) == 5
         assert total == 5
+
+
+class TestSingleStatementWrites:
+    """单语句更新/删除测试（另加同一事务中的一条变更日志 INSERT）"""
+
+    def _statements(self, test_db, fn, *args):
+        with capture_statements(test_db.get_bind()) as statements:
+            result = fn(test_db, *args)
+        return result, [sql for sql, _ in statements]
+
+    def test_update_is_one_statement(self, test_db, create_patient):
+        """测试更新只发出一条 UPDATE ... RETURNING 和一条变更日志"""
+        patient = create_patient()
+
+        updated, statements = self._statements(
+            test_db, update_patient, patient.id, PatientUpdate(
+                name="新名字", age=40, gender="男", medical_condition="复查"
+            )
+        )
+
+        assert len(statements) == 2
+        assert statements[0].startswith("UPDATE patients")
+        assert "RETURNING" in statements[0]
+        assert statements[1].startswith("INSERT INTO change_log")
+        assert updated.name == "新名字"
+        assert updated.updated_at is not None
+
+    def test_update_result_needs_no_reload(self, test_db, create_doctor, sample_doctor_data):
+        """测试返回的对象提交后读取属性不再查询数据库"""
+        doctor = create_doctor()
+        updated = update_doctor(test_db, doctor.id, DoctorUpdate(**{**sample_doctor_data, "status": "休息中"}))
+
+        with capture_statements(test_db.get_bind()) as statements:
+            assert updated.status == "休息中"
+            assert doctor.status == "休息中"
+
+        assert statements == []
+
+    def test_delete_is_one_statement(self, test_db, create_appointment):
+        """测试删除只发出一条 DELETE ... RETURNING 和一条变更日志（墓碑）"""
+        appointment = create_appointment()
+        test_db.expunge_all()
+
+        deleted, statements = self._statements(test_db, delete_appointment, appointment.id)
+
+        assert deleted is True
+        assert len(statements) == 2
+        assert statements[0].startswith("DELETE FROM appointments")
+        assert "RETURNING" in statements[0]
+        assert statements[1].startswith("INSERT INTO change_log")
+
+    def test_fallback_without_returning(self, test_db, create_patient, monkeypatch):
+        """测试不支持 RETURNING 的数据库（MySQL）使用 UPDATE + SELECT"""
+        dialect = test_db.get_bind().dialect
+        monkeypatch.setattr(dialect, "update_returning", False)
+        monkeypatch.setattr(dialect, "delete_returning", False)
+        patient = create_patient()
+
+        updated, statements = self._statements(
+            test_db, update_patient, patient.id, PatientUpdate(
+                name="回退更新", age=41, gender="女", medical_condition="观察"
+            )
+        )
+        assert [sql.split()[0] for sql in statements] == ["UPDATE", "SELECT", "INSERT"]
+        assert updated.name == "回退更新"
+
+        assert update_patient(test_db, 999, PatientUpdate(
+            name="不存在", age=1, gender="男", medical_condition="无"
+        )) is None
+        assert delete_patient(test_db, patient.id) is True
+        assert delete_patient(test_db, patient.id) is False
+
+
+class TestConditionalUpdate:
+    """版本号条件更新测试"""
+
+    def test_version_conflict_raises(self, test_db, create_patient, sample_patient_data):
+        """测试版本号不一致时抛出 VersionConflictError 且不修改数据"""
+        patient = create_patient(name="原名")
+        update_patient(test_db, patient.id, PatientUpdate(**sample_patient_data))
+
+        with pytest.raises(VersionConflictError) as exc_info:
+            update_patient(test_db, patient.id, PatientUpdate(**{**sample_patient_data, "name": "过期修改"}),
+                           expected_version=1)
+
+        assert exc_info.value.current_version == 2
+        patient_id = patient.id
+        test_db.expunge_all()
+        assert get_patient(test_db, patient_id).name == sample_patient_data["name"]
+
+    def test_conditional_update_is_one_statement(self, test_db, create_doctor, sample_doctor_data):
+        """测试版本号匹配时条件更新仍只有一条 UPDATE（加一条变更日志）"""
+        doctor = create_doctor()
+
+        with capture_statements(test_db.get_bind()) as statements:
+            updated = update_doctor(test_db, doctor.id, DoctorUpdate(**sample_doctor_data), expected_version=1)
+
+        assert updated.version == 2
+        assert len(statements) == 2
+        assert "version" in statements[0][0]
@@ -0,0 +1,208 @@
+"""
+读写分离测试
+使用两个 SQLite 文件分别模拟主库和只读副本
+"""
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+
+import database
+from database import Base, ReplicaSet, RoutingSession, get_db, pool_stats
+from models import Patient
+from schemas import PatientCreate
+import crud
+
+
+def make_request(method):
+    """构造只包含请求方法的 Request 对象"""
+    return Request({"type": "http", "method": method, "headers": []})
+
+
+@pytest.fixture
+def primary_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def replica_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+def seed(engine, name):
+    """直接向某个库写入一名患者，用于区分读到的是哪个库"""
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add(Patient(name=name, age=30, gender="男", medical_condition="测试"))
+        db.commit()
+
+
+@pytest.fixture
+def routing_factory(primary_engine, replica_engine):
+    seed(primary_engine, "主库患者")
+    seed(replica_engine, "副本患者")
+    replica_set = ReplicaSet([replica_engine], lag_probe=lambda engine: 0.0)
+    return sessionmaker(
+        class_=RoutingSession, autoflush=False, bind=primary_engine, replica_set=replica_set
+    ), replica_set
+
+
+class TestRoutingSession:
+    """读写分离会话测试"""
+
+    def test_reads_use_primary_by_default(self, routing_factory):
+        """测试未开启副本时读主库"""
+        factory, _ = routing_factory
+        with factory() as db:
+            assert db.query(Patient).first().name == "主库患者"
+
+    def test_reads_use_replica_when_enabled(self, routing_factory):
+        """测试只读会话读副本"""
+        factory, replica_set = routing_factory
+        with factory() as db:
+            db.use_replica = True
+            assert db.query(Patient).first().name == "副本患者"
+        assert replica_set.reads == [1]
+
+    def test_read_after_write_stays_on_primary(self, routing_factory):
+        """测试写入后的读留在主库"""
+        factory, _ = routing_factory
+        with factory() as db:
+            db.use_replica = True
+            created = crud.create_patient(db, PatientCreate(
+                name="新患者", age=20, gender="女", medical_condition="感冒"
+            ))
+            names = {patient.name for patient in db.query(Patient).all()}
+
+        assert created.id is not None
+        assert names == {"主库患者", "新患者"}
+
+    def test_lagging_replica_falls_back_to_primary(self, primary_engine, replica_engine):
+        """测试副本延迟过大时回退主库"""
+        seed(primary_engine, "主库患者")
+        seed(replica_engine, "副本患者")
+        replica_set = ReplicaSet([replica_engine], max_lag=5, lag_probe=lambda engine: 30.0)
+        factory = sessionmaker(class_=RoutingSession, bind=primary_engine, replica_set=replica_set)
+
+        with factory() as db:
+            db.use_replica = True
+            assert db.query(Patient).first().name == "主库患者"
+        assert replica_set.fallbacks == 1
+
+    def test_failed_probe_marks_replica_unhealthy(self, replica_engine):
+        """测试延迟检测失败的副本不可用"""
+        def broken_probe(engine):
+            raise RuntimeError("replication stopped")
+
+        replica_set = ReplicaSet([replica_engine], lag_probe=broken_probe)
+        assert replica_set.choose() is None
+
+    def test_lag_probe_is_cached(self, replica_engine):
+        """测试延迟检测结果按间隔缓存"""
+        calls = []
+
+        def probe(engine):
+            calls.append(engine)
+            return 0.0
+
+        replica_set = ReplicaSet([replica_engine], check_interval=60, lag_probe=probe)
+        for _ in range(5):
+            replica_set.choose()
+        assert len(calls) == 1
+
+    def test_slow_probe_does_not_block_choose(self, tmp_path):
+        """测试一个副本延迟检测卡住时，其他线程仍能立即选择副本"""
+        engines = [create_engine(f"sqlite:///{tmp_path / f'r{i}.db'}") for i in range(2)]
+        started, release = threading.Event(), threading.Event()
+
+        def probe(engine):
+            if engine is engines[0]:
+                started.set()
+                release.wait(5)
+            return 0.0
+
+        replica_set = ReplicaSet(engines, lag_probe=probe)
+        blocked = threading.Thread(target=replica_set.choose)
+        blocked.start()
+        try:
+            assert started.wait(5)
+            begin = time.monotonic()
+            # 副本0正在检测（尚无结果，视为不可用），选到副本1
+            assert replica_set.choose() is engines[1]
+            assert time.monotonic() - begin < 1
+        finally:
+            release.set()
+            blocked.join()
+
+    def test_round_robin_between_replicas(self, tmp_path):
+        """测试多个副本轮询"""
+        engines = [create_engine(f"sqlite:///{tmp_path / f'r{i}.db'}") for i in range(2)]
+        replica_set = ReplicaSet(engines, lag_probe=lambda engine: 0.0)
+
+        chosen = [replica_set.choose() for _ in range(4)]
+
+        assert chosen == [engines[0], engines[1], engines[0], engines[1]]
+        assert replica_set.reads == [2, 2]
+
+
+class TestGetDb:
+    """get_db 依赖测试"""
+
+    def test_get_request_uses_replica(self, monkeypatch, routing_factory):
+        """测试GET请求的会话读副本"""
+        factory, _ = routing_factory
+        monkeypatch.setattr(database, "SessionLocal", factory)
+
+        generator = get_db(make_request("GET"))
+        db = next(generator)
+        assert db.use_replica is True
+        assert db.query(Patient).first().name == "副本患者"
+        generator.close()
+
+    def test_post_request_uses_primary(self, monkeypatch, routing_factory):
+        """测试POST请求的会话只用主库"""
+        factory, _ = routing_factory
+        monkeypatch.setattr(database, "SessionLocal", factory)
+
+        generator = get_db(make_request("POST"))
+        db = next(generator)
+        assert db.use_replica is False
+        assert db.query(Patient).first().name == "主库患者"
+        generator.close()
+
+
+class TestPoolStats:
+    """连接池统计测试"""
+
+    def test_pool_stats_fields(self, primary_engine):
+        """测试连接池统计字段"""
+        stats = pool_stats(primary_engine)
+
+        assert stats["pool_class"] == "QueuePool"
+        assert {"size", "checkedin", "checkedout", "overflow"} <= set(stats)
+
+    def test_replica_stats(self, replica_engine):
+        """测试副本统计"""
+        replica_set = ReplicaSet([replica_engine], lag_probe=lambda engine: 1.5)
+        replica_set.choose()
+
+        stats = replica_set.stats()
+        assert stats[0]["name"] == "replica_0"
+        assert stats[0]["lag_seconds"] == 1.5
+        assert stats[0]["reads"] == 1
+
+    def test_metrics_endpoint(self, client):
+        """测试 /metrics 返回数据库统计"""
+        response = client.get("/metrics")
+
+        assert response.status_code == 200
+        assert "primary" in response.json()["database"]
@@ -0,0 +1,235 @@
+"""
+患者查重测试
+测试 dedupe.py 的分块键、打分、逐块比较、增量查重，以及 /api/patients/duplicates 接口
+"""
+import json
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import dedupe
+from database import Base, ReplicaSet, RoutingSession, get_db
+from main import app
+from models import PatientBlockKey
+from query_plan import capture_statements
+
+
+def _record(id=1, name="张三", age=30, gender="男", phone=None):
+    return dedupe.PatientRecord(id, name, age, gender, phone)
+
+
+def _pairs(suggestions):
+    return sorted((item["patient_id"], item["duplicate_id"]) for item in suggestions)
+
+
+class TestBlockKeys:
+    """分块键测试"""
+
+    @pytest.mark.parametrize("phone", ["13800000001", "138-0000-0001", "+86 138 0000 0001", "0086 13800000001"])
+    def test_phone_normalized(self, phone):
+        assert dedupe.normalize_phone(phone) == "13800000001"
+
+    def test_short_phone_ignored(self):
+        assert dedupe.normalize_phone("12-34") == ""
+        assert not any(key.startswith("phone:") for key in _record(phone="110").block_keys())
+
+    def test_latin_name_spacing_and_case(self):
+        """测试拼音姓名的大小写、空格不影响分块"""
+        keys = set(_record(name="Zhang San").block_keys())
+        assert "name:zhangsan" in keys
+        assert "initials:zs:3" in keys
+        assert "name:zhangsan" in _record(name="ZHANGSAN").block_keys()
+
+    def test_homophone_typo_shares_initials_block(self):
+        """测试名字中的同音错字与原名至少共享一个分块键"""
+        a = set(_record(name="张三", age=30).block_keys())
+        b = set(_record(name="张山", age=32).block_keys())
+        assert a & b
+
+    def test_age_bucket(self):
+        young = set(_record(name="Li Si", age=25).block_keys())
+        old = set(_record(name="Li Si", age=65).block_keys())
+        assert [key for key in young if key.startswith("initials:")] != \
+            [key for key in old if key.startswith("initials:")]
+
+
+class TestScore:
+    """打分测试"""
+
+    def test_same_person(self):
+        value, reasons = dedupe.score(_record(phone="13800000001"), _record(id=2, phone="+86 13800000001", age=31))
+        assert value >= 0.9
+        assert "电话相同" in reasons and "姓名相同" in reasons
+
+    def test_different_people_same_surname(self):
+        value, _ = dedupe.score(_record(name="张三", age=30), _record(id=2, name="张伟国", age=62))
+        assert value < dedupe.DEFAULT_MIN_SCORE
+
+    def test_gender_mismatch_halves_score(self):
+        same, _ = dedupe.score(_record(), _record(id=2))
+        other, reasons = dedupe.score(_record(), _record(id=2, gender="女"))
+        assert other < same / 2 + 0.01
+        assert "性别不同" in reasons
+
+
+class TestFindDuplicates:
+    """逐块比较测试"""
+
+    def test_finds_variants_and_reports_each_pair_once(self, test_db, create_patient):
+        """测试电话格式和姓名写法不同的重复登记被找到，同一对只产出一次"""
+        original = create_patient(name="张三", age=30, phone="13800000001")
+        variant = create_patient(name="张 三", age=31, phone="138-0000-0001")
+        create_patient(name="李四", age=45, gender="女", phone="13900000002")
+
+        suggestions = list(dedupe.find_duplicates(test_db))
+
+        assert _pairs(suggestions) == [(original.id, variant.id)]
+        assert suggestions[0]["score"] >= 0.9
+
+    def test_only_compares_within_blocks(self, test_db, create_patient):
+        """测试没有共同分块键的患者不比较"""
+        for i in range(20):
+            create_patient(name=f"患者{chr(0x4e00 + i * 37)}{chr(0x4e00 + i * 53)}", age=20 + i * 3,
+                           phone=f"1380000{i:04d}")
+
+        list(dedupe.find_duplicates(test_db))
+
+        assert dedupe._stats["comparisons"] < 20 * 19 // 2
+
+    def test_oversized_block_skipped(self, test_db, create_patient, monkeypatch):
+        monkeypatch.setattr(dedupe, "DEDUPE_MAX_BLOCK", 3)
+        for _ in range(5):
+            create_patient(name="王五", age=40, phone="13700000000")
+
+        before = dedupe._stats["oversized_blocks"]
+        assert list(dedupe.find_duplicates(test_db)) == []
+        assert dedupe._stats["oversized_blocks"] > before
+
+    def test_pair_compared_in_other_block_when_preferred_oversized(self, test_db, create_patient, monkeypatch):
+        """测试共有的首字母分块超限时，患者对仍在电话、姓名分块中比较"""
+        monkeypatch.setattr(dedupe, "DEDUPE_MAX_BLOCK", 3)
+        first = create_patient(name="zhang san", age=30, phone="13800000001")
+        second = create_patient(name="zhang san", age=31, phone="13800000001")
+        for name in ("zhao si", "zhou shu", "zeng sen"):
+            create_patient(name=name, age=35)
+
+        suggestions = list(dedupe.find_duplicates(test_db))
+
+        assert _pairs(suggestions) == [(first.id, second.id)]
+        assert suggestions[0]["block_key"] == "phone:13800000001"
+
+    def test_blocks_span_batches(self, test_db, create_patient, monkeypatch):
+        """测试分块跨越读取批次时不被拆开"""
+        monkeypatch.setattr(dedupe, "DEDUPE_BATCH_SIZE", 2)
+        ids = [create_patient(name="赵六", age=50, phone="13600000000").id for _ in range(3)]
+
+        assert _pairs(dedupe.find_duplicates(test_db)) == [(ids[0], ids[1]), (ids[0], ids[2]), (ids[1], ids[2])]
+
+    def test_incremental_only_compares_new_patients(self, test_db, create_patient):
+        """测试增量查重只比较包含新患者的患者对，只读取新患者的分块键"""
+        old_a = create_patient(name="张三", age=30, phone="13800000001")
+        create_patient(name="张三", age=30, phone="13800000001")
+        since_id = dedupe.last_patient_id(test_db)
+        list(dedupe.find_duplicates(test_db))
+
+        new = create_patient(name="张三", age=31, phone="13800000001")
+        with capture_statements(test_db.get_bind()) as statements:
+            suggestions = list(dedupe.find_duplicates(test_db, since_id=since_id))
+
+        assert {item["duplicate_id"] for item in suggestions} == {new.id}
+        assert (old_a.id, new.id) in _pairs(suggestions)
+        full_scans = [sql for sql, _ in statements if "FROM patient_block_keys ORDER BY" in sql]
+        assert full_scans == []
+
+    def test_new_patients_indexed_once(self, test_db, create_patient):
+        create_patient(name="张三", phone="13800000001")
+        list(dedupe.find_duplicates(test_db))
+        count = test_db.query(PatientBlockKey).count()
+
+        assert dedupe.index_new_patients(test_db) == 0
+        assert test_db.query(PatientBlockKey).count() == count
+
+    def test_rebuild_picks_up_edits_and_drops_deleted(self, test_db, create_patient):
+        """测试重建分块键后修改过的患者被比较，已删除患者的分块键被清理"""
+        a = create_patient(name="张三", age=30, phone="13800000001")
+        b = create_patient(name="李四", age=60, gender="女", phone="13900000002")
+        c = create_patient(name="王五", age=20, phone="13700000003")
+        list(dedupe.find_duplicates(test_db))
+
+        b.name, b.age, b.gender, b.phone = "张三", 30, "男", "13800000001"
+        test_db.delete(c)
+        test_db.commit()
+        assert _pairs(dedupe.find_duplicates(test_db)) == []
+
+        assert _pairs(dedupe.find_duplicates(test_db, rebuild=True)) == [(a.id, b.id)]
+        assert test_db.query(PatientBlockKey).filter(PatientBlockKey.patient_id == c.id).count() == 0
+
+
+class TestDuplicatesApi:
+    """接口与后台任务测试"""
+
+    def test_streams_json_lines(self, client, create_patient):
+        first = create_patient(name="张三", phone="13800000001")
+        second = create_patient(name="张三", phone="13800000001")
+
+        response = client.get("/api/patients/duplicates")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert response.headers["x-next-since-id"] == str(second.id)
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert _pairs(lines) == [(first.id, second.id)]
+
+        # 用返回的游标增量查重：没有新患者
+        response = client.get("/api/patients/duplicates", params={"since_id": second.id})
+        assert response.text == ""
+
+    def test_reads_primary_not_lagging_replica(self, client, test_db, test_engine, create_patient, tmp_path):
+        """测试 GET 请求的会话开启了副本时，补建分块键和查重都在主库上进行"""
+        replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        Base.metadata.create_all(bind=replica)
+        factory = sessionmaker(class_=RoutingSession, autoflush=False, bind=test_engine,
+                               replica_set=ReplicaSet([replica], lag_probe=lambda engine: 0.0))
+
+        def replica_get_db():
+            db = factory()
+            db.use_replica = True
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = replica_get_db
+        try:
+            first = create_patient(name="张三", phone="13800000001")
+            second = create_patient(name="张三", phone="13800000001")
+
+            response = client.get("/api/patients/duplicates")
+
+            assert response.headers["x-next-since-id"] == str(second.id)
+            assert _pairs(json.loads(line) for line in response.text.splitlines()) == [(first.id, second.id)]
+            assert test_db.query(PatientBlockKey).count() > 0
+        finally:
+            replica.dispose()
+
+    def test_job(self, test_db, create_patient, tmp_path):
+        """测试 patient_dedupe 后台任务写出 JSON Lines 并给出下次的 since_id"""
+        import jobs
+
+        create_patient(name="张三", phone="13800000001")
+        second_id = create_patient(name="张三", phone="13800000001").id
+
+        class Context:
+            def write_session(self):
+                return test_db
+
+            def progress(self, done, total=None, message=None, force=False):
+                pass
+
+        out_path = tmp_path / "duplicates.jsonl"
+        with open(out_path, "w", encoding="utf-8") as out:
+            message = jobs.JOB_KINDS["patient_dedupe"].func(Context(), dedupe.PatientDedupeParams(), out)
+
+        assert len(out_path.read_text(encoding="utf-8").splitlines()) == 1
+        assert f"since_id={second_id}" in message
@@ -0,0 +1,149 @@
+"""
+医生目录缓存测试
+测试 doctor_directory.py 的懒加载、写入同步和跨进程失效
+"""
+import pytest
+
+import crud
+import doctor_directory
+from doctor_directory import DoctorDirectory, DoctorRecord
+from query_plan import capture_statements
+from schemas import DoctorCreate, DoctorUpdate
+
+
+@pytest.fixture
+def publisher():
+    """记录广播消息的跨进程失效函数"""
+    messages = []
+    doctor_directory.set_invalidation_publisher(messages.append)
+    yield messages
+    doctor_directory.set_invalidation_publisher(None)
+
+
+class TestDoctorRecord:
+    """医生快照测试"""
+
+    def test_record_uses_slots(self):
+        """测试记录没有 __dict__"""
+        record = DoctorRecord(1, "李医生", "内科", "10年", None, "在职")
+        assert not hasattr(record, "__dict__")
+
+
+class TestDoctorDirectory:
+    """目录缓存测试"""
+
+    def test_lazy_load_once(self, test_db, multiple_doctors):
+        """测试首次使用时加载，之后不再查询数据库"""
+        directory = DoctorDirectory()
+        assert directory.stats()["loaded"] is False
+
+        with capture_statements(test_db.get_bind()) as statements:
+            first = directory.get_by_name(test_db, "内科医生")
+            second = directory.get(test_db, first.id)
+            directory.count(test_db)
+
+        assert len(statements) == 1
+        assert second is first
+        assert first.specialty == "内科"
+        assert directory.loads == 1
+
+    def test_missing_name(self, test_db, multiple_doctors):
+        """测试不存在的医生"""
+        assert DoctorDirectory().get_by_name(test_db, "不存在") is None
+
+    def test_duplicate_names_resolve_to_lowest_id(self, test_db, create_doctor):
+        """测试同名医生取ID最小的一位"""
+        first = create_doctor(name="王医生", specialty="内科")
+        create_doctor(name="王医生", specialty="外科")
+
+        assert DoctorDirectory().get_by_name(test_db, "王医生").id == first.id
+
+    def test_ttl_expiry_reloads(self, test_db, create_doctor):
+        """测试超过有效期后重新加载"""
+        directory = DoctorDirectory(ttl=0)
+        directory.count(test_db)
+        create_doctor(name="新医生")
+
+        assert directory.get_by_name(test_db, "新医生") is not None
+        assert directory.loads == 2
+
+
+class TestWriteThrough:
+    """crud 写入同步测试"""
+
+    def test_create_doctor_updates_directory(self, test_db, multiple_doctors, sample_doctor_data):
+        """测试创建医生后目录立即可见"""
+        directory = doctor_directory.directory_for(test_db)
+        directory.count(test_db)
+
+        created = crud.create_doctor(test_db, DoctorCreate(**sample_doctor_data))
+
+        assert directory.get_by_name(test_db, "李医生").id == created.id
+        assert directory.loads == 1
+
+    def test_update_doctor_renames_entry(self, test_db, create_doctor, sample_doctor_data):
+        """测试修改姓名后旧姓名不再命中"""
+        doctor = create_doctor(name="旧名字")
+        directory = doctor_directory.directory_for(test_db)
+        directory.count(test_db)
+
+        crud.update_doctor(test_db, doctor.id, DoctorUpdate(**{**sample_doctor_data, "name": "新名字"}))
+
+        assert directory.get_by_name(test_db, "旧名字") is None
+        assert directory.get_by_name(test_db, "新名字").id == doctor.id
+
+    def test_delete_doctor_removes_entry(self, test_db, create_doctor):
+        """测试删除医生后目录中不再存在"""
+        doctor = create_doctor(name="待删除")
+        directory = doctor_directory.directory_for(test_db)
+        directory.count(test_db)
+
+        crud.delete_doctor(test_db, doctor.id)
+
+        assert directory.get(test_db, doctor.id) is None
+        assert directory.get_by_name(test_db, "待删除") is None
+
+    def test_writes_are_published(self, test_db, create_doctor, sample_doctor_data, publisher):
+        """测试写入时广播失效消息"""
+        created = crud.create_doctor(test_db, DoctorCreate(**sample_doctor_data))
+        crud.delete_doctor(test_db, created.id)
+
+        assert publisher == [created.id, created.id]
+
+    def test_remote_invalidation(self, test_db, create_doctor):
+        """测试收到其他进程的失效消息后重新加载"""
+        directory = doctor_directory.directory_for(test_db)
+        directory.count(test_db)
+        create_doctor(name="其他进程创建的医生")
+
+        doctor_directory.handle_remote_invalidation(None)
+
+        assert directory.get_by_name(test_db, "其他进程创建的医生") is not None
+
+
+class TestDirectoryUsage:
+    """目录在预约和仪表盘中的使用"""
+
+    def test_appointment_enrichment_uses_directory(self, test_db, multiple_appointments):
+        """测试预约列表中的医生信息"""
+        appointments, _ = crud.get_appointments(test_db)
+
+        doctor_names = {a["doctor"]["name"] for a in appointments}
+        assert doctor_names == {"内科医生", "外科医生", "儿科医生"}
+        assert appointments[0]["doctor"]["specialty"] == "内科"
+
+    def test_dashboard_departments(self, test_db, multiple_appointments):
+        """测试仪表盘科室统计"""
+        summary = crud.get_dashboard_summary(test_db)
+
+        departments = {d["name"]: d for d in summary["departments"]}
+        assert summary["summary"]["total_doctors"] == 6
+        assert departments["内科"]["doctor_count"] == 1
+        assert departments["内科"]["appointment_count"] == 1
+        assert departments["眼科"]["appointment_count"] == 0
+
+    def test_metrics_include_directory(self, client):
+        """测试 /metrics 包含目录统计"""
+        response = client.get("/metrics")
+
+        assert "doctor_directory" in response.json()
@@ -0,0 +1,202 @@
+"""
+幂等键测试
+测试 idempotency.py 和创建接口对 Idempotency-Key 请求头的处理
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+import crud
+import idempotency
+from models import IdempotencyRecord, Patient
+
+
+@pytest.fixture
+def count_creates(monkeypatch):
+    """统计 crud.create_patient 的实际调用次数"""
+    calls = []
+    original = crud.create_patient
+
+    def counting(db, patient):
+        calls.append(patient.name)
+        return original(db, patient)
+
+    monkeypatch.setattr(crud, "create_patient", counting)
+    return calls
+
+
+class TestIdempotentCreate:
+    """创建接口的幂等键测试"""
+
+    def test_replay_returns_first_response_without_creating(self, client, test_db, sample_patient_data, count_creates):
+        """测试相同键的重试返回第一次的响应，不再调用 crud.create_patient"""
+        headers = {"Idempotency-Key": "patient-1"}
+        first = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+        second = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+
+        assert first.status_code == second.status_code == 200
+        assert second.json() == first.json()
+        assert second.headers[idempotency.REPLAY_HEADER] == "true"
+        assert idempotency.REPLAY_HEADER not in first.headers
+        assert len(count_creates) == 1
+        assert test_db.query(Patient).count() == 1
+
+    def test_without_key_creates_every_time(self, client, test_db, sample_patient_data, count_creates):
+        """测试不带键时行为不变"""
+        client.post("/api/patients/", json=sample_patient_data)
+        client.post("/api/patients/", json=sample_patient_data)
+
+        assert len(count_creates) == 2
+        assert test_db.query(IdempotencyRecord).count() == 0
+
+    def test_different_payload_with_same_key_rejected(self, client, sample_patient_data):
+        """测试同一个键用于不同的请求体返回 422"""
+        headers = {"Idempotency-Key": "patient-2"}
+        client.post("/api/patients/", json=sample_patient_data, headers=headers)
+        response = client.post("/api/patients/", json={**sample_patient_data, "age": 40}, headers=headers)
+
+        assert response.status_code == 422
+
+    def test_same_key_in_different_scopes_independent(self, client, sample_patient_data, sample_appointment_data):
+        """测试不同接口的相同键互不影响"""
+        headers = {"Idempotency-Key": "shared"}
+        patient = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+        appointment = client.post("/api/appointments/", json=sample_appointment_data, headers=headers)
+
+        assert patient.status_code == appointment.status_code == 200
+        assert appointment.json()["data"]["patient_name"] == sample_appointment_data["patient_name"]
+
+    def test_failed_create_releases_key(self, client, test_db, sample_patient_data, monkeypatch):
+        """测试创建失败不保存记录，可以用同一个键重试"""
+        headers = {"Idempotency-Key": "patient-3"}
+
+        def failing(db, patient):
+            raise RuntimeError("数据库错误")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(crud, "create_patient", failing)
+            response = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+        assert response.status_code == 400
+        assert test_db.query(IdempotencyRecord).count() == 0
+
+        retry = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+        assert retry.status_code == 200
+        assert idempotency.REPLAY_HEADER not in retry.headers
+
+    def test_in_progress_duplicate_gets_conflict(self, client, test_db, sample_patient_data, count_creates, monkeypatch):
+        """测试第一次请求处理中时，重复请求等待超时返回 409"""
+        monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_SECONDS", 0)
+        now = datetime.now()
+        test_db.add(IdempotencyRecord(
+            scope="POST /api/patients", key="patient-4",
+            request_hash=idempotency.request_hash(sample_patient_data),
+            created_at=now, expires_at=now + timedelta(hours=1),
+        ))
+        test_db.commit()
+
+        response = client.post("/api/patients/", json=sample_patient_data, headers={"Idempotency-Key": "patient-4"})
+
+        assert response.status_code == 409
+        assert response.headers["Retry-After"] == "1"
+        assert count_creates == []
+
+    def test_stale_in_progress_claim_taken_over(self, client, test_db, sample_patient_data, count_creates):
+        """测试处理中断（超过 IDEMPOTENCY_LOCK_TIMEOUT）的记录可以被重新占用"""
+        started = datetime.now() - timedelta(seconds=idempotency.IDEMPOTENCY_LOCK_TIMEOUT + 5)
+        test_db.add(IdempotencyRecord(
+            scope="POST /api/patients", key="patient-5",
+            request_hash=idempotency.request_hash(sample_patient_data),
+            created_at=started, expires_at=started + timedelta(hours=1),
+        ))
+        test_db.commit()
+
+        response = client.post("/api/patients/", json=sample_patient_data, headers={"Idempotency-Key": "patient-5"})
+
+        assert response.status_code == 200
+        assert len(count_creates) == 1
+
+    def test_expired_record_not_replayed(self, client, test_db, sample_patient_data, count_creates):
+        """测试过期记录不再重放"""
+        headers = {"Idempotency-Key": "patient-6"}
+        client.post("/api/patients/", json=sample_patient_data, headers=headers)
+        test_db.query(IdempotencyRecord).update({"expires_at": datetime.now() - timedelta(seconds=1)})
+        test_db.commit()
+
+        response = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+
+        assert idempotency.REPLAY_HEADER not in response.headers
+        assert len(count_creates) == 2
+
+    def test_key_too_long_rejected(self, client, sample_patient_data):
+        """测试超长的键返回 400"""
+        headers = {"Idempotency-Key": "k" * (idempotency.MAX_KEY_LENGTH + 1)}
+        response = client.post("/api/patients/", json=sample_patient_data, headers=headers)
+
+        assert response.status_code == 400
+
+    def test_crash_before_saving_response_rolls_back_create(self, client, test_db, sample_patient_data, monkeypatch):
+        """测试保存响应失败时创建一起回滚，不会留下已创建的患者和“处理中”的记录"""
+        def failing_update(*args, **kwargs):
+            raise RuntimeError("保存响应失败")
+
+        monkeypatch.setattr(idempotency, "update", failing_update)
+        with pytest.raises(RuntimeError):
+            client.post("/api/patients/", json=sample_patient_data, headers={"Idempotency-Key": "patient-7"})
+
+        assert test_db.query(Patient).count() == 0
+        assert test_db.query(IdempotencyRecord).count() == 0
+
+    def test_claim_taken_over_during_create_not_committed(self, client, test_db, sample_patient_data, monkeypatch):
+        """测试处理太慢、记录已被其他请求重新占用时放弃本次创建，返回 409"""
+        original = crud.create_patient
+
+        def slow_create(db, patient):
+            db_patient = original(db, patient)
+            # 模拟其他请求在超时后重新占用了这个键
+            db.execute(
+                update(IdempotencyRecord).values(created_at=datetime.now() + timedelta(seconds=1))
+            )
+            return db_patient
+
+        monkeypatch.setattr(crud, "create_patient", slow_create)
+        response = client.post("/api/patients/", json=sample_patient_data, headers={"Idempotency-Key": "patient-8"})
+
+        assert response.status_code == 409
+        assert test_db.query(Patient).count() == 0
+
+    def test_handler_runs_in_threadpool(self, client, sample_patient_data, monkeypatch):
+        """测试创建不在事件循环线程上执行"""
+        loops = []
+        original = crud.create_patient
+
+        def recording(db, patient):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return original(db, patient)
+
+        monkeypatch.setattr(crud, "create_patient", recording)
+        client.post("/api/patients/", json=sample_patient_data, headers={"Idempotency-Key": "patient-9"})
+        client.post("/api/patients/", json=sample_patient_data)
+
+        assert loops == [None, None]
+
+
+class TestCleanup:
+    """过期记录清理测试"""
+
+    def test_cleanup_removes_only_expired(self, test_db):
+        """测试只删除过期记录"""
+        now = datetime.now()
+        for i, expires_at in enumerate([now - timedelta(hours=1), now - timedelta(minutes=1), now + timedelta(hours=1)]):
+            test_db.add(IdempotencyRecord(
+                scope="POST /api/patients", key=f"k{i}", request_hash="0" * 64,
+                status_code=200, response_body="{}", created_at=now, expires_at=expires_at,
+            ))
+        test_db.commit()
+
+        assert idempotency.cleanup_all_expired(test_db, batch_size=1) == 2
+        assert [record.key for record in test_db.query(IdempotencyRecord)] == ["k2"]
@@ -0,0 +1,276 @@
+"""
+后台任务测试
+测试 jobs.py 的任务执行、进度、取消、结果保留，以及 /api/jobs 接口和导出任务
+"""
+import csv
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import jobs
+from database import Base, ReplicaSet, RoutingSession, get_db
+from main import app
+from models import Appointment, Job, Patient
+
+
+class WaitParams(BaseModel):
+    steps: int = 1000
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """文件数据库：任务线程和请求各自使用独立连接"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def manager(session_factory, tmp_path):
+    manager = jobs.JobManager(
+        executor=ThreadPoolExecutor(max_workers=1), session_factory=session_factory,
+        result_dir=str(tmp_path / "results"), max_concurrent=1, max_queued=2,
+    )
+    yield manager
+    manager.shutdown()
+
+
+@pytest.fixture
+def job_client(session_factory, manager):
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[jobs.get_manager] = lambda: manager
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def blocking_kind(monkeypatch):
+    """注册一个等待 release 后才逐步汇报进度的任务类型"""
+    started, release = threading.Event(), threading.Event()
+
+    def wait_job(context, params, out):
+        started.set()
+        release.wait(5)
+        for step in range(params.steps):
+            context.progress(step, params.steps, force=True)
+        out.write("{}")
+        return "完成"
+
+    monkeypatch.setitem(jobs.JOB_KINDS, "test_wait", jobs.JobKind(
+        "test_wait", wait_job, WaitParams, "application/json", ".json", "utf-8", "测试"))
+    return started, release
+
+
+def _submit(client, kind, params=None):
+    response = client.post("/api/jobs/", json={"kind": kind, "params": params or {}})
+    assert response.status_code == 202, response.text
+    return response.json()["data"]["id"]
+
+
+def _status(client, job_id):
+    return client.get(f"/api/jobs/{job_id}").json()["data"]
+
+
+class TestJobLifecycle:
+    """任务提交、执行和下载测试"""
+
+    def test_export_appointments_job(self, job_client, session_factory, manager):
+        """测试预约导出任务：成功后可以下载CSV"""
+        with session_factory() as db:
+            for i in range(3):
+                db.add(Appointment(patient_name=f"患者{i}", doctor_name="李医生",
+                                   appointment_time=datetime(2024, 5, 10 + i, 9), status="confirmed"))
+            db.add(Appointment(patient_name="六月患者", doctor_name="李医生",
+                               appointment_time=datetime(2024, 6, 1, 9), status="pending"))
+            db.commit()
+
+        job_id = _submit(job_client, "appointments_export", {"month": "2024-05"})
+        manager.wait(job_id, timeout=5)
+
+        job = _status(job_client, job_id)
+        assert job["status"] == "succeeded"
+        assert job["progress"] == 100
+        assert job["params"] == {"month": "2024-05"}
+        assert job["message"] == "共导出 3 条预约"
+
+        response = job_client.get(f"/api/jobs/{job_id}/result")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        rows = list(csv.reader(io.StringIO(response.content.decode("utf-8-sig"))))
+        assert rows[0][:2] == ["预约ID", "患者姓名"]
+        assert [row[1] for row in rows[1:]] == ["患者0", "患者1", "患者2"]
+
+    def test_export_batches_cover_all_rows(self, job_client, session_factory, manager, monkeypatch):
+        """测试分批导出不遗漏、不重复"""
+        import exports
+        monkeypatch.setattr(exports, "EXPORT_BATCH_SIZE", 2)
+        with session_factory() as db:
+            for i in range(5):
+                db.add(Patient(name=f"患者{i}", age=30, gender="男" if i % 2 else "女", medical_condition="感冒"))
+            db.commit()
+
+        job_id = _submit(job_client, "patients_export")
+        manager.wait(job_id, timeout=5)
+
+        content = job_client.get(f"/api/jobs/{job_id}/result").content.decode("utf-8-sig")
+        assert [row[1] for row in csv.reader(io.StringIO(content))][1:] == [f"患者{i}" for i in range(5)]
+
+    def test_unknown_kind_and_invalid_params(self, job_client):
+        """测试未知任务类型返回 400，参数不合法返回 422"""
+        assert job_client.post("/api/jobs/", json={"kind": "nope"}).status_code == 400
+        response = job_client.post("/api/jobs/", json={"kind": "appointments_export", "params": {"month": "2024-13"}})
+        assert response.status_code == 422
+
+    def test_list_kinds(self, job_client):
+        """测试列出任务类型"""
+        kinds = {kind["kind"] for kind in job_client.get("/api/jobs/kinds").json()["data"]}
+        assert {"appointments_export", "patients_export"} <= kinds
+
+    def test_result_not_ready(self, job_client, blocking_kind, manager):
+        """测试任务未完成时下载返回 409"""
+        started, release = blocking_kind
+        job_id = _submit(job_client, "test_wait", {"steps": 1})
+        started.wait(5)
+        assert job_client.get(f"/api/jobs/{job_id}/result").status_code == 409
+        release.set()
+        manager.wait(job_id, timeout=5)
+        assert job_client.get(f"/api/jobs/{job_id}/result").status_code == 200
+
+    def test_failed_job_records_error(self, job_client, manager, monkeypatch):
+        """测试任务异常时状态为 failed 并记录原因，不留下结果文件"""
+        def failing(context, params, out):
+            raise RuntimeError("统计失败")
+
+        monkeypatch.setitem(jobs.JOB_KINDS, "test_fail", jobs.JobKind(
+            "test_fail", failing, WaitParams, "application/json", ".json", "utf-8", "测试"))
+        job_id = _submit(job_client, "test_fail")
+        manager.wait(job_id, timeout=5)
+
+        job = _status(job_client, job_id)
+        assert job["status"] == "failed"
+        assert "统计失败" in job["error"]
+        assert os.listdir(manager.result_dir) == []
+
+    def test_poll_reads_primary_not_lagging_replica(self, job_client, session_factory, manager, tmp_path):
+        """测试 GET 请求的会话开启了副本时，提交后立即查询和下载都读主库"""
+        replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        Base.metadata.create_all(bind=replica)
+        factory = sessionmaker(class_=RoutingSession, autoflush=False, bind=session_factory.kw["bind"],
+                               replica_set=ReplicaSet([replica], lag_probe=lambda engine: 0.0))
+
+        def replica_get_db():
+            db = factory()
+            db.use_replica = True
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app.dependency_overrides[get_db] = replica_get_db
+        try:
+            job_id = _submit(job_client, "patients_export")
+            manager.wait(job_id, timeout=5)
+
+            assert _status(job_client, job_id)["status"] == "succeeded"
+            assert job_client.get(f"/api/jobs/{job_id}/result").status_code == 200
+        finally:
+            replica.dispose()
+
+    def test_missing_job(self, job_client):
+        """测试不存在的任务返回 404"""
+        assert job_client.get("/api/jobs/missing").status_code == 404
+        assert job_client.delete("/api/jobs/missing").status_code == 404
+
+
+class TestCancellationAndLimits:
+    """取消与并发上限测试"""
+
+    def test_cancel_queued_job_never_runs(self, job_client, blocking_kind, manager):
+        """测试排队中的任务取消后不会执行"""
+        started, release = blocking_kind
+        first = _submit(job_client, "test_wait", {"steps": 1})
+        started.wait(5)
+        second = _submit(job_client, "test_wait", {"steps": 1})
+
+        response = job_client.delete(f"/api/jobs/{second}")
+        assert response.json()["data"]["status"] == "cancelled"
+
+        release.set()
+        manager.wait(first, timeout=5)
+        manager.wait(second, timeout=5)
+        assert _status(job_client, first)["status"] == "succeeded"
+        assert _status(job_client, second)["status"] == "cancelled"
+
+    def test_cancel_running_job_stops_at_next_progress(self, job_client, blocking_kind, manager):
+        """测试运行中的任务在下一次汇报进度时停止，不留下结果文件"""
+        started, release = blocking_kind
+        job_id = _submit(job_client, "test_wait")
+        started.wait(5)
+
+        job_client.delete(f"/api/jobs/{job_id}")
+        release.set()
+        manager.wait(job_id, timeout=5)
+
+        job = _status(job_client, job_id)
+        assert job["status"] == "cancelled"
+        assert job["progress"] < 100
+        assert os.listdir(manager.result_dir) == []
+
+    def test_queue_limit(self, job_client, blocking_kind, manager):
+        """测试执行中 + 排队的任务达到上限时拒绝提交"""
+        started, release = blocking_kind
+        job_ids = [
+            _submit(job_client, "test_wait", {"steps": 1})
+            for _ in range(manager.max_concurrent + manager.max_queued)
+        ]
+
+        response = job_client.post("/api/jobs/", json={"kind": "test_wait", "params": {"steps": 1}})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "30"
+        assert manager.rejected == 1
+        release.set()
+        for job_id in job_ids:
+            manager.wait(job_id, timeout=5)
+
+
+class TestCleanup:
+    """过期结果清理测试"""
+
+    def test_cleanup_removes_expired_results_and_stale_jobs(self, session_factory, manager, tmp_path):
+        """测试删除过期的任务记录和结果文件，长时间无更新的任务标记为失败"""
+        now = datetime.now()
+        result = tmp_path / "old.csv"
+        result.write_text("x")
+        with session_factory() as db:
+            db.add(Job(id="old", kind="patients_export", status="succeeded", progress=100,
+                       cancel_requested=False, result_path=str(result), created_at=now - timedelta(days=2),
+                       expires_at=now - timedelta(hours=1)))
+            db.add(Job(id="stale", kind="patients_export", status="running", progress=10,
+                       cancel_requested=False, created_at=now - timedelta(days=1),
+                       updated_at=now - timedelta(seconds=jobs.JOB_STALE_SECONDS + 1)))
+            db.add(Job(id="fresh", kind="patients_export", status="running", progress=10,
+                       cancel_requested=False, created_at=now, updated_at=now))
+            db.commit()
+
+            assert manager.cleanup(db) == 1
+            assert not result.exists()
+            assert db.get(Job, "old") is None
+            assert db.get(Job, "stale").status == "failed"
+            assert db.get(Job, "fresh").status == "running"
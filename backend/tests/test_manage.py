@@ -0,0 +1,131 @@
+"""
+管理命令测试
+测试 manage.py 中的数据库管理命令
+"""
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import manage
+from main import app
+
+
+@pytest.fixture
+def file_engine(tmp_path):
+    """基于临时文件的 SQLite 引擎"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'manage.db'}")
+    yield engine
+    engine.dispose()
+
+
+class TestInitDb:
+    """init-db 命令测试"""
+
+    def test_init_db_creates_tables(self, file_engine):
+        """测试创建所有表"""
+        manage.init_db(bind=file_engine)
+
+        tables = set(inspect(file_engine).get_table_names())
+        assert {"patients", "doctors", "appointments"} <= tables
+
+    def test_init_db_is_idempotent(self, file_engine):
+        """测试重复执行不报错"""
+        manage.init_db(bind=file_engine)
+        manage.init_db(bind=file_engine)
+
+        assert "patients" in inspect(file_engine).get_table_names()
+
+    def test_parser_requires_command(self):
+        """测试必须指定子命令"""
+        with pytest.raises(SystemExit):
+            manage.build_parser().parse_args([])
+
+
+class TestStartupHook:
+    """启动钩子测试"""
+
+    def test_create_tables_not_registered_by_default(self):
+        """测试默认不在启动时建表"""
+        handlers = [handler.__name__ for handler in app.router.on_startup]
+        assert "create_tables" not in handlers
+
+
+class TestAddColumns:
+    """add-columns 迁移命令测试"""
+
+    def test_adds_version_column_to_legacy_table(self, file_engine):
+        """测试为没有 version 列的旧表补列，已有行取默认值"""
+        with file_engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE patients (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, "
+                "age INTEGER NOT NULL, gender VARCHAR(2) NOT NULL, phone VARCHAR(20), address TEXT, "
+                "medical_condition TEXT NOT NULL, notes TEXT, created_at DATETIME, updated_at DATETIME)"
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO patients (name, age, gender, medical_condition) VALUES ('旧患者', 30, '男', '感冒')"
+            )
+
+        statements = manage.add_columns(bind=file_engine)
+
+        assert statements == ["ALTER TABLE patients ADD COLUMN version INTEGER DEFAULT '1' NOT NULL"]
+        with file_engine.connect() as conn:
+            assert conn.exec_driver_sql("SELECT version FROM patients").scalar() == 1
+        assert manage.missing_columns(file_engine) == []
+
+    def test_up_to_date_database(self, file_engine):
+        """测试新建的库没有缺失的列"""
+        manage.init_db(bind=file_engine)
+
+        assert manage.add_columns(bind=file_engine, dry_run=True) == []
+
+
+class TestCreateIndexes:
+    """create-indexes 迁移命令测试"""
+
+    def _legacy_database(self, engine):
+        """模拟升级前的数据库：只有表和主键，没有二级索引"""
+        manage.init_db(bind=engine)
+        with engine.begin() as conn:
+            for table in ("patients", "doctors", "appointments"):
+                for index in inspect(conn).get_indexes(table):
+                    conn.exec_driver_sql(f"DROP INDEX {index['name']}")
+
+    def test_init_db_creates_declared_indexes(self, file_engine):
+        """测试建表时同时创建模型声明的索引"""
+        manage.init_db(bind=file_engine)
+
+        names = {index["name"] for index in inspect(file_engine).get_indexes("appointments")}
+        assert {"idx_appointments_doctor_time", "idx_appointments_time_status"} <= names
+        assert manage.missing_indexes(file_engine) == []
+
+    def test_create_indexes_on_legacy_database(self, file_engine):
+        """测试为旧库补建索引"""
+        self._legacy_database(file_engine)
+        assert manage.missing_indexes(file_engine)
+
+        statements = manage.create_indexes(bind=file_engine)
+
+        assert any("idx_patients_gender_id" in sql for sql in statements)
+        assert manage.missing_indexes(file_engine) == []
+        patient_indexes = {index["name"] for index in inspect(file_engine).get_indexes("patients")}
+        assert {"idx_patients_name", "idx_patients_phone", "idx_patients_gender_id"} <= patient_indexes
+
+    def test_dry_run_does_not_execute(self, file_engine):
+        """测试 --sql 只输出SQL"""
+        self._legacy_database(file_engine)
+
+        statements = manage.create_indexes(bind=file_engine, dry_run=True)
+
+        assert statements
+        assert all(sql.startswith("CREATE INDEX") for sql in statements)
+        assert manage.missing_indexes(file_engine)
+
+    def test_index_with_other_name_and_same_columns_is_reused(self, file_engine):
+        """测试按 MySQL DDL 命名的同列索引不会重复创建"""
+        self._legacy_database(file_engine)
+        with file_engine.begin() as conn:
+            conn.exec_driver_sql("CREATE INDEX idx_name ON patients (name)")
+
+        names = {index.name for index in manage.missing_indexes(file_engine)}
+
+        assert "idx_patients_name" not in names
+        assert "idx_patients_phone" in names
@@ -0,0 +1,179 @@
+"""
+姓名模糊搜索测试
+测试 name_index.py 的 n-gram 切分、前缀过滤、随写入更新、与数据库核对、快照，
+以及患者/医生列表接口的 fuzzy 参数
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import name_index
+from database import Base
+from models import Doctor, Patient
+from query_plan import capture_statements
+from schemas import DoctorCreate, PatientCreate, PatientUpdate
+
+
+def _patient(db, name, **kwargs):
+    data = {"name": name, "age": 30, "gender": "男", "medical_condition": "感冒", **kwargs}
+    return crud.create_patient(db, PatientCreate(**data))
+
+
+def _names(db, query):
+    return [db.get(Patient, patient_id).name for patient_id, _ in name_index.search(db, Patient, query)]
+
+
+class TestGrams:
+    """n-gram 切分测试"""
+
+    def test_normalization(self):
+        """测试全角、大小写、空格不影响切分"""
+        assert name_index.grams("Zhang San") == name_index.grams("ＺＨＡＮＧ　ＳＡＮ")
+
+    def test_chinese_uses_bigrams(self):
+        assert {"^张", "张三", "三$"} <= name_index.grams("张三")
+
+    def test_similarity(self):
+        same = name_index.similarity(name_index.grams("zhangsan"), name_index.grams("zhangsan"))
+        typo = name_index.similarity(name_index.grams("zhangsan"), name_index.grams("zhnagsan"))
+        assert same == 1.0
+        assert 0.3 < typo < 1.0
+
+
+class TestSearch:
+    """索引查询测试"""
+
+    def test_typos_ranked_by_similarity(self, test_db):
+        """测试拼写错误也能找到，最相近的排在前面"""
+        for name in ("Zhang Sanfeng", "Zhang San", "Li Si", "Wang Wu"):
+            _patient(test_db, name)
+
+        assert _names(test_db, "zhnag san")[:2] == ["Zhang San", "Zhang Sanfeng"]
+        assert "Li Si" not in _names(test_db, "zhnag san")
+
+    def test_chinese_typo(self, test_db):
+        """测试汉字姓名错一个字仍能找到"""
+        _patient(test_db, "欧阳明华")
+        _patient(test_db, "李四")
+
+        assert _names(test_db, "欧阳明花") == ["欧阳明华"]
+
+    def test_writes_update_index_without_rebuild(self, test_db):
+        """测试 crud 写入同步更新索引，不重新加载"""
+        patient = _patient(test_db, "Zhang San")
+        _names(test_db, "zhang")
+        index = name_index.index_for(test_db, Patient)
+        rebuilds = index.rebuilds
+
+        _patient(test_db, "Zhang Wei")
+        crud.update_patient(test_db, patient.id, PatientUpdate(name="Chen San", age=30, gender="男",
+                                                               medical_condition="感冒"))
+
+        assert _names(test_db, "zhang") == ["Zhang Wei"]
+        crud.delete_patient(test_db, patient.id)
+        assert _names(test_db, "chen san") == []
+        assert index.rebuilds == rebuilds
+
+    def test_candidates_limited_to_rare_grams(self, test_db):
+        """测试常见 n-gram 的倒排表不会整个进入候选"""
+        for i in range(50):
+            _patient(test_db, f"Zhang {chr(97 + i % 26)}{chr(97 + i // 26)}xx")
+        _patient(test_db, "Zhang Qiuyue")
+
+        assert _names(test_db, "zhang qiuyue")[0] == "Zhang Qiuyue"
+
+    def test_early_stop_matches_full_count(self, test_db):
+        """测试提前停止遍历长倒排表时，前 limit 个结果与逐个计算相似度一致"""
+        names = [f"Zhang {chr(97 + i % 26)}{chr(97 + i // 26)}" for i in range(60)] + ["Zhang Ab", "Wang Ab"]
+        for name in names:
+            _patient(test_db, name)
+
+        query = name_index.grams("zhang ab")
+        expected = sorted(
+            ((patient.id, name_index.similarity(query, name_index.grams(patient.name)))
+             for patient in test_db.query(Patient)),
+            key=lambda item: (-item[1], item[0]),
+        )[:5]
+        assert name_index.search(test_db, Patient, "zhang ab", limit=5) == \
+            [(patient_id, round(score, 4)) for patient_id, score in expected]
+
+    def test_external_change_detected(self, test_db):
+        """测试其他进程绕过 crud 的新增、修改在核对时只增量读取，不重建"""
+        patient = _patient(test_db, "Zhang San")
+        _names(test_db, "zhang")
+        index = name_index.index_for(test_db, Patient)
+        rebuilds = index.rebuilds
+
+        test_db.add(Patient(name="Zhang Wei", age=40, gender="男", medical_condition="复查"))
+        test_db.query(Patient).filter(Patient.id == patient.id).update({"name": "Chen San"})
+        test_db.commit()
+        assert "Zhang Wei" not in _names(test_db, "zhang wei")  # 核对间隔内仍使用内存中的索引
+
+        index.invalidate()
+        assert _names(test_db, "zhang wei")[0] == "Zhang Wei"
+        assert _names(test_db, "chen san") == ["Chen San"]
+        assert index.rebuilds == rebuilds
+        assert index.refreshes == 1
+
+    def test_external_delete_triggers_rebuild(self, test_db):
+        """测试增量读取后行数仍不一致（其他进程删除）时整体重建"""
+        patient = _patient(test_db, "Zhang San")
+        _names(test_db, "zhang")
+        index = name_index.index_for(test_db, Patient)
+        rebuilds = index.rebuilds
+
+        test_db.delete(patient)
+        test_db.commit()
+        index.invalidate()
+
+        assert _names(test_db, "zhang san") == []
+        assert index.rebuilds == rebuilds + 1
+
+    def test_snapshot_reused_after_restart(self, tmp_path, monkeypatch):
+        """测试进程重启后与数据库一致的快照直接加载，不读全表"""
+        monkeypatch.setattr(name_index, "FUZZY_INDEX_DIR", str(tmp_path / "index"))
+        engine = create_engine(f"sqlite:///{tmp_path / 'hospital.db'}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            _patient(db, "Zhang San")
+            _patient(db, "Li Si")
+            _names(db, "zhang")
+            name_index.save_all()
+
+            name_index._indexes.clear()  # 模拟进程重启
+            with capture_statements(engine) as statements:
+                assert _names(db, "zhang san")[0] == "Zhang San"
+            assert not any("FROM patients WHERE patients.id >" in sql for sql, _ in statements)
+            assert name_index.index_for(db, Patient).snapshot_loads == 1
+        finally:
+            db.close()
+            engine.dispose()
+
+
+class TestFuzzyListApi:
+    """列表接口 fuzzy 参数测试"""
+
+    def test_patients(self, client, test_db):
+        _patient(test_db, "Zhang San", gender="女")
+        _patient(test_db, "Zhang Sanfeng")
+        _patient(test_db, "Li Si")
+
+        assert client.get("/api/patients/", params={"search": "zhnag"}).json()["patients"] == []
+        data = client.get("/api/patients/", params={"search": "zhnag san", "fuzzy": "true"}).json()
+        assert [patient["name"] for patient in data["patients"]] == ["Zhang San", "Zhang Sanfeng"]
+        assert data["pagination"]["total"] == 2
+
+        data = client.get("/api/patients/", params={"search": "zhnag san", "fuzzy": "true", "gender": "男"}).json()
+        assert [patient["name"] for patient in data["patients"]] == ["Zhang Sanfeng"]
+
+    def test_doctors(self, client, test_db, sample_doctor_data):
+        for name in ("Wang Fang", "Wang Fangfei", "Zhao Liu"):
+            crud.create_doctor(test_db, DoctorCreate(**{**sample_doctor_data, "name": name}))
+
+        data = client.get("/api/doctors/", params={"search": "wnag fang", "fuzzy": "true", "limit": 1}).json()
+
+        assert [doctor["name"] for doctor in data["doctors"]] == ["Wang Fang"]
+        assert data["summary"]["total"] == 2
+        assert data["pagination"]["next_cursor"] is None
@@ -0,0 +1,176 @@
+"""
+查询计划测试
+在种子数据上检查 crud 查询是否使用索引
+"""
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import database
+import manage
+import query_plan
+from database import Base, ReplicaSet, RoutingSession
+from models import Patient, Doctor, Appointment
+from query_plan import (
+    CRUD_PLAN_CHECKS, analyze_call, assert_indexed, capture_statements,
+    check_crud_plans, find_full_scans
+)
+
+
+@pytest.fixture
+def seeded_db(test_db):
+    """种子数据：患者、医生、预约各若干条"""
+    specialties = ["内科", "外科", "儿科", "妇产科", "眼科", "口腔科"]
+    test_db.add_all([
+        Patient(
+            name=f"患者{i}", age=i % 90, gender="男" if i % 2 else "女",
+            phone=f"138{i:08d}", medical_condition="复查" if i % 10 == 0 else "感冒"
+        )
+        for i in range(300)
+    ])
+    test_db.add_all([
+        Doctor(name=f"医生{i}", specialty=specialties[i % 6], experience="5年", status="在职")
+        for i in range(30)
+    ])
+    start = datetime.now() - timedelta(days=30)
+    test_db.add_all([
+        Appointment(
+            patient_name=f"患者{i % 300}", doctor_name=f"医生{i % 30}",
+            appointment_time=start + timedelta(hours=i),
+            status=["pending", "confirmed", "cancelled"][i % 3]
+        )
+        for i in range(1000)
+    ])
+    test_db.commit()
+    return test_db
+
+
+class TestPlanParsing:
+    """执行计划解析测试"""
+
+    def test_sqlite_full_scan(self):
+        """测试识别 SQLite 全表扫描"""
+        assert find_full_scans("sqlite", ["SCAN patients"]) == ["patients"]
+        assert find_full_scans("sqlite", ["SCAN TABLE patients"]) == ["patients"]
+
+    def test_sqlite_index_scan_is_not_full_scan(self):
+        """测试覆盖索引扫描和索引查找不算全表扫描"""
+        plan = [
+            "SCAN doctors USING COVERING INDEX idx_doctors_specialty",
+            "SEARCH patients USING INDEX idx_patients_name (name=?)",
+        ]
+        assert find_full_scans("sqlite", plan) == []
+
+    def test_mysql_full_scan(self):
+        """测试识别 MySQL type=ALL"""
+        plan = [
+            "table=appointments type=ALL key=None",
+            "table=doctors type=ref key=idx_name",
+        ]
+        assert find_full_scans("mysql", plan) == ["appointments"]
+
+    def test_postgresql_seq_scan(self):
+        """测试识别 PostgreSQL Seq Scan"""
+        plan = [
+            "Seq Scan on patients  (cost=0.00..1.05 rows=5 width=100)",
+            "Index Scan using idx_doctors_name on doctors  (cost=0.14..8.16 rows=1 width=100)",
+        ]
+        assert find_full_scans("postgresql", plan) == ["patients"]
+
+
+class TestCapture:
+    """SQL 捕获测试"""
+
+    def test_capture_statements(self, test_db):
+        """测试捕获 crud 发出的 SQL"""
+        with capture_statements(test_db.get_bind()) as statements:
+            crud.get_doctor(test_db, 1)
+
+        assert len(statements) == 1
+        assert "FROM doctors" in statements[0][0]
+
+    def test_analyze_call_reports_each_distinct_select_once(self, seeded_db):
+        """测试相同SQL只解释一次"""
+        reports = analyze_call(seeded_db, crud.get_appointments, status="pending")
+
+        sqls = [report.sql for report in reports]
+        assert len(sqls) == len(set(sqls))
+        assert all(report.plan for report in reports)
+
+
+class TestCrudQueryPlans:
+    """crud 查询计划断言"""
+
+    @pytest.mark.parametrize("name,call,allow_scans", CRUD_PLAN_CHECKS, ids=[c[0] for c in CRUD_PLAN_CHECKS])
+    def test_crud_query_uses_indexes(self, seeded_db, name, call, allow_scans):
+        """测试声明了索引的查询不做全表扫描"""
+        assert_indexed(seeded_db, call, allow_scans=allow_scans)
+
+    def test_check_crud_plans_passes(self, seeded_db):
+        """测试全部检查通过"""
+        assert check_crud_plans(seeded_db) == []
+
+    def test_unindexed_query_detected(self, seeded_db):
+        """测试没有索引的查询会被发现"""
+        def by_age(db):
+            return db.query(Patient).filter(Patient.age == 30).all()
+
+        with pytest.raises(AssertionError, match="全表扫描"):
+            assert_indexed(seeded_db, by_age)
+
+    def test_allowed_scan_passes(self, seeded_db):
+        """测试明确允许的全表扫描"""
+        assert_indexed(seeded_db, crud.get_patients, search="患者", allow_scans=("patients",))
+
+
+class TestReplicaPlans:
+    """读写分离时的查询计划检查"""
+
+    @pytest.fixture
+    def replica_session(self, tmp_path, monkeypatch):
+        """主库有索引、副本删掉了全部 idx_* 索引的只读会话"""
+        primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+        replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        for engine in (primary, replica):
+            Base.metadata.create_all(bind=engine)
+        with replica.begin() as conn:
+            names = conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+            ).scalars().all()
+            for name in names:
+                conn.exec_driver_sql(f"DROP INDEX {name}")
+        factory = sessionmaker(class_=RoutingSession, autoflush=False, bind=primary,
+                               replica_set=ReplicaSet([replica], lag_probe=lambda engine: 0.0))
+
+        def read_session():
+            db = factory()
+            db.use_replica = True
+            return db
+
+        monkeypatch.setattr(database, "get_read_session", read_session)
+        yield read_session
+        primary.dispose()
+        replica.dispose()
+
+    def test_explains_on_replica(self, replica_session):
+        """测试发往副本的 SELECT 被捕获，并在副本上执行 EXPLAIN"""
+        db = replica_session()
+        try:
+            reports = analyze_call(db, crud.get_doctors, status="在职")
+        finally:
+            db.close()
+
+        assert reports
+        assert any("doctors" in report.full_scans for report in reports)
+
+    def test_check_plans_fails_on_unindexed_replica(self, replica_session):
+        assert manage.check_plans() == 1
+
+    def test_check_without_statements_fails(self, seeded_db, monkeypatch):
+        """测试没有捕获到任何查询的检查不会被当作通过"""
+        monkeypatch.setattr(query_plan, "CRUD_PLAN_CHECKS", [("noop", lambda db: None, ())])
+
+        [(name, report)] = check_crud_plans(seeded_db)
+        assert name == "noop" and report.full_scans == []
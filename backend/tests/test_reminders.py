@@ -0,0 +1,164 @@
+"""
+预约提醒测试
+测试 reminders.py 的时间窗口扫描、键集分页、最多一次认领和文件发送器
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import database
+import manage
+import reminders
+from models import AppointmentReminder, ReminderState
+from query_plan import capture_statements
+
+NOW = datetime(2024, 5, 20, 8)
+
+
+@pytest.fixture
+def session_factory(test_engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return reminders.FileSender(str(tmp_path / "outbox.jsonl"))
+
+
+def _sent(outbox):
+    try:
+        with open(outbox.path, encoding="utf-8") as lines:
+            return [json.loads(line) for line in lines]
+    except FileNotFoundError:
+        return []
+
+
+def _scheduler(session_factory, sender, **kwargs):
+    kwargs.setdefault("lead_hours", 24)
+    return reminders.ReminderScheduler(session_factory, sender, **kwargs)
+
+
+class TestReminderWindow:
+    """时间窗口与状态筛选测试"""
+
+    def test_reminds_confirmed_appointments_within_lead(self, session_factory, outbox,
+                                                        create_appointment, create_patient):
+        """测试只提醒提前量以内、已确认的预约"""
+        create_patient(name="张三", phone="13800000001")
+        due = create_appointment(patient_name="张三", appointment_time=NOW + timedelta(hours=5), status="confirmed")
+        create_appointment(patient_name="李四", appointment_time=NOW + timedelta(hours=6), status="pending")
+        create_appointment(patient_name="王五", appointment_time=NOW + timedelta(hours=30), status="confirmed")
+        create_appointment(patient_name="赵六", appointment_time=NOW - timedelta(hours=1), status="confirmed")
+
+        assert _scheduler(session_factory, outbox).run_once(NOW) == 1
+
+        [message] = _sent(outbox)
+        assert message["appointment_id"] == due.id
+        assert message["phone"] == "13800000001"
+        assert "张三" in message["text"]
+
+    def test_at_most_once(self, session_factory, outbox, create_appointment):
+        """测试重复执行和多个调度器都不会重复提醒"""
+        create_appointment(appointment_time=NOW + timedelta(hours=1), status="confirmed")
+
+        first = _scheduler(session_factory, outbox)
+        first.run_once(NOW)
+        first.run_once(NOW + timedelta(minutes=1))
+        _scheduler(session_factory, outbox).run_once(NOW + timedelta(minutes=2))
+
+        assert len(_sent(outbox)) == 1
+
+    def test_send_failure_not_retried(self, session_factory, test_db, create_appointment):
+        """测试发送失败只记录原因，不再重试"""
+        appointment = create_appointment(appointment_time=NOW + timedelta(hours=1), status="confirmed")
+
+        class BrokenSender:
+            calls = 0
+
+            def send(self, message):
+                BrokenSender.calls += 1
+                raise ConnectionError("短信网关不可用")
+
+        scheduler = _scheduler(session_factory, BrokenSender(), catchup_seconds=0)
+        assert scheduler.run_once(NOW) == 0
+        scheduler.run_once(NOW + timedelta(minutes=1))
+
+        assert BrokenSender.calls == 1
+        record = test_db.get(AppointmentReminder, appointment.id)
+        assert record.status == reminders.FAILED
+        assert "短信网关" in record.error
+
+    def test_window_advances_between_runs(self, session_factory, outbox, create_appointment):
+        """测试非补扫的轮次只读取上一轮上界之后的新窗口"""
+        scheduler = _scheduler(session_factory, outbox, catchup_seconds=3600)
+        scheduler.run_once(NOW)
+        create_appointment(appointment_time=NOW + timedelta(hours=24, minutes=1), status="confirmed")
+
+        with capture_statements(session_factory.kw["bind"]) as statements:
+            assert scheduler.run_once(NOW + timedelta(minutes=1)) == 1
+
+        window = [parameters for sql, parameters in statements if "FROM appointments" in sql]
+        assert str(window[0][0]).startswith(str(NOW + timedelta(hours=24)))
+
+    def test_catchup_finds_appointments_confirmed_late(self, session_factory, outbox, create_appointment):
+        """测试提前量以内才确认的预约由补扫发现"""
+        scheduler = _scheduler(session_factory, outbox, catchup_seconds=1800)
+        scheduler.run_once(NOW)
+        create_appointment(appointment_time=NOW + timedelta(hours=2), status="confirmed")
+
+        assert scheduler.run_once(NOW + timedelta(minutes=1)) == 0
+        assert scheduler.run_once(NOW + timedelta(minutes=31)) == 1
+
+    def test_window_persisted_across_cli_runs(self, session_factory, test_db, outbox, monkeypatch):
+        """测试 cron 连续两次执行 send-reminders（各自新建调度器）时，第二次只读取新窗口"""
+        monkeypatch.setattr(database, "SessionLocal", session_factory)
+        monkeypatch.setattr(reminders, "load_sender", lambda: outbox)
+
+        manage.send_reminders()
+        watermark = test_db.get(ReminderState, reminders.STATE_ID).watermark
+        with capture_statements(session_factory.kw["bind"]) as statements:
+            manage.send_reminders()
+
+        window = [parameters for sql, parameters in statements if "FROM appointments" in sql]
+        assert str(window[0][0]) == str(watermark)
+        test_db.expire_all()
+        assert test_db.get(ReminderState, reminders.STATE_ID).watermark > watermark
+
+    def test_keyset_batches(self, session_factory, outbox, create_appointment):
+        """测试同一时间的多条预约跨批次不遗漏、不重复"""
+        same_time = NOW + timedelta(hours=3)
+        for i in range(5):
+            create_appointment(patient_name=f"患者{i}", appointment_time=same_time, status="confirmed")
+
+        assert _scheduler(session_factory, outbox, batch_size=2).run_once(NOW) == 5
+        assert sorted(message["patient_name"] for message in _sent(outbox)) == [f"患者{i}" for i in range(5)]
+
+
+class TestRetention:
+    """提醒记录清理测试"""
+
+    def test_old_records_deleted(self, session_factory, test_db, outbox):
+        """测试预约时间早于保留期的提醒记录被删除"""
+        old = NOW - timedelta(days=reminders.REMINDER_RETENTION_DAYS + 1)
+        test_db.add(AppointmentReminder(appointment_id=1, appointment_time=old, status="sent", claimed_at=old))
+        test_db.add(AppointmentReminder(appointment_id=2, appointment_time=NOW, status="sent", claimed_at=NOW))
+        test_db.commit()
+
+        _scheduler(session_factory, outbox).run_once(NOW)
+
+        test_db.expire_all()
+        assert [record.appointment_id for record in test_db.query(AppointmentReminder)] == [2]
+
+
+class TestSender:
+    """发送器加载测试"""
+
+    def test_load_file_sender(self):
+        assert isinstance(reminders.load_sender("file"), reminders.FileSender)
+
+    def test_load_custom_sender(self):
+        """测试 "模块:工厂函数" 形式的自定义发送器"""
+        sender = reminders.load_sender("reminders:FileSender")
+        assert isinstance(sender, reminders.FileSender)
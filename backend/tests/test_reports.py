@@ -0,0 +1,133 @@
+"""
+利用率报表测试
+测试 reports.py 的单遍汇总以及 /api/reports/utilization 接口
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+import reports
+from models import ArchivedAppointment
+from query_plan import capture_statements
+
+NOW = datetime(2024, 5, 20, 12)
+
+
+@pytest.fixture
+def may_appointments(create_doctor, create_appointment):
+    """两位内科医生、一位外科医生在 2024 年 5 月的预约，另有一条 6 月的预约"""
+    create_doctor(name="李医生", specialty="内科")
+    create_doctor(name="王医生", specialty="内科")
+    create_doctor(name="张医生", specialty="外科")
+    rows = [
+        ("李医生", datetime(2024, 5, 6, 9), "confirmed"),
+        ("李医生", datetime(2024, 5, 7, 9, 30), "pending"),   # 已过时间仍待确认：未到诊
+        ("李医生", datetime(2024, 5, 8, 14), "cancelled"),
+        ("李医生", datetime(2024, 5, 28, 9), "pending"),      # 尚未到时间
+        ("王医生", datetime(2024, 5, 9, 10), "confirmed"),
+        ("张医生", datetime(2024, 5, 10, 15), "confirmed"),
+        ("张医生", datetime(2024, 5, 11, 15), "confirmed"),
+        ("张医生", datetime(2024, 5, 12, 15), "cancelled"),
+        ("赵医生", datetime(2024, 5, 13, 8), "pending"),      # 不在医生表中
+        ("李医生", datetime(2024, 6, 1, 9), "confirmed"),
+    ]
+    for doctor_name, appointment_time, status in rows:
+        create_appointment(doctor_name=doctor_name, appointment_time=appointment_time, status=status)
+
+
+class TestUtilizationReport:
+    """报表汇总测试"""
+
+    def test_per_doctor_counts(self, test_db, may_appointments):
+        """测试每位医生的各状态数量、未到诊率和最繁忙小时"""
+        report = reports.utilization_report(test_db, "2024-05", now=NOW)
+        doctors = {row["name"]: row for row in report["doctors"]}
+
+        assert report["total_appointments"] == 9
+        assert doctors["李医生"] == {
+            "name": "李医生", "specialty": "内科",
+            "booked": 4, "confirmed": 1, "cancelled": 1, "pending": 2,
+            "no_shows": 1, "no_show_rate": 0.5, "busiest_hours": [9],
+        }
+        assert doctors["张医生"]["busiest_hours"] == [15]
+        assert doctors["赵医生"]["specialty"] == reports.UNKNOWN_SPECIALTY
+        assert report["doctors"][0]["name"] == "李医生"  # 按预约数降序
+
+    def test_per_specialty_totals(self, test_db, may_appointments):
+        """测试科室汇总等于该科室医生之和"""
+        report = reports.utilization_report(test_db, "2024-05", now=NOW)
+        specialties = {row["name"]: row for row in report["specialties"]}
+
+        assert specialties["内科"]["booked"] == 5
+        assert specialties["内科"]["confirmed"] == 2
+        assert specialties["外科"]["cancelled"] == 1
+        assert specialties[reports.UNKNOWN_SPECIALTY]["no_shows"] == 1
+        assert "specialty" not in specialties["内科"]
+
+    def test_single_pass_over_appointments(self, test_db, may_appointments):
+        """测试预约只按时间范围读取一次"""
+        with capture_statements(test_db.get_bind()) as statements:
+            reports.utilization_report(test_db, "2024-05", now=NOW)
+
+        appointment_reads = [sql for sql, _ in statements if "FROM appointments " in sql + " "]
+        assert len(appointment_reads) == 1
+        assert "appointment_time >=" in appointment_reads[0]
+
+    def test_includes_archived_appointments(self, test_db, create_doctor, create_appointment):
+        """测试统计月份早于归档边界时同时读取归档表"""
+        create_doctor(name="李医生", specialty="内科")
+        test_db.add(ArchivedAppointment(id=100, patient_name="老患者", doctor_name="李医生",
+                                        appointment_time=datetime(2024, 5, 2, 10), status="confirmed"))
+        test_db.commit()
+        create_appointment(doctor_name="李医生", appointment_time=datetime(2024, 5, 30, 10), status="confirmed")
+
+        report = reports.utilization_report(test_db, "2024-05", now=NOW)
+
+        assert report["doctors"][0]["booked"] == 2
+
+    def test_counter_memory_bounded_by_doctors(self):
+        """测试计数器大小固定，与预约数量无关"""
+        counter = reports.new_counter()
+        for day in range(1, 29):
+            reports.add_appointment(counter, datetime(2024, 2, day, 9), "confirmed", NOW)
+        assert len(counter) == len(reports.new_counter())
+        assert reports.summarize("李医生", counter)["booked"] == 28
+
+
+class TestUtilizationApi:
+    """报表接口测试"""
+
+    def test_endpoint(self, client, may_appointments):
+        """测试接口返回医生和科室汇总"""
+        response = client.get("/api/reports/utilization", params={"month": "2024-05"})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["month"] == "2024-05"
+        assert {row["name"] for row in data["specialties"]} == {"内科", "外科", reports.UNKNOWN_SPECIALTY}
+
+    def test_invalid_month(self, client):
+        """测试月份格式不正确返回 422"""
+        assert client.get("/api/reports/utilization", params={"month": "2024-5"}).status_code == 422
+        assert client.get("/api/reports/utilization").status_code == 422
+
+    def test_job_writes_same_report(self, test_db, may_appointments, tmp_path):
+        """测试 utilization_report 后台任务写出的JSON与接口一致"""
+        import jobs
+
+        class Context:
+            def session(self):
+                return test_db
+
+            def progress(self, done, total=None, message=None, force=False):
+                pass
+
+        out_path = tmp_path / "report.json"
+        with open(out_path, "w", encoding="utf-8") as out:
+            message = jobs.JOB_KINDS["utilization_report"].func(
+                Context(), reports.UtilizationReportParams(month="2024-05"), out)
+
+        data = json.loads(out_path.read_text(encoding="utf-8"))
+        assert data["total_appointments"] == 9
+        assert "9 条预约" in message
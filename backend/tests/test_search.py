@@ -0,0 +1,194 @@
+"""
+统一搜索测试
+测试 fulltext.py 的中文分词、倒排索引随写入更新、排序，以及 /api/search 接口
+"""
+import gc
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import fulltext
+from database import Base
+from query_plan import capture_statements
+from schemas import AppointmentCreate, AppointmentUpdate, DoctorCreate, PatientCreate, PatientUpdate
+
+
+def _patient(db, name="张三", medical_condition="感冒", phone=None):
+    return crud.create_patient(
+        db, PatientCreate(name=name, age=30, gender="男", phone=phone, medical_condition=medical_condition)
+    )
+
+
+def _appointment(db, reason, notes=None):
+    return crud.create_appointment(db, AppointmentCreate(
+        patient_name="张三", doctor_name="李医生",
+        appointment_time=datetime.now() + timedelta(days=1), reason=reason, notes=notes
+    ))
+
+
+def _search(client, q, **params):
+    response = client.get("/api/search", params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _hits(body):
+    return [(item["type"], item["id"]) for item in body["results"]]
+
+
+class TestTokenize:
+    """分词测试"""
+
+    def test_cjk_unigrams_and_bigrams(self):
+        assert fulltext.tokenize("感冒发烧") == ["感", "冒", "发", "烧", "感冒", "冒发", "发烧"]
+
+    def test_latin_digits_width_and_case(self):
+        assert fulltext.tokenize("ＣＴ检查 Zhang-San 138") == ["ct", "检", "查", "检查", "zhang", "san", "138"]
+
+    def test_query_uses_bigrams(self):
+        """测试查询中的多字词只用二元组，单字用单字"""
+        assert fulltext.query_terms("发烧 咳") == ["发烧", "咳"]
+        assert fulltext.query_terms("  ,, ") == []
+
+
+class TestSearchApi:
+    """搜索接口测试"""
+
+    def test_searches_all_types(self, client, test_db, sample_doctor_data):
+        patient = _patient(test_db, medical_condition="头痛发烧")
+        doctor = crud.create_doctor(test_db, DoctorCreate(**sample_doctor_data))
+        appointment = _appointment(test_db, "复诊", notes="发烧三天")
+        _patient(test_db, name="李四", medical_condition="骨折")
+
+        body = _search(client, "发烧")
+
+        assert sorted(_hits(body)) == [("appointment", appointment.id), ("patient", patient.id)]
+        assert body["pagination"]["total"] == 2
+        hit = next(item for item in body["results"] if item["type"] == "patient")
+        assert hit["title"] == "张三" and hit["subtitle"] == "头痛发烧"
+        assert _hits(_search(client, "内科")) == [("doctor", doctor.id)]
+
+    def test_bigrams_must_be_adjacent(self, client, test_db):
+        """测试“发烧”不匹配分开出现的“发”和“烧”"""
+        _patient(test_db, medical_condition="发热，烧伤")
+        assert _search(client, "发烧")["results"] == []
+        assert len(_search(client, "烧")["results"]) == 1
+
+    def test_all_terms_required(self, client, test_db):
+        both = _patient(test_db, medical_condition="发烧咳嗽")
+        _patient(test_db, name="李四", medical_condition="发烧")
+
+        assert _hits(_search(client, "发烧 咳嗽")) == [("patient", both.id)]
+
+    def test_name_ranks_above_condition(self, client, test_db):
+        """测试姓名命中的得分高于病情命中"""
+        by_condition = _patient(test_db, name="李四", medical_condition="王五介绍来的")
+        by_name = _patient(test_db, name="王五", medical_condition="感冒")
+
+        assert _hits(_search(client, "王五")) == [("patient", by_name.id), ("patient", by_condition.id)]
+
+    def test_phone(self, client, test_db):
+        patient = _patient(test_db, phone="13800138000")
+        assert _hits(_search(client, "13800138000")) == [("patient", patient.id)]
+
+    def test_type_filter_and_pagination(self, client, test_db):
+        ids = [_patient(test_db, name=f"患者{i}", medical_condition="高血压").id for i in range(5)]
+        _appointment(test_db, "高血压复查")
+
+        first = _search(client, "高血压", type="patient", limit=2)
+        second = _search(client, "高血压", type="patient", limit=2, page=2)
+
+        assert first["pagination"] == {"page": 1, "limit": 2, "total": 5, "totalPages": 3}
+        # 得分相同时按ID从新到旧
+        assert [item["id"] for item in first["results"] + second["results"]] == ids[::-1][:4]
+
+    def test_invalid_params(self, client):
+        assert client.get("/api/search", params={"q": ""}).status_code == 422
+        assert client.get("/api/search", params={"q": "a", "type": "nurse"}).status_code == 422
+
+
+class TestIncrementalUpdates:
+    """随 crud 写入更新测试"""
+
+    def test_writes_update_index_without_rebuild(self, client, test_db):
+        """测试创建、修改、删除后结果立即更新，且不重新读取数据表"""
+        _search(client, "感冒")
+        patient = _patient(test_db, medical_condition="感冒")
+        appointment = _appointment(test_db, "感冒复诊")
+        rebuilds = fulltext.get_stats()["rebuilds"]
+
+        with capture_statements(test_db.get_bind()) as statements:
+            assert len(_search(client, "感冒")["results"]) == 2
+        assert statements == []
+
+        crud.update_patient(test_db, patient.id, PatientUpdate(
+            name="张三", age=30, gender="男", medical_condition="骨折", version=patient.version
+        ))
+        crud.update_appointment(test_db, appointment.id, AppointmentUpdate(
+            patient_name="张三", doctor_name="李医生", appointment_time=appointment.appointment_time,
+            reason="骨折复查", version=appointment.version
+        ))
+        assert _search(client, "感冒")["results"] == []
+        assert len(_search(client, "骨折")["results"]) == 2
+
+        crud.delete_patient(test_db, patient.id)
+        crud.delete_appointment(test_db, appointment.id)
+        assert _search(client, "骨折")["results"] == []
+        assert fulltext.get_stats()["rebuilds"] == rebuilds
+
+    def test_external_writes_picked_up_after_invalidate(self, client, test_db, create_patient):
+        """测试绕过 crud 的写入在与数据库核对后可见，只补读变化的行，不重建"""
+        _search(client, "感冒")
+        index = fulltext.index_for(test_db, "patient")
+        rebuilds = index.rebuilds
+        patient = create_patient(medical_condition="感冒")
+        assert _search(client, "感冒")["results"] == []
+
+        index.invalidate()
+        assert _hits(_search(client, "感冒")) == [("patient", patient.id)]
+        assert index.rebuilds == rebuilds
+
+    def test_external_deletes_removed_without_rebuild(self, client, test_db, create_patient):
+        """测试其他进程删除（预约归档）后只按ID列核对移除，不重建"""
+        kept = create_patient(medical_condition="感冒")
+        removed = create_patient(medical_condition="感冒")
+        _search(client, "感冒")
+        index = fulltext.index_for(test_db, "patient")
+        rebuilds = index.rebuilds
+
+        test_db.delete(removed)
+        test_db.commit()
+        index.invalidate()
+
+        assert _hits(_search(client, "感冒")) == [("patient", kept.id)]
+        assert index.rebuilds == rebuilds
+        assert index.refreshes >= 1
+
+    def test_rebuild_count_survives_engine_collection(self):
+        """测试索引随引擎回收后累计的重建次数不减少"""
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        fulltext.search(db, "感冒")
+        rebuilds = fulltext.get_stats()["rebuilds"]
+        db.close()
+        del db, engine
+        gc.collect()
+
+        assert fulltext.get_stats()["rebuilds"] == rebuilds
+
+    def test_delete_during_search_does_not_fail(self, client, test_db, monkeypatch):
+        """测试命中的记录在取出标题前被并发删除时不报错"""
+        patient = _patient(test_db, medical_condition="感冒")
+        index = fulltext.index_for(test_db, "patient")
+        original = fulltext.TableIndex.search
+
+        def search_then_delete(self, db, terms, limit=fulltext.SEARCH_MAX_HITS):
+            result = original(self, db, terms, limit)
+            index.discard(patient.id)
+            return result
+
+        monkeypatch.setattr(fulltext.TableIndex, "search", search_then_delete)
+        assert _hits(_search(client, "感冒")) == [("patient", patient.id)]
@@ -0,0 +1,94 @@
+"""
+生产服务入口测试
+测试 serve.py 的参数解析、连接池分配和 uvicorn 配置
+"""
+import serve
+from database import engine_options
+
+
+class TestPoolSettings:
+    """连接池分配测试"""
+
+    def test_pool_split_across_workers(self):
+        """测试连接数按进程平均分配"""
+        pool_size, max_overflow = serve.derive_pool_settings(64, 4)
+
+        assert pool_size + max_overflow == 16
+        assert pool_size == 12
+        assert max_overflow == 4
+
+    def test_pool_never_below_one(self):
+        """测试进程数多于连接数时每个进程至少一个连接"""
+        pool_size, max_overflow = serve.derive_pool_settings(4, 16)
+
+        assert pool_size == 1
+        assert max_overflow == 0
+
+    def test_total_never_exceeds_budget(self):
+        """测试所有进程合计不超过连接上限"""
+        for workers in range(1, 33):
+            pool_size, max_overflow = serve.derive_pool_settings(100, workers)
+            assert (pool_size + max_overflow) * workers <= 100
+
+    def test_sqlite_engine_options_skip_pool_settings(self):
+        """测试 SQLite 不设置连接池参数"""
+        assert "pool_size" not in engine_options("sqlite:///./test.db")
+
+    def test_server_engine_options_include_pool_settings(self):
+        """测试 MySQL 等数据库使用连接池参数"""
+        options = engine_options("mysql+mysqlconnector://user:pw@localhost/db")
+
+        assert {"pool_size", "max_overflow", "pool_timeout", "pool_recycle"} <= set(options)
+
+
+class TestBuildConfig:
+    """uvicorn 配置测试"""
+
+    def test_production_config(self, monkeypatch):
+        """测试生产模式配置"""
+        monkeypatch.delenv("DB_POOL_SIZE", raising=False)
+        monkeypatch.delenv("DB_MAX_OVERFLOW", raising=False)
+        args = serve.build_parser().parse_args([
+            "--workers", "4", "--keep-alive", "10", "--backlog", "4096",
+            "--graceful-timeout", "20", "--db-max-connections", "40",
+        ])
+
+        config, env = serve.build_config(args)
+
+        assert config["workers"] == 4
+        assert config["host"] == "0.0.0.0"
+        assert config["timeout_keep_alive"] == 10
+        assert config["backlog"] == 4096
+        assert config["timeout_graceful_shutdown"] == 20
+        assert config["loop"] in ("uvloop", "asyncio")
+        assert config["http"] in ("httptools", "h11")
+        assert "reload" not in config
+        assert env == {"DB_POOL_SIZE": "7", "DB_MAX_OVERFLOW": "3"}
+
+    def test_reload_mode_is_single_process(self):
+        """测试开发模式单进程、仅本机访问"""
+        args = serve.build_parser().parse_args(["--reload"])
+
+        config, _ = serve.build_config(args)
+
+        assert config["reload"] is True
+        assert "workers" not in config
+        assert config["host"] == "127.0.0.1"
+
+    def test_explicit_pool_env_wins(self, monkeypatch):
+        """测试显式配置的连接池参数优先"""
+        monkeypatch.setenv("DB_POOL_SIZE", "3")
+        args = serve.build_parser().parse_args(["--workers", "2"])
+
+        _, env = serve.build_config(args)
+
+        assert env["DB_POOL_SIZE"] == "3"
+
+    def test_default_workers_from_env(self, monkeypatch):
+        """测试 WEB_CONCURRENCY 指定默认进程数"""
+        monkeypatch.setenv("WEB_CONCURRENCY", "3")
+        args = serve.build_parser().parse_args([])
+
+        config, _ = serve.build_config(args)
+
+        assert config["workers"] == 3
@@ -0,0 +1,208 @@
+"""
+现场候诊队列测试
+测试 waiting_list.py 的取号、叫号、过号、取消、崩溃恢复，以及 /api/waiting-list 接口
+"""
+from urllib.parse import quote
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import waiting_list
+from database import Base
+from models import Appointment, WaitingListEntry
+
+DOCTOR = "李医生"
+URL = f"/api/waiting-list/{quote(DOCTOR)}"
+
+
+def _join(client, patient_name, reason=None):
+    response = client.post(URL, json={"patient_name": patient_name, "reason": reason})
+    assert response.status_code == 200, response.text
+    return response.json()["data"]
+
+
+def _waiting_names(client):
+    return [entry["patient_name"] for entry in client.get(URL).json()["waiting"]]
+
+
+class TestWaitingListApi:
+    """候诊队列接口测试"""
+
+    def test_enqueue_assigns_numbers(self, client):
+        """测试取号分配递增的排队号并返回前面等待的人数"""
+        first = _join(client, "张三")
+        second = _join(client, "李四")
+
+        assert (first["entry"]["number"], first["ahead"]) == (1, 0)
+        assert (second["entry"]["number"], second["ahead"]) == (2, 1)
+        data = client.get(URL).json()
+        assert data["count"] == 2
+        assert _waiting_names(client) == ["张三", "李四"]
+
+    def test_call_next_creates_appointment_through_crud(self, client, test_db, monkeypatch):
+        """测试叫号通过 crud.create_appointment 生成已确认的预约"""
+        calls = []
+        original = crud.create_appointment
+
+        def counting(db, appointment):
+            calls.append(appointment.patient_name)
+            return original(db, appointment)
+
+        monkeypatch.setattr(crud, "create_appointment", counting)
+        _join(client, "张三", reason="发烧")
+        _join(client, "李四")
+
+        response = client.post(f"{URL}/call-next")
+
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert calls == ["张三"]
+        assert data["entry"]["status"] == "called"
+        assert data["appointment"]["status"] == "confirmed"
+        assert data["appointment"]["reason"] == "发烧"
+        assert data["entry"]["appointment_id"] == data["appointment"]["id"]
+        assert test_db.query(Appointment).count() == 1
+        assert _waiting_names(client) == ["李四"]
+
+    def test_call_next_on_empty_queue(self, client):
+        """测试队列为空时叫号返回 404"""
+        assert client.post(f"{URL}/call-next").status_code == 404
+
+    def test_skip_moves_to_end(self, client):
+        """测试过号的患者移到队尾"""
+        for name in ("张三", "李四", "王五"):
+            _join(client, name)
+
+        response = client.post(f"{URL}/1/skip")
+
+        assert response.json()["data"]["skips"] == 1
+        assert _waiting_names(client) == ["李四", "王五", "张三"]
+
+    def test_cancel(self, client):
+        """测试取消排号后不再叫到"""
+        _join(client, "张三")
+        _join(client, "李四")
+
+        assert client.delete(f"{URL}/1").status_code == 200
+        assert client.delete(f"{URL}/1").status_code == 404
+        assert client.post(f"{URL}/9/skip").status_code == 404
+        assert client.post(f"{URL}/call-next").json()["data"]["entry"]["patient_name"] == "李四"
+
+    def test_queues_are_per_doctor(self, client):
+        """测试不同医生的队列互不影响"""
+        _join(client, "张三")
+        other = client.post(f"/api/waiting-list/{quote('王医生')}", json={"patient_name": "李四"}).json()["data"]
+
+        assert other["entry"]["number"] == 1
+        assert _waiting_names(client) == ["张三"]
+
+
+class TestRecovery:
+    """持久化与恢复测试"""
+
+    def test_restart_restores_order_and_numbers(self, client, test_db):
+        """测试进程重启后从表中恢复队列顺序和下一个排队号"""
+        for name in ("张三", "李四", "王五"):
+            _join(client, name)
+        client.post(f"{URL}/1/skip")
+        client.delete(f"{URL}/2")
+
+        waiting_list._queues.clear()  # 模拟进程重启
+
+        assert _waiting_names(client) == ["王五", "张三"]
+        assert _join(client, "赵六")["entry"]["number"] == 4
+
+    def test_change_by_another_process_triggers_reload(self, client, test_db):
+        """测试其他进程已叫走队首时，重新加载后叫下一位"""
+        _join(client, "张三")
+        _join(client, "李四")
+        test_db.query(WaitingListEntry).filter(WaitingListEntry.number == 1).update({"status": "called"})
+        test_db.commit()
+
+        response = client.post(f"{URL}/call-next")
+
+        assert response.json()["data"]["entry"]["patient_name"] == "李四"
+        assert waiting_list.get_stats()["reloads"] >= 1
+
+    def test_skip_by_another_process_detected(self, client, test_db):
+        """测试其他进程把队首过号（只改 position，不改状态）后，叫号叫的是新的队首"""
+        _join(client, "张三")
+        _join(client, "李四")
+        test_db.query(WaitingListEntry).filter(WaitingListEntry.number == 1).update(
+            {"position": 3, "skips": 1}
+        )
+        test_db.commit()
+
+        response = client.post(f"{URL}/call-next")
+
+        assert response.json()["data"]["entry"]["patient_name"] == "李四"
+        assert _waiting_names(client) == ["张三"]
+
+    def test_read_reflects_other_processes(self, client, test_db):
+        """测试查看队列读表：其他进程的取号、过号、叫号立即可见"""
+        _join(client, "张三")
+        _join(client, "李四")
+        test_db.query(WaitingListEntry).filter(WaitingListEntry.number == 1).update({"position": 3})
+        waiting_list.enqueue(test_db, DOCTOR, "王五")
+        test_db.query(WaitingListEntry).filter(WaitingListEntry.number == 2).update({"status": "called"})
+        test_db.commit()
+
+        assert _waiting_names(client) == ["张三", "王五"]
+
+    def test_entries_from_another_worker_found(self, tmp_path):
+        """测试两个进程（各自的内存队列，同一个数据库）：另一个进程取的号可以叫号、过号、取消"""
+        path = tmp_path / "hospital.db"
+        engines = [create_engine(f"sqlite:///{path}") for _ in range(2)]
+        Base.metadata.create_all(bind=engines[0])
+        worker_a, worker_b = (sessionmaker(bind=engine)() for engine in engines)
+        try:
+            waiting_list.queue_for(worker_b, DOCTOR)  # B 的内存队列在取号前加载，为空
+            for name in ("张三", "李四", "王五"):
+                waiting_list.enqueue(worker_a, DOCTOR, name)
+
+            entry, _ = waiting_list.call_next(worker_b, DOCTOR)
+            assert entry.patient_name == "张三"
+            assert waiting_list.skip(worker_b, DOCTOR, 2).patient_name == "李四"
+            assert waiting_list.cancel(worker_b, DOCTOR, 3).patient_name == "王五"
+            assert waiting_list.cancel(worker_b, DOCTOR, 9) is None
+        finally:
+            worker_a.close()
+            worker_b.close()
+            for engine in engines:
+                engine.dispose()
+
+    def test_failed_appointment_returns_patient_to_front(self, client, test_db, monkeypatch):
+        """测试预约创建失败时患者回到队首"""
+        _join(client, "张三")
+        _join(client, "李四")
+
+        def failing(db, appointment):
+            raise RuntimeError("数据库错误")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(crud, "create_appointment", failing)
+            assert client.post(f"{URL}/call-next").status_code == 400
+
+        assert _waiting_names(client) == ["张三", "李四"]
+        entry = test_db.query(WaitingListEntry).filter(WaitingListEntry.number == 1).one()
+        assert entry.status == "waiting"
+
+
+class TestDoctorQueue:
+    """内存队列测试"""
+
+    @pytest.mark.parametrize("count", [1, 50])
+    def test_operations_touch_only_one_entry(self, test_db, count):
+        """测试叫号、过号、取消各只执行一条写语句"""
+        from query_plan import capture_statements
+
+        for i in range(count + 2):
+            waiting_list.enqueue(test_db, DOCTOR, f"患者{i}")
+
+        with capture_statements(test_db.get_bind()) as statements:
+            waiting_list.skip(test_db, DOCTOR, 1)
+            waiting_list.cancel(test_db, DOCTOR, 2)
+        writes = [sql for sql, _ in statements if sql.startswith("UPDATE")]
+        assert len(writes) == 2
@@ -0,0 +1,42 @@
+"""
+乐观锁的 HTTP 约定
+
+详情接口和更新接口在 ETag 响应头中返回记录的版本号（如 "3"），
+客户端更新时通过 If-Match 请求头（或请求体中的 version）带回读取时的版本号。
+记录已被他人修改时更新接口返回 409，客户端应重新读取后再提交。
+"""
+from typing import Optional
+
+from fastapi import HTTPException, Response
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def set_etag(response: Response, instance):
+    response.headers["ETag"] = etag(instance.version)
+
+
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    """解析 If-Match 请求头，返回期望的版本号；未提供或为 * 时返回 None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value == "*":
+        return None
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value.isdigit():
+        raise HTTPException(status_code=400, detail="If-Match 必须是记录的版本号，如 \"3\"")
+    return int(value)
+
+
+def conflict(exc) -> HTTPException:
+    """把 crud.VersionConflictError 转换为 409 响应"""
+    return HTTPException(
+        status_code=409,
+        detail=f"记录已被其他用户修改（当前版本 {exc.current_version}），请刷新后重试",
+        headers={"ETag": etag(exc.current_version)},
+    )
@@ -0,0 +1,280 @@
+"""
+现场候诊队列
+
+现场挂号的患者原来在系统外排队，医生叫号时才集中补录预约。这里按医生、按天维护候诊队列：
+
+- 取号（enqueue）：分配当天递增的排队号，加到队尾，O(1)
+- 叫号（call_next）：取出队首，通过 crud.create_appointment 生成一条已确认的预约，O(1)
+- 过号（skip）：患者不在场，移到队尾，O(1)
+- 取消（cancel）：按排队号移除，O(1)
+
+队列在进程内用 OrderedDict（排队号 → 条目，按叫号顺序排列）维护，每次变更同时写入
+waiting_list 表（单条 INSERT/UPDATE）。进程重启后第一次访问某位医生当天的队列时从表中恢复。
+
+多进程部署时各进程都有自己的内存队列：写入表时带上条件（排队号唯一、状态仍为 waiting、
+叫号顺序 position 未变），条件不满足说明其他进程已经改过这个队列（叫号、取消、过号），
+重新从表中加载后重试；内存队列为空或找不到排队号时，可能是其他进程取的号，也先重新加载再判断。
+查看队列（waiting）直接按索引读表，不使用可能过时的内存队列。
+"""
+import threading
+import weakref
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import crud
+from models import WaitingListEntry
+from schemas import AppointmentCreate, AppointmentStatusEnum
+
+WAITING = "waiting"
+CALLED = "called"
+CANCELLED = "cancelled"
+
+MAX_RETRIES = 3
+
+_stats = {"loads": 0, "enqueued": 0, "called": 0, "skipped": 0, "cancelled": 0, "reloads": 0}
+
+
+class QueueEntry:
+    """候诊条目的内存快照"""
+    __slots__ = ("id", "doctor_name", "queue_date", "number", "patient_name", "reason", "status",
+                 "position", "skips", "appointment_id", "created_at", "called_at")
+
+    def __init__(self, row: WaitingListEntry):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+
+class DoctorQueue:
+    """单个医生单天的候诊队列"""
+
+    def __init__(self, doctor_name: str, queue_date: date):
+        self.doctor_name = doctor_name
+        self.queue_date = queue_date
+        self.lock = threading.Lock()
+        self.waiting: "OrderedDict[int, QueueEntry]" = OrderedDict()
+        self.next_number = 1
+        self.next_position = 1
+
+    def load(self, db: Session):
+        """从表中恢复队列"""
+        rows = (
+            db.query(WaitingListEntry)
+            .filter(WaitingListEntry.doctor_name == self.doctor_name, WaitingListEntry.queue_date == self.queue_date)
+            .all()
+        )
+        self.waiting.clear()
+        self.next_number = max((row.number for row in rows), default=0) + 1
+        self.next_position = max((row.position for row in rows), default=0) + 1
+        for row in sorted((row for row in rows if row.status == WAITING), key=lambda row: (row.position, row.number)):
+            self.waiting[row.number] = QueueEntry(row)
+        _stats["loads"] += 1
+
+    def reload(self, db: Session):
+        db.rollback()
+        db.expire_all()
+        self.load(db)
+        _stats["reloads"] += 1
+
+    def entries(self) -> List[QueueEntry]:
+        return list(self.waiting.values())
+
+
+# 每个数据库一套队列：{(医生, 日期): DoctorQueue}
+_queues: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_queues_lock = threading.Lock()
+
+
+def queue_for(db: Session, doctor_name: str, queue_date: Optional[date] = None) -> DoctorQueue:
+    """获取医生某天（默认今天）的队列，首次访问时从表中恢复"""
+    queue_date = queue_date or date.today()
+    bind = db.get_bind()
+    with _queues_lock:
+        queues: Dict[Tuple[str, date], DoctorQueue] = _queues.setdefault(bind, {})
+        queue = queues.get((doctor_name, queue_date))
+        if queue is None:
+            # 顺带丢弃以前日期的队列
+            for key in [key for key in queues if key[1] < queue_date]:
+                del queues[key]
+            queue = queues[(doctor_name, queue_date)] = DoctorQueue(doctor_name, queue_date)
+            with queue.lock:
+                queue.load(db)
+    return queue
+
+
+def waiting(db: Session, doctor_name: str, queue_date: Optional[date] = None) -> List[QueueEntry]:
+    """当前的候诊队列（按叫号顺序）；从表中读取，多进程部署时各进程看到同一个队列"""
+    rows = (
+        db.query(WaitingListEntry)
+        .filter(
+            WaitingListEntry.doctor_name == doctor_name,
+            WaitingListEntry.queue_date == (queue_date or date.today()),
+            WaitingListEntry.status == WAITING,
+        )
+        .order_by(WaitingListEntry.position, WaitingListEntry.number)
+        .all()
+    )
+    return [QueueEntry(row) for row in rows]
+
+
+def _next_position(db: Session, queue: DoctorQueue) -> int:
+    """队尾的叫号顺序：其他进程可能已分配过更大的 position，取表中最大值之后"""
+    last_position = db.query(func.max(WaitingListEntry.position)).filter(
+        WaitingListEntry.doctor_name == queue.doctor_name, WaitingListEntry.queue_date == queue.queue_date
+    ).scalar() or 0
+    return max(queue.next_position, last_position + 1)
+
+
+def enqueue(db: Session, doctor_name: str, patient_name: str, reason: Optional[str] = None) -> Tuple[QueueEntry, int]:
+    """取号，返回 (条目, 前面等待的人数)"""
+    queue = queue_for(db, doctor_name)
+    with queue.lock:
+        for _ in range(MAX_RETRIES):
+            row = WaitingListEntry(
+                doctor_name=doctor_name, queue_date=queue.queue_date, number=queue.next_number,
+                patient_name=patient_name, reason=reason, status=WAITING,
+                position=_next_position(db, queue), skips=0, created_at=datetime.now(),
+            )
+            db.add(row)
+            try:
+                db.commit()
+            except IntegrityError:
+                # 排队号已被其他进程占用
+                queue.reload(db)
+                continue
+            db.refresh(row)
+            entry = QueueEntry(row)
+            db.expunge(row)
+            ahead = len(queue.waiting)
+            queue.waiting[entry.number] = entry
+            queue.next_number += 1
+            queue.next_position = entry.position + 1
+            _stats["enqueued"] += 1
+            return entry, ahead
+    raise RuntimeError("取号冲突，请重试")
+
+
+def _find(db: Session, queue: DoctorQueue, number: Optional[int] = None) -> Optional[QueueEntry]:
+    """队首（number 为空时）或指定排队号的条目；内存中没有时重新加载一次再找（可能是其他进程取的号）"""
+    for attempt in range(2):
+        if number is None:
+            entry = next(iter(queue.waiting.values()), None)
+        else:
+            entry = queue.waiting.get(number)
+        if entry is not None or attempt:
+            return entry
+        queue.reload(db)
+
+
+def _transition(db: Session, entry: QueueEntry, **values) -> bool:
+    """条件更新：条目仍在等待且叫号顺序未被其他进程改动（过号）时才修改"""
+    result = db.execute(
+        update(WaitingListEntry)
+        .where(
+            WaitingListEntry.id == entry.id,
+            WaitingListEntry.status == WAITING,
+            WaitingListEntry.position == entry.position,
+        )
+        .values(**values)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def call_next(db: Session, doctor_name: str):
+    """叫号：队首患者生成一条已确认的预约，返回 (条目, 预约)；队列为空返回 None"""
+    queue = queue_for(db, doctor_name)
+    with queue.lock:
+        for _ in range(MAX_RETRIES):
+            entry = _find(db, queue)
+            if entry is None:
+                return None
+            number = entry.number
+            called_at = datetime.now()
+            if not _transition(db, entry, status=CALLED, called_at=called_at):
+                queue.reload(db)
+                continue
+            del queue.waiting[number]
+            break
+        else:
+            raise RuntimeError("叫号冲突，请重试")
+
+    # 现场就诊的预约时间就是叫号时间，不经过“必须是未来时间”的校验
+    appointment = AppointmentCreate.model_construct(
+        patient_name=entry.patient_name,
+        doctor_name=doctor_name,
+        appointment_time=called_at,
+        status=AppointmentStatusEnum.confirmed,
+        reason=entry.reason,
+        notes=f"现场挂号 {entry.number} 号",
+    )
+    try:
+        db_appointment = crud.create_appointment(db, appointment)
+    except Exception:
+        # 预约创建失败：患者回到队首
+        db.rollback()
+        db.execute(
+            update(WaitingListEntry).where(WaitingListEntry.id == entry.id)
+            .values(status=WAITING, called_at=None)
+        )
+        db.commit()
+        with queue.lock:
+            queue.waiting[entry.number] = entry
+            queue.waiting.move_to_end(entry.number, last=False)
+        raise
+
+    db.execute(
+        update(WaitingListEntry).where(WaitingListEntry.id == entry.id).values(appointment_id=db_appointment.id)
+    )
+    db.commit()
+    entry.status, entry.called_at, entry.appointment_id = CALLED, called_at, db_appointment.id
+    _stats["called"] += 1
+    return entry, db_appointment
+
+
+def skip(db: Session, doctor_name: str, number: int) -> Optional[QueueEntry]:
+    """过号：移到队尾；不在队列中返回 None"""
+    queue = queue_for(db, doctor_name)
+    with queue.lock:
+        for _ in range(MAX_RETRIES):
+            entry = _find(db, queue, number)
+            if entry is None:
+                return None
+            position = _next_position(db, queue)
+            if not _transition(db, entry, position=position, skips=entry.skips + 1):
+                queue.reload(db)
+                continue
+            entry.position = position
+            entry.skips += 1
+            queue.next_position = position + 1
+            queue.waiting.move_to_end(number)
+            _stats["skipped"] += 1
+            return entry
+    raise RuntimeError("过号冲突，请重试")
+
+
+def cancel(db: Session, doctor_name: str, number: int) -> Optional[QueueEntry]:
+    """取消排号；不在队列中返回 None"""
+    queue = queue_for(db, doctor_name)
+    with queue.lock:
+        for _ in range(MAX_RETRIES):
+            entry = _find(db, queue, number)
+            if entry is None:
+                return None
+            if not _transition(db, entry, status=CANCELLED):
+                queue.reload(db)
+                continue
+            del queue.waiting[number]
+            entry.status = CANCELLED
+            _stats["cancelled"] += 1
+            return entry
+    raise RuntimeError("取消冲突，请重试")
+
+
+def get_stats() -> Dict:
+    queues = sum(len(queues) for queues in list(_queues.values()))
+    return {"queues": queues, **_stats}